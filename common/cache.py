@@ -0,0 +1,101 @@
+"""
+Versions of the data of the models, kept in the cache.
+The version of a tracked model changes on every write (post_save, post_delete and m2m_changed signals), so the
+cached values that depend on some models can be invalidated exactly, by including the versions of these models
+in their cache keys. Writes that do not send signals (bulk_create, update etc.) should bump the versions manually.
+The models are tracked explicitly (by the apps, see track_model_versions), since a delete signal receiver for
+all the models would disable the fast deletes everywhere. The models that are deleted in bulk can be tracked
+without a delete receiver, their versions are then bumped by the code that deletes them and by the deletes of
+the tracked models they cascade from.
+"""
+from time import time_ns
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import CASCADE
+from django.db.models.signals import post_save, post_delete, m2m_changed
+
+tracked_models = []
+
+
+def model_version_key(model):
+    return 'model-version:{}'.format(model._meta.label_lower)
+
+
+def get_model_versions(models):
+    """Gets the versions of the given models, initializing the missing ones"""
+    keys = [model_version_key(model) for model in models]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            # a new version is unique, so an evicted version never matches the values cached with an older one
+            cache.add(key, time_ns(), timeout=None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def bump_model_version(model):
+    key = model_version_key(model)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, time_ns(), timeout=None)
+
+
+def get_query_models(sql):
+    """Gets the tracked models whose tables are used in an sql query"""
+    return [model for model in tracked_models if '"{}"'.format(model._meta.db_table) in sql]
+
+
+def bump_model_version_on_commit(model):
+    """
+    Bumps the version of a model now and again when the transaction is committed, since the values that are
+    cached in between may have been computed from the data before the commit.
+    """
+    bump_model_version(model)
+    transaction.on_commit(lambda: bump_model_version(model))
+
+
+def get_cascade_models(model):
+    """Gets the tracked models whose rows are deleted by a cascade when rows of a model are deleted"""
+    return list(dict.fromkeys(
+        field.related_model for field in model._meta.get_fields(include_hidden=True)
+        if field.auto_created and not field.concrete and (field.one_to_many or field.one_to_one)
+        and field.on_delete is CASCADE and field.related_model in tracked_models))
+
+
+def bump_deleted_model_versions(model):
+    """Bumps the versions of a model whose rows are deleted and of the models that the deletes cascade to"""
+    for deleted_model in [model] + get_cascade_models(model):
+        bump_model_version_on_commit(deleted_model)
+
+
+def bump_version_on_write(sender, **kwargs):
+    bump_model_version_on_commit(sender)
+
+
+def bump_version_on_delete(sender, **kwargs):
+    bump_deleted_model_versions(sender)
+
+
+def bump_version_on_m2m_change(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        bump_model_version_on_commit(sender)
+
+
+def track_model_versions(*models, deletes=True):
+    """
+    Bumps the versions of the given models (and of the through models of their m2m fields) on every write.
+    Without deletes, the models have no delete receiver, so that QuerySet.delete() is a fast delete (one query
+    instead of collecting and signaling the rows) for them and for the cascades to them. The through models
+    never have one, their rows are deleted by the m2m managers (which send m2m_changed) or by cascades.
+    """
+    for model in models:
+        through_models = [field.remote_field.through for field in model._meta.local_many_to_many]
+        for tracked_model in [model] + through_models:
+            if tracked_model in tracked_models:
+                continue
+            tracked_models.append(tracked_model)
+            post_save.connect(bump_version_on_write, sender=tracked_model)
+            if deletes and tracked_model is model:
+                post_delete.connect(bump_version_on_delete, sender=tracked_model)
+            m2m_changed.connect(bump_version_on_m2m_change, sender=tracked_model)
@@ -0,0 +1,55 @@
+"""
+Database helpers for the writes that the ORM does not support (in this version of django).
+"""
+from django.db import connections
+
+
+def insert_or_increment(model, rows, unique_fields, increment_fields, using='default'):
+    """
+    Inserts rows (dicts with the values of the unique and the increment fields by field name, the ids for the
+    foreign keys) into the table of a model, or adds their increment fields to the existing rows with the same
+    unique fields, with INSERT ... ON CONFLICT DO UPDATE queries (postgres and sqlite, one query per batch).
+    The unique fields should have a unique constraint. Concurrent increments of the same row are safe, since
+    they are applied by the database, but the rows are locked in their order, so concurrent upserts of the same
+    rows should sort them the same way (e.g. by their unique fields) not to deadlock.
+    """
+    if not rows:
+        return
+    connection = connections[using]
+    quote_name = connection.ops.quote_name
+    fields = [model._meta.get_field(name) for name in tuple(unique_fields) + tuple(increment_fields)]
+    table = quote_name(model._meta.db_table)
+    columns = [quote_name(field.column) for field in fields]
+    unique_columns = columns[:len(unique_fields)]
+    increment_columns = columns[len(unique_fields):]
+    updates = ', '.join('{column} = {table}.{column} + EXCLUDED.{column}'.format(column=column, table=table)
+                        for column in increment_columns)
+    batch_size = connection.ops.bulk_batch_size(fields, rows)
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            values = ', '.join(['({})'.format(', '.join(['%s'] * len(fields)))] * len(batch))
+            cursor.execute('INSERT INTO {} ({}) VALUES {} ON CONFLICT ({}) DO UPDATE SET {}'.format(
+                table, ', '.join(columns), values, ', '.join(unique_columns), updates),
+                [field.get_db_prep_value(row[field.name], connection) for row in batch for field in fields])
+
+
+def insert_or_increment_from_query(model, queryset, unique_fields, increment_fields, using='default'):
+    """
+    Like insert_or_increment, for the rows of a values() queryset (whose names are field names of the model),
+    with one INSERT ... SELECT ... ON CONFLICT DO UPDATE query, so the rows are never loaded. The queryset should
+    have a WHERE clause on sqlite (it is ambiguous otherwise).
+    """
+    connection = connections[using]
+    quote_name = connection.ops.quote_name
+    table = quote_name(model._meta.db_table)
+    # the values come first in the select list, then the annotations
+    names = list(queryset.query.values_select) + list(queryset.query.annotation_select)
+    columns = [quote_name(model._meta.get_field(name).column) for name in names]
+    unique_columns = [quote_name(model._meta.get_field(name).column) for name in unique_fields]
+    updates = ', '.join('{column} = {table}.{column} + EXCLUDED.{column}'.format(
+        column=quote_name(model._meta.get_field(name).column), table=table) for name in increment_fields)
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute('INSERT INTO {} ({}) {} ON CONFLICT ({}) DO UPDATE SET {}'.format(
+            table, ', '.join(columns), sql, ', '.join(unique_columns), updates), params)
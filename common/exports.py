@@ -0,0 +1,62 @@
+"""
+Streaming exports of rows (dicts) as NDJSON or CSV.
+The rows are encoded lazily and sent in chunks of lines, so an export of any size is never held in memory.
+"""
+import csv
+import json
+from datetime import datetime
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+class Echo:
+    """File-like object that returns what is written to it, so that the csv writer returns the encoded lines"""
+
+    def write(self, value):
+        return value
+
+
+def csv_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, (list, tuple)):
+        return ','.join(str(v) for v in value)
+    return value
+
+
+def iter_ndjson(rows, columns):
+    for row in rows:
+        yield json.dumps(row, cls=DjangoJSONEncoder, separators=(',', ':')) + '\n'
+
+
+def iter_csv(rows, columns):
+    writer = csv.writer(Echo())
+    yield writer.writerow(columns)
+    for row in rows:
+        yield writer.writerow([csv_value(row[column]) for column in columns])
+
+
+def iter_chunks(lines, lines_per_chunk):
+    """Joins the lines in chunks, since sending every line separately is slow"""
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) >= lines_per_chunk:
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield ''.join(chunk)
+
+
+def streaming_export_response(rows, columns, export_format, filename, lines_per_chunk=500):
+    """Returns a response that streams the rows in the given format (one of EXPORT_FORMATS)"""
+    encode = {'ndjson': iter_ndjson, 'csv': iter_csv}[export_format]
+    response = StreamingHttpResponse(iter_chunks(encode(rows, columns), lines_per_chunk),
+                                     content_type=EXPORT_FORMATS[export_format])
+    response['Content-Disposition'] = 'attachment; filename="{}.{}"'.format(filename, export_format)
+    return response
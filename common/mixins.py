@@ -0,0 +1,243 @@
+from hashlib import sha1
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response, quote_etag
+from django.utils.http import http_date
+from rest_framework import status
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+from .cache import get_model_versions
+from .exports import EXPORT_FORMATS, streaming_export_response
+from .serializers import CompiledReadSerializer, CompileError
+
+# the names of the views that use the response cache, in order to report their hits and misses
+response_cache_names = set()
+
+
+def response_cache_counter_key(name, counter):
+    return 'response-cache:{}:{}'.format(name, counter)
+
+
+def increment_response_cache_counter(name, counter):
+    key = response_cache_counter_key(name, counter)
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, timeout=None):
+            cache.incr(key)
+
+
+def get_response_cache_stats():
+    """Gets the hits and misses of the response cache of every view"""
+    keys = [response_cache_counter_key(name, counter) for name in response_cache_names
+            for counter in ('hits', 'misses')]
+    counters = cache.get_many(keys)
+    return {name: {counter: counters.get(response_cache_counter_key(name, counter), 0)
+                   for counter in ('hits', 'misses')}
+            for name in sorted(response_cache_names)}
+
+
+class CachedResponseMixin:
+    """
+    Caches the successful responses of the list and retrieve actions of a viewset.
+    The cache key is made of the action, the url kwargs, the normalized query parameters, the host and the
+    accepted media type of the request, and the versions of the response_cache_models. These are the models
+    whose data are in the responses, so any write to them (that bumps their version) invalidates the cached
+    responses exactly. The responses have an X-Cache header with HIT or MISS.
+    """
+    response_cache_name = None
+    response_cache_models = ()
+    response_cache_actions = ('list', 'retrieve')
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if cls.response_cache_name is not None:
+            response_cache_names.add(cls.response_cache_name)
+
+    def list(self, request, *args, **kwargs):
+        return self.get_cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_cached_response(super().retrieve, request, *args, **kwargs)
+
+    def response_is_cacheable(self, request):
+        return self.action in self.response_cache_actions
+
+    def get_response_cache_key(self, request):
+        query_params = sorted((key, request.query_params.getlist(key)) for key in request.query_params)
+        versions = get_model_versions(self.response_cache_models)
+        signature = repr((self.action, sorted(self.kwargs.items()), query_params, request.scheme,
+                          request.get_host(), request.accepted_media_type, versions))
+        return 'response-cache:{}:{}'.format(self.response_cache_name, sha1(signature.encode('utf-8')).hexdigest())
+
+    def get_cached_response_headers(self, request):
+        """Returns the headers that are cached with the data of a response (e.g. its validators)"""
+        return {}
+
+    def get_cached_response(self, get_response, request, *args, **kwargs):
+        if not self.response_is_cacheable(request):
+            return get_response(request, *args, **kwargs)
+
+        key = self.get_response_cache_key(request)
+        cached = cache.get(key)
+        if cached is not None:
+            increment_response_cache_counter(self.response_cache_name, 'hits')
+            data, headers = cached
+            return Response(data, headers=dict(headers, **{'X-Cache': 'HIT'}))
+
+        increment_response_cache_counter(self.response_cache_name, 'misses')
+        headers = self.get_cached_response_headers(request)
+        response = get_response(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            for header, value in headers.items():
+                response[header] = value
+            cache.set(key, (response.data, headers), timeout=settings.MOVIE_STORE_RESPONSE_CACHE['TIMEOUT'])
+        response['X-Cache'] = 'MISS'
+        return response
+
+
+class ConditionalGetMixin:
+    """
+    Supports conditional GET requests (If-None-Match / If-Modified-Since) on the list and retrieve actions of
+    a viewset, answering with 304 Not Modified when the client's copy is fresh.
+    The freshness is computed from the last_modified_field of the objects, without serializing them: the
+    modification time of the object for retrieve, and the latest modification time and the number of the
+    filtered objects for list (so that deletions are detected too). The ETag also depends on the query
+    parameters and the accepted media type, since they change the response. The lists only have an ETag, since
+    a Last-Modified time cannot tell deletions.
+    The freshness is only queried for the conditional requests and for the responses that are not served from
+    the response cache, which keeps the validators with the responses it caches (see CachedResponseMixin).
+    """
+    last_modified_field = 'modified'
+    conditional_get_actions = ('list', 'retrieve')
+    validators = None
+
+    def list(self, request, *args, **kwargs):
+        return self.get_conditional_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_conditional_response(super().retrieve, request, *args, **kwargs)
+
+    def supports_conditional_get(self, request):
+        return self.action in self.conditional_get_actions
+
+    @staticmethod
+    def is_conditional_request(request):
+        return 'HTTP_IF_NONE_MATCH' in request.META or 'HTTP_IF_MODIFIED_SINCE' in request.META
+
+    def get_freshness(self, request):
+        """Returns the latest modification time of the requested objects and a summary of their state"""
+        queryset = self.filter_queryset(self.get_queryset())
+        if self.action == 'retrieve':
+            lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+            last_modified = queryset.prefetch_related(None)\
+                .filter(**{self.lookup_field: self.kwargs[lookup_url_kwarg]})\
+                .values_list(self.last_modified_field, flat=True).first()
+            return last_modified, last_modified is not None
+        state = queryset.aggregate(last_modified=Max(self.last_modified_field), count=Count('pk'))
+        return state['last_modified'], state['count']
+
+    def get_validators(self, request):
+        """Returns the ETag and the Last-Modified timestamp (None for lists) of the requested objects"""
+        if self.validators is None:
+            last_modified, state = self.get_freshness(request)
+            query_params = sorted((key, request.query_params.getlist(key)) for key in request.query_params)
+            signature = repr((self.action, sorted(self.kwargs.items()), query_params, request.accepted_media_type,
+                              last_modified and last_modified.isoformat(), state))
+            etag = quote_etag(sha1(signature.encode('utf-8')).hexdigest())
+            timestamp = int(last_modified.timestamp()) \
+                if self.action != 'list' and last_modified is not None else None
+            self.validators = etag, timestamp
+        return self.validators
+
+    def get_validator_headers(self, request):
+        etag, timestamp = self.get_validators(request)
+        headers = {'ETag': etag}
+        if timestamp is not None:
+            headers['Last-Modified'] = http_date(timestamp)
+        return headers
+
+    def response_may_be_cached(self, request):
+        response_is_cacheable = getattr(self, 'response_is_cacheable', None)
+        return response_is_cacheable is not None and response_is_cacheable(request)
+
+    def get_cached_response_headers(self, request):
+        headers = super().get_cached_response_headers(request)
+        if self.supports_conditional_get(request):
+            headers.update(self.get_validator_headers(request))
+        return headers
+
+    def get_conditional_response(self, get_response, request, *args, **kwargs):
+        if not self.supports_conditional_get(request):
+            return get_response(request, *args, **kwargs)
+
+        # the freshness is queried before the response, so that the validators are never newer than its data,
+        # unless the response may be served from the response cache, which keeps them with the data
+        if self.is_conditional_request(request) or not self.response_may_be_cached(request):
+            etag, timestamp = self.get_validators(request)
+            not_modified_response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+            if not_modified_response is not None:
+                return not_modified_response
+
+        response = get_response(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK and 'ETag' not in response:
+            for header, value in self.get_validator_headers(request).items():
+                response[header] = value
+        return response
+
+
+class StreamingExportMixin:
+    """
+    Exports all the (filtered) objects of a viewset as a streamed NDJSON or CSV file, selected with the
+    export_format query parameter. The export_fields map the columns of the file to the fields (or related
+    field paths) of the objects. The rows are read with QuerySet.iterator(), which uses a server-side cursor on
+    postgres, so that neither the rows nor the file are ever loaded in memory.
+    The viewsets add the export action, which returns the get_export_response.
+    """
+    export_fields = ()
+    export_filename = 'export'
+    export_chunk_size = 2000
+    export_format_query_param = 'export_format'
+
+    def get_export_queryset(self):
+        return self.filter_queryset(self.get_queryset()).prefetch_related(None)
+
+    def get_export_columns(self):
+        return [column for column, _ in self.export_fields]
+
+    def get_export_rows(self, queryset):
+        columns = self.get_export_columns()
+        values = queryset.values_list(*[field for _, field in self.export_fields])
+        for row in values.iterator(chunk_size=self.export_chunk_size):
+            yield dict(zip(columns, row))
+
+    def get_export_response(self, request):
+        export_format = request.query_params.get(self.export_format_query_param, 'ndjson')
+        if export_format not in EXPORT_FORMATS:
+            raise ValidationError({self.export_format_query_param: [
+                'Select one of: {}.'.format(', '.join(EXPORT_FORMATS))]})
+        return streaming_export_response(self.get_export_rows(self.get_export_queryset()),
+                                         self.get_export_columns(), export_format, self.export_filename)
+
+
+class CompiledReadMixin:
+    """
+    Serves the list action of a viewset with a CompiledReadSerializer of its serializer, which serializes
+    the values() rows of the queryset instead of model instances, with the same output. It is used when the
+    MOVIE_STORE_COMPILED_READ setting is on and the serializer can be compiled, the serializer is used otherwise.
+    """
+
+    def list(self, request, *args, **kwargs):
+        if not settings.MOVIE_STORE_COMPILED_READ:
+            return super().list(request, *args, **kwargs)
+        try:
+            serializer = CompiledReadSerializer(self.get_serializer())
+        except CompileError:
+            return super().list(request, *args, **kwargs)
+
+        queryset = serializer.get_values_queryset(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(serializer.serialize(page))
+        return Response(serializer.serialize(queryset))
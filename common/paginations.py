@@ -1,8 +1,320 @@
-from rest_framework.pagination import PageNumberPagination
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as Base64Error
+from collections import OrderedDict
+from functools import partial, reduce
+from hashlib import sha1
+from operator import and_, or_
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet, FieldDoesNotExist
+from django.core.paginator import EmptyPage, Page, PageNotAnInteger, Paginator as DjangoPaginator
+from django.db import connections
+from django.db.models import F, Q
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+from .cache import get_model_versions, get_query_models
+
+COUNT_MODES = ('exact', 'cached', 'estimated')
+
+
+class CountingPaginator(DjangoPaginator):
+    """
+    Paginator that counts the results with a count mode:
+    - exact: a COUNT(*) of the results.
+    - cached: the exact count, cached per query (the sql and its parameters) for COUNT_CACHE_TIMEOUT seconds
+      or until any of the tables in the query is written to (the model versions are part of the cache key).
+    - estimated: the number of rows estimated by the postgres planner, when it is at least
+      COUNT_ESTIMATE_THRESHOLD (an exact count is used for fewer rows or on other databases).
+    The count_mode attribute holds the mode that actually produced the count.
+    An estimated count is only reported: the pages are not validated against it (it can be too low or too high),
+    one more row than the page size is fetched instead to know if there is a next page.
+    """
+
+    def __init__(self, object_list, per_page, count_mode='exact', **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.count_mode = count_mode
+
+    @cached_property
+    def count(self):
+        try:
+            sql, params = self.object_list.query.sql_with_params()
+        except (AttributeError, EmptyResultSet):  # not a queryset or a queryset that is always empty
+            self.count_mode = 'exact'
+            return super().count
+        return {
+            'cached': self.get_cached_count,
+            'estimated': self.get_estimated_count,
+        }.get(self.count_mode, self.get_exact_count)(sql, params)
+
+    def get_exact_count(self, sql, params):
+        self.count_mode = 'exact'
+        return self.object_list.count()
+
+    def get_cached_count(self, sql, params):
+        versions = get_model_versions(get_query_models(sql))
+        signature = sha1(repr((sql, params, versions)).encode('utf-8')).hexdigest()
+        key = 'pagination-count:{}'.format(signature)
+        count = cache.get(key)
+        if count is None:
+            count = self.object_list.count()
+            cache.set(key, count, timeout=settings.MOVIE_STORE_PAGINATION['COUNT_CACHE_TIMEOUT'])
+        self.count_mode = 'cached'
+        return count
+
+    def get_estimated_count(self, sql, params):
+        if connections[self.object_list.db].vendor != 'postgresql':
+            return self.get_exact_count(sql, params)
+        unordered_sql, unordered_params = self.object_list.order_by().query.sql_with_params()
+        with connections[self.object_list.db].cursor() as cursor:
+            cursor.execute('EXPLAIN (FORMAT JSON) ' + unordered_sql, unordered_params)
+            plan = cursor.fetchone()[0]
+        plan = json.loads(plan) if isinstance(plan, str) else plan
+        estimated_count = int(plan[0]['Plan']['Plan Rows'])
+        if estimated_count < settings.MOVIE_STORE_PAGINATION['COUNT_ESTIMATE_THRESHOLD']:
+            return self.get_exact_count(sql, params)
+        self.count_mode = 'estimated'
+        return estimated_count
+
+    def page(self, number):
+        count = self.count
+        if self.count_mode != 'estimated':
+            return super().page(number)
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger('That page number is not an integer')
+        if number < 1:
+            raise EmptyPage('That page number is less than 1')
+        bottom = (number - 1) * self.per_page
+        rows = list(self.object_list[bottom:bottom + self.per_page + 1])
+        if not rows and number > 1:
+            raise EmptyPage('That page contains no results')
+        has_next = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        # the results go at least up to the fetched rows, and end with the last page
+        self.count = max(count, bottom + len(rows) + 1) if has_next else bottom + len(rows)
+        return EstimatedCountPage(rows, number, self, has_next)
+
+
+class EstimatedCountPage(Page):
+    """Page of an estimated count paginator, which knows if there is a next page from its fetched rows"""
+
+    def __init__(self, object_list, number, paginator, has_next):
+        super().__init__(object_list, number, paginator)
+        self._has_next = has_next
+
+    def has_next(self):
+        return self._has_next
+
+    def next_page_number(self):
+        return self.number + 1
+
+    def previous_page_number(self):
+        return self.number - 1
+
+
+class KeysetPagination(BasePagination):
+    """
+    Keyset (cursor) pagination.
+    A page is selected by comparing the ordering fields, plus the id as a tiebreaker, with the values of the
+    last (or first) row of the previous page, so the cost of a page does not depend on how deep it is
+    (there is no COUNT and no OFFSET). The ordering is the one of the queryset (as set by the OrderingFilter),
+    or the default ordering of the model. Null values are placed last in ascending and first in descending
+    order, which is the postgres default.
+    """
+    cursor_query_param = 'cursor'
+    page_query_param = 'page'
+    invalid_cursor_message = 'Invalid cursor.'
+    tiebreaker_field = 'id'
+
+    def __init__(self, page_size):
+        self.page_size = page_size
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.ordering = self.get_ordering(queryset)
+        reverse, position = self.decode_cursor(request)
+        self.has_cursor = position is not None
+
+        # when going backwards, the ordering is reversed and the page is reversed again after it is fetched
+        ordering = [(field, not descending) for field, descending in self.ordering] if reverse else self.ordering
+        if position is not None:
+            queryset = queryset.filter(self.get_position_filter(queryset.model, ordering, position))
+        queryset = queryset.order_by(*[F(field).desc(nulls_first=True) if descending
+                                       else F(field).asc(nulls_last=True) for field, descending in ordering])
+
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = self.has_cursor, has_more
+        else:
+            self.has_next, self.has_previous = has_more, self.has_cursor
+        return self.page
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data)
+        ]))
+
+    def get_next_link(self):
+        if not (self.has_next and self.page):
+            return None
+        return self.encode_cursor(reverse=False, row=self.page[-1])
+
+    def get_previous_link(self):
+        if not (self.has_previous and self.page):
+            return None
+        return self.encode_cursor(reverse=True, row=self.page[0])
+
+    def get_ordering(self, queryset):
+        """Returns the ordering as a list of (field, descending) tuples, ending with the tiebreaker field"""
+        ordering = [field for field in (queryset.query.order_by or queryset.model._meta.ordering)
+                    if isinstance(field, str) and field != '?']
+        ordering = [(field.lstrip('-'), field.startswith('-')) for field in ordering]
+        if self.tiebreaker_field not in set(field for field, _ in ordering):
+            ordering.append((self.tiebreaker_field, False))
+        return ordering
+
+    def get_position_filter(self, model, ordering, position):
+        """
+        Builds the filter for the rows after the given position, that is:
+        (f1 after v1) OR (f1 = v1 AND f2 after v2) OR ... (f1 = v1 AND ... AND fn after vn)
+        """
+        conditions = []
+        equal_fields = []
+        for (field, descending), value in zip(ordering, position):
+            nullable = self.field_is_nullable(model, field)
+            if value is None:
+                after = Q(**{field + '__isnull': False}) if descending else None
+                equal = Q(**{field + '__isnull': True})
+            else:
+                after = Q(**{field + ('__lt' if descending else '__gt'): value})
+                if nullable and not descending:
+                    after |= Q(**{field + '__isnull': True})
+                equal = Q(**{field: value})
+            if after is not None:
+                conditions.append(reduce(and_, equal_fields + [after]))
+            equal_fields.append(equal)
+        return reduce(or_, conditions) if conditions else Q(pk__in=[])
+
+    @staticmethod
+    def field_is_nullable(model, field_path):
+        """Checks if a (possibly related) field can be null, annotations are considered not nullable"""
+        field = None
+        for name in field_path.split('__'):
+            try:
+                field = model._meta.get_field(name)
+            except FieldDoesNotExist:
+                return False
+            if field.null:
+                return True
+            model = field.related_model
+        return field is not None and field.null
+
+    def get_position(self, row):
+        """Gets the values of the ordering fields of a row (a model instance or a values dict)"""
+        position = []
+        for field, _ in self.ordering:
+            if isinstance(row, dict):
+                value = row[field]
+            else:
+                value = row
+                for name in field.split('__'):
+                    value = getattr(value, name) if value is not None else None
+            position.append(None if value is None else str(value))
+        return position
+
+    def encode_cursor(self, reverse, row):
+        cursor = json.dumps({'r': reverse, 'p': self.get_position(row)}, separators=(',', ':'))
+        encoded_cursor = urlsafe_b64encode(cursor.encode('utf-8')).decode('ascii')
+        url = remove_query_param(self.request.build_absolute_uri(), self.page_query_param)
+        return replace_query_param(url, self.cursor_query_param, encoded_cursor)
+
+    def decode_cursor(self, request):
+        """Returns the direction and the position of the cursor in the request (False, None if there is none)"""
+        encoded_cursor = request.query_params.get(self.cursor_query_param)
+        if not encoded_cursor:
+            return False, None
+        try:
+            cursor = json.loads(urlsafe_b64decode(encoded_cursor.encode('ascii')).decode('utf-8'))
+            reverse, position = bool(cursor['r']), list(cursor['p'])
+        except (TypeError, ValueError, KeyError, UnicodeError, Base64Error):
+            raise NotFound(self.invalid_cursor_message)
+        if len(position) != len(self.ordering) or not all(v is None or isinstance(v, str) for v in position):
+            raise NotFound(self.invalid_cursor_message)
+        return reverse, position
 
 
 class MovieStorePagination(PageNumberPagination):
-    """Default pagination for all movie store api viewsets"""
+    """
+    Default pagination for all movie store api viewsets.
+    Uses page numbers by default, with the results counted in the count mode of the view (its
+    pagination_count_mode attribute) or of the settings. The keyset pagination can be selected with
+    ?pagination=cursor (the following pages are then requested with the cursor in the next/previous links).
+    """
     page_size = 10
     page_size_query_param = 'page_size'
     max_page_size = 1000
+    pagination_mode_query_param = 'pagination'
+    keyset_pagination_class = KeysetPagination
+
+    def get_count_mode(self, view):
+        count_mode = getattr(view, 'pagination_count_mode', None) \
+            or settings.MOVIE_STORE_PAGINATION['COUNT_MODE']
+        assert count_mode in COUNT_MODES, 'Unknown pagination count mode {}'.format(count_mode)
+        return count_mode
+
+    def use_keyset_pagination(self, request):
+        return request.query_params.get(self.pagination_mode_query_param) == 'cursor' \
+            or self.keyset_pagination_class.cursor_query_param in request.query_params
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset_pagination = None
+        if self.use_keyset_pagination(request):
+            self.keyset_pagination = self.keyset_pagination_class(page_size=self.get_page_size(request))
+            return self.keyset_pagination.paginate_queryset(queryset, request, view)
+        self.django_paginator_class = partial(CountingPaginator, count_mode=self.get_count_mode(view))
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset_pagination is not None:
+            return self.keyset_pagination.get_paginated_response(data)
+        return Response(OrderedDict([
+            ('count', self.page.paginator.count),
+            ('count_mode', self.page.paginator.count_mode),
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data)
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        response_schema = super().get_paginated_response_schema(schema)
+        response_schema['properties']['count_mode'] = {'type': 'string', 'enum': list(COUNT_MODES)}
+        return response_schema
+
+    def get_schema_operation_parameters(self, view):
+        return super().get_schema_operation_parameters(view) + [
+            {
+                'name': self.pagination_mode_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'The pagination mode, "cursor" selects the keyset pagination '
+                               '(without a count of the results).',
+                'schema': {'type': 'string', 'enum': ['page', 'cursor']},
+            },
+            {
+                'name': self.keyset_pagination_class.cursor_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'The pagination cursor value (from the next/previous links).',
+                'schema': {'type': 'string'},
+            },
+        ]
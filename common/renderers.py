@@ -0,0 +1,60 @@
+"""
+Renderers of the api responses.
+The fast JSON renderer uses orjson and the MessagePack renderer uses msgpack, both optional packages:
+without orjson the JSON responses are rendered with the stdlib json, and without msgpack the MessagePack
+renderer is not enabled (see the REST_FRAMEWORK settings).
+"""
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    Renders JSON with orjson (when installed), which encodes UUIDs and datetimes natively, and the other types
+    (decimals, lazy strings etc.) with the encoder of the stdlib renderer. The output is the same JSON data, not
+    always the same bytes: the floats are formatted differently (1e16 instead of 1e+16), and NaN and infinity are
+    rendered as null instead of raising an error. The data that orjson cannot encode (e.g. integers over 64 bits)
+    and the indented responses (as requested with the indent media type parameter) are rendered by the stdlib
+    renderer.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None or self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(data, default=self.encoder_class().default,
+                               option=orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS)
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        # like the stdlib renderer, escape the line and paragraph separators, which are invalid in javascript
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
+
+
+class MessagePackRenderer(BaseRenderer):
+    """Renders MessagePack, for the internal service clients (requires msgpack)"""
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, default=encode_msgpack_value, use_bin_type=True)
+
+
+def encode_msgpack_value(value):
+    """Encodes the values that msgpack does not support (UUIDs, datetimes etc.) like the JSON encoder does"""
+    return JSONEncoder().default(value)
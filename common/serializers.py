@@ -0,0 +1,212 @@
+from collections import OrderedDict
+from types import SimpleNamespace
+from urllib.parse import quote
+from django.core.exceptions import FieldDoesNotExist
+from django.utils.http import RFC3986_SUBDELIMS
+from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.utils.serializer_helpers import ReturnList
+
+
+class SparseFieldset:
+    """
+    The fields of a response, as requested with the query parameters:
+    - fields: the (comma separated) fields to include, all of them by default,
+    - exclude: the (comma separated) fields to exclude,
+    - omit_url: a true value (true, 1) omits the url field.
+    Only read requests can select their fields, the other requests (and no request) include all the fields.
+    """
+    fields_query_param = 'fields'
+    exclude_query_param = 'exclude'
+    omit_url_query_param = 'omit_url'
+
+    def __init__(self, request):
+        query_params = request.query_params if request is not None and request.method in SAFE_METHODS else {}
+        self.fields = self.parse_names(query_params.get(self.fields_query_param)) or None
+        self.exclude = self.parse_names(query_params.get(self.exclude_query_param))
+        if query_params.get(self.omit_url_query_param, '').lower() in ('true', '1'):
+            self.exclude.add('url')
+
+    @staticmethod
+    def parse_names(value):
+        return set(name.strip() for name in (value or '').split(',') if name.strip())
+
+    def includes(self, name):
+        return (self.fields is None or name in self.fields) and name not in self.exclude
+
+
+class SparseFieldsetMixin:
+    """
+    Drops the fields that are not requested (see SparseFieldset) from a serializer, before anything is
+    serialized. Only the top level serializer of a response is affected, the nested serializers have no
+    request in their context when they are created.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fieldset = SparseFieldset(self.context.get('request'))
+        for name in [name for name in self.fields if not self.fieldset.includes(name)]:
+            self.fields.pop(name)
+
+
+class CompileError(Exception):
+    """A serializer has fields that the compiled read serializer does not support"""
+
+
+class CompiledReadSerializer:
+    """
+    Read only serializer compiled from a (model) serializer, which serializes the values() rows of a
+    queryset instead of model instances, with the same output as the serializer.
+    Every field is compiled once to a function of a row, that reads the row values and converts them with the
+    to_representation of the field:
+    - model fields are read from their values,
+    - hyperlinked identity fields format a url template, which is reversed once (instead of once per row),
+    - nested serializers are compiled too, and their fields are read with the related lookups (movie__title),
+    - many related slug fields are read with one query per page for all the rows.
+    A serializer that overrides to_representation can be compiled when it moves its extra work to a
+    finalize_representation(instance, representation) method. It gets a partial instance, with the
+    compiled_instance_fields of the serializer (model fields or annotations of the queryset).
+    Anything else raises a CompileError, so that the serializer is used instead.
+    """
+    url_lookup_placeholder = 'compiled-url-lookup'
+
+    def __init__(self, serializer, prefix=''):
+        if not isinstance(serializer, serializers.ModelSerializer):
+            raise CompileError('{} is not a model serializer'.format(type(serializer).__name__))
+        self.serializer = serializer
+        self.model = serializer.Meta.model
+        self.prefix = prefix
+        self.pk_path = prefix + self.model._meta.pk.name
+        self.paths = [self.pk_path]
+        self.many_related = []
+        self.fields = [(name, self.compile_field(field)) for name, field in serializer.fields.items()
+                       if not field.write_only]
+
+        self.instance_fields = ()
+        if type(serializer).to_representation is not serializers.Serializer.to_representation:
+            if not hasattr(serializer, 'finalize_representation'):
+                raise CompileError('{} overrides to_representation'.format(type(serializer).__name__))
+            self.instance_fields = tuple(getattr(serializer, 'compiled_instance_fields', ()))
+            self.paths.extend(prefix + name for name in self.instance_fields)
+            # from_db reads the values of the concrete fields in the order of the model
+            attnames = [field.attname for field in self.model._meta.concrete_fields]
+            self.instance_attnames = [name for name in attnames if name in self.instance_fields]
+            self.instance_annotations = [name for name in self.instance_fields if name not in attnames]
+
+    def compile_field(self, field):
+        if isinstance(field, serializers.HyperlinkedIdentityField):
+            return self.compile_url_field(field)
+        if isinstance(field, serializers.ManyRelatedField):
+            return self.compile_many_related_field(field)
+        if isinstance(field, serializers.BaseSerializer):
+            return self.compile_nested_serializer(field)
+        if isinstance(field, serializers.RelatedField) or field.source == '*' or '.' in field.source:
+            raise CompileError('{} is not supported'.format(field.field_name))
+        try:
+            model_field = self.model._meta.get_field(field.source)
+        except FieldDoesNotExist:
+            raise CompileError('{} is not a model field'.format(field.field_name))
+        if model_field.is_relation:
+            raise CompileError('{} is a relation'.format(field.field_name))
+
+        path = self.prefix + field.source
+        self.paths.append(path)
+        to_representation = field.to_representation
+        return lambda row: None if row[path] is None else to_representation(row[path])
+
+    def compile_url_field(self, field):
+        request = field.context['request']
+        url_format = field.context.get('format', None)
+        if url_format and field.format and field.format != url_format:
+            url_format = field.format
+        lookup_object = SimpleNamespace(**{field.lookup_field: self.url_lookup_placeholder})
+        url = field.get_url(lookup_object, field.view_name, request, url_format)
+        if url.count(self.url_lookup_placeholder) != 1:
+            raise CompileError('The url of {} cannot be a template'.format(field.field_name))
+
+        head, tail = url.split(self.url_lookup_placeholder)
+        path = self.prefix + field.lookup_field
+        self.paths.append(path)
+        # the lookup value is quoted like reverse() does
+        return lambda row: head + quote(str(row[path]), safe=RFC3986_SUBDELIMS + '/~:@') + tail
+
+    def compile_many_related_field(self, field):
+        child = field.child_relation
+        # subclasses of the slug field may only change how the values are written
+        if not isinstance(child, serializers.SlugRelatedField) or \
+                type(child).to_representation is not serializers.SlugRelatedField.to_representation:
+            raise CompileError('{} is not a slug related field'.format(field.field_name))
+        try:
+            model_field = self.model._meta.get_field(field.source)
+        except FieldDoesNotExist:
+            raise CompileError('{} is not a model field'.format(field.field_name))
+        if not model_field.many_to_many or model_field.auto_created:
+            raise CompileError('{} is not a many to many field'.format(field.field_name))
+
+        many_related = ManyRelatedValues(model_field, child.slug_field, self.pk_path)
+        self.many_related.append(many_related)
+        return many_related.get
+
+    def compile_nested_serializer(self, field):
+        if isinstance(field, serializers.ListSerializer) or '.' in field.source or field.source == '*':
+            raise CompileError('{} is not supported'.format(field.field_name))
+        nested = CompiledReadSerializer(field, prefix='{}{}__'.format(self.prefix, field.source))
+        self.paths.extend(nested.paths)
+        self.many_related.extend(nested.many_related)
+        # the nested object is null when its foreign key is
+        return lambda row: None if row[nested.pk_path] is None else nested.to_representation(row)
+
+    def to_representation(self, row):
+        representation = OrderedDict([(name, get_value(row)) for name, get_value in self.fields])
+        if self.instance_fields:
+            instance = self.model.from_db(None, self.instance_attnames,
+                                          [row[self.prefix + name] for name in self.instance_attnames])
+            # the annotations of the queryset (e.g. a computed value), which are not model fields
+            for name in self.instance_annotations:
+                setattr(instance, name, row[self.prefix + name])
+            representation = self.serializer.finalize_representation(instance, representation)
+        return representation
+
+    def get_values_queryset(self, queryset):
+        """
+        Gets the values of a queryset for the compiled fields, plus the fields of its ordering, which are used by
+        the keyset pagination.
+        """
+        ordering = [field.lstrip('-') for field in (queryset.query.order_by or queryset.model._meta.ordering)
+                    if isinstance(field, str) and field != '?']
+        return queryset.prefetch_related(None).values(*dict.fromkeys(self.paths + ordering))
+
+    def serialize(self, rows):
+        """Serializes a list of values() rows (e.g. a page of the values queryset)"""
+        rows = list(rows)
+        for many_related in self.many_related:
+            many_related.load(rows)
+        return ReturnList([self.to_representation(row) for row in rows], serializer=self.serializer)
+
+
+class ManyRelatedValues:
+    """The values of a many to many field of a list of rows, read with one query"""
+
+    def __init__(self, model_field, slug_field, pk_path):
+        self.through = model_field.remote_field.through
+        self.source_name = model_field.m2m_field_name()
+        self.target_name = model_field.m2m_reverse_field_name()
+        self.slug_field = slug_field
+        self.pk_path = pk_path
+        # the same order as the related manager, which has the default ordering of the related model
+        self.ordering = ['{}{}__{}'.format('-' if field.startswith('-') else '', self.target_name, field.lstrip('-'))
+                         for field in model_field.related_model._meta.ordering if isinstance(field, str)]
+        self.values = {}
+
+    def load(self, rows):
+        pks = set(row[self.pk_path] for row in rows if row[self.pk_path] is not None)
+        self.values = {}
+        if not pks:
+            return
+        related_values = self.through.objects.filter(**{self.source_name + '__in': pks}).order_by(*self.ordering)\
+            .values_list(self.source_name, '{}__{}'.format(self.target_name, self.slug_field))
+        for pk, value in related_values:
+            self.values.setdefault(pk, []).append(value)
+
+    def get(self, row):
+        return list(self.values.get(row[self.pk_path], []))
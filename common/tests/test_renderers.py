@@ -0,0 +1,78 @@
+import json
+from decimal import Decimal
+from uuid import uuid4
+import pytest
+from django.utils.translation import gettext_lazy
+from rest_framework.renderers import JSONRenderer
+from common import parsers, renderers
+from common.renderers import FastJSONRenderer
+from common.tests import data
+from movie_store.tests.utils import get_random_movies
+
+auth_url = '/iam/auth/'
+movies_url = '/store/movies/'
+rentals_url = '/store/rentals/'
+
+# post/patch default arguments
+request_args = {'content_type': 'application/json'}
+
+# mark all tests as needing database access
+pytestmark = pytest.mark.django_db
+
+
+def test_fast_json_renderer():
+    rendered_data = {'uuid': uuid4(), 'decimal': Decimal('1.50'), 'lazy': gettext_lazy('Lazy'),
+                     'text': 'Unicode \u00e9 and separators \u2028 \u2029', 'list': [1, 2.5, None, True]}
+    assert FastJSONRenderer().render(rendered_data) == JSONRenderer().render(rendered_data)
+    assert FastJSONRenderer().render(None) == b''
+    assert FastJSONRenderer().render(rendered_data, 'application/json; indent=4') == \
+        JSONRenderer().render(rendered_data, 'application/json; indent=4')
+
+    # the same data, the floats are formatted differently
+    rendered_data = {'floats': [1e16, 1.5e-7, 0.1]}
+    assert json.loads(FastJSONRenderer().render(rendered_data)) == json.loads(JSONRenderer().render(rendered_data))
+    # the data that orjson cannot encode is rendered by the stdlib renderer
+    rendered_data = {'big': 2 ** 64, 'small': -2 ** 70}
+    assert FastJSONRenderer().render(rendered_data) == JSONRenderer().render(rendered_data)
+    # NaN is rendered as null, where the (strict) stdlib renderer raises an error
+    assert FastJSONRenderer().render({'nan': float('nan')}) == b'{"nan":null}'
+
+
+def test_fast_json_stdlib_fallback__user(client, monkeypatch):
+    # without orjson the stdlib json is used
+    monkeypatch.setattr(renderers, 'orjson', None)
+    monkeypatch.setattr(parsers, 'orjson', None)
+    client.post(auth_url, data.user1_credentials, **request_args)
+    movie = get_random_movies(number_of_movies=1)[0]
+    response = client.post(rentals_url, {'movie': str(movie.uuid)}, **request_args)
+    assert response.status_code == 201
+    assert response.content == JSONRenderer().render(response.data)
+
+
+def test_fast_json_responses__user(client):
+    client.post(auth_url, data.user1_credentials, **request_args)
+    for movie in get_random_movies(number_of_movies=3):
+        client.post(rentals_url, {'movie': str(movie.uuid)}, **request_args)
+
+    # the responses are the same as with the stdlib renderer
+    for url, params in ((movies_url, {'page_size': 100}), (rentals_url, {}), (movies_url, {'page': 1000})):
+        response = client.get(url, params)
+        assert response.content == JSONRenderer().render(response.data)
+
+    response = client.post(rentals_url, '{"movie": ', **request_args)
+    assert response.status_code == 400
+    assert response.json()['detail'].startswith('JSON parse error')
+
+
+def test_message_pack__user(client):
+    msgpack = pytest.importorskip('msgpack')
+    client.post(auth_url, data.user1_credentials, **request_args)
+    movie = get_random_movies(number_of_movies=1)[0]
+    response = client.post(rentals_url, msgpack.packb({'movie': str(movie.uuid)}),
+                           content_type='application/msgpack', HTTP_ACCEPT='application/msgpack')
+    assert response.status_code == 201
+    assert response['Content-Type'] == 'application/msgpack'
+    assert msgpack.unpackb(response.content)['movie']['uuid'] == str(movie.uuid)
+
+    response = client.get(movies_url, HTTP_ACCEPT='application/msgpack')
+    assert msgpack.unpackb(response.content) == client.get(movies_url).json()
@@ -1,5 +1,6 @@
 import string
 import random
+from django.core.cache import cache
 
 
 def get_random_string(length=32, use_lowercase=True, use_uppercase=True, use_digits=True, use_punctuation=True):
@@ -16,4 +17,26 @@ def get_random_string(length=32, use_lowercase=True, use_uppercase=True, use_dig
 
     chars = list(chars_to_use)
     random.shuffle(chars)
-    return ''.join(random.choices(chars, k=length))
\ No newline at end of file
+    return ''.join(random.choices(chars, k=length))
+
+
+def get_all_pages(client, url, params, link='next'):
+    """Follows the next (or previous) links of a paginated list and returns the results of every page"""
+    pages = []
+    response = client.get(url, params)
+    while True:
+        assert response.status_code == 200
+        pages.append(response.json()['results'])
+        if response.json()[link] is None:
+            return pages
+        response = client.get(response.json()[link])
+
+
+def get_compiled_and_serializer_responses(client, settings, url, params=None):
+    """Gets a list with the compiled read serializer and with the serializer (the response cache is cleared)"""
+    responses = []
+    for compiled_read in (True, False):
+        settings.MOVIE_STORE_COMPILED_READ = compiled_read
+        cache.clear()
+        responses.append(client.get(url, params))
+    return responses
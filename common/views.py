@@ -1,7 +1,12 @@
 from rest_framework import status
 from rest_framework.response import Response
-from rest_framework.views import exception_handler
+from rest_framework.views import APIView, exception_handler
+from rest_framework.permissions import IsAuthenticated
 from rest_framework import exceptions as drf_exceptions
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import extend_schema
+from .mixins import get_response_cache_stats
+from .permissions import IsSuperuser
 
 
 def custom_exception_handler(exc, context):
@@ -23,3 +28,12 @@ def custom_exception_handler(exc, context):
     # if none of the above cases checked true, call the default drf exception handler
     response = exception_handler(exc, context)
     return response
+
+
+class ResponseCacheStatsView(APIView):
+    """Reports the hits and misses of the response cache of every view, for monitoring."""
+    permission_classes = (IsAuthenticated, IsSuperuser)
+
+    @extend_schema(responses={200: OpenApiTypes.OBJECT})
+    def get(self, request, *args, **kwargs):
+        return Response(get_response_cache_stats(), status=status.HTTP_200_OK)
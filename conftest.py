@@ -1,7 +1,9 @@
 import pytest
 from django.db import connection
 from django.conf import settings
+from django.core.cache import cache
 from django.core.management import call_command
+from movie_store.genres import genre_resolver
 
 
 def django_db_modify_db_settings(schema):
@@ -52,6 +54,14 @@ def django_db_setup(django_db_blocker, django_db_createdb, django_db_keepdb):
                 c.close()
 
 
+@pytest.fixture(autouse=True)
+def clear_cache():
+    # the cached values may depend on data of previous tests, which have been rolled back
+    cache.clear()
+    genre_resolver.clear()
+    yield
+
+
 # in case of using the default postgres schema, this is enough to load the initial_data.json
 # @pytest.fixture(scope='session')
 # def django_db_setup(django_db_setup, django_db_blocker):
@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class IamConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'iam'
+
+    def ready(self):
+        # track the versions of the users for the cached values (e.g. the pagination counts)
+        from common.cache import track_model_versions
+        track_model_versions(self.get_model('CustomUser'))
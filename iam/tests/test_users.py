@@ -1,5 +1,6 @@
 import pytest
 from common.tests import data
+from common.tests.utils import get_all_pages, get_compiled_and_serializer_responses
 
 auth_url = '/iam/auth/'
 users_url = '/iam/users/'
@@ -45,3 +46,23 @@ def test_retrieve_user__admin(client):
     client.post(auth_url, data.admin_credentials, **request_args)
     response = client.get(user_url.format(user_uuid=data.user1_uuid))
     assert response.status_code == 200
+
+
+def test_list_users_cursor_pagination__admin(client):
+    client.post(auth_url, data.admin_credentials, **request_args)
+    for ordering in ('email', '-last_login', 'last_name'):
+        all_users = client.get(users_url, {'order_by': ordering}).json()['results']
+        pages = get_all_pages(client, users_url, {'order_by': ordering, 'page_size': 1, 'pagination': 'cursor'})
+        paged_users = [u for page in pages for u in page]
+        field = ordering.lstrip('-')
+        assert [u[field] for u in paged_users] == [u[field] for u in all_users]
+        assert sorted(u['uuid'] for u in paged_users) == sorted(u['uuid'] for u in all_users)
+
+
+def test_list_users_compiled_read__admin(client, settings):
+    client.post(auth_url, data.admin_credentials, **request_args)
+    for params in ({}, {'order_by': '-last_login', 'pagination': 'cursor'}, {'search': 'user'}):
+        compiled_response, serializer_response = get_compiled_and_serializer_responses(client, settings, users_url,
+                                                                                       params)
+        assert compiled_response.status_code == 200
+        assert compiled_response.content == serializer_response.content
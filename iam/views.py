@@ -10,6 +10,7 @@ from rest_framework_simplejwt.exceptions import TokenError
 from rest_framework.filters import SearchFilter, OrderingFilter
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 from drf_spectacular.utils import extend_schema
+from common.mixins import CompiledReadMixin
 from common.permissions import IsSuperuser
 from common.paginations import MovieStorePagination
 from .authentications import JWTCookieAuthentication
@@ -95,11 +96,12 @@ class AuthView(GenericAPIView):
         }
 
 
-class UserViewSet(ReadOnlyModelViewSet):
+class UserViewSet(CompiledReadMixin, ReadOnlyModelViewSet):
     queryset = CustomUser.objects.all()
     authentication_classes = (JWTCookieAuthentication,)
     permission_classes = (IsAuthenticated, IsSuperuser,)
     pagination_class = MovieStorePagination
+    pagination_count_mode = 'cached'
     serializer_class = CustomUserSerializer
     lookup_field = 'uuid'
 
@@ -1,44 +1,128 @@
+from drf_spectacular.types import OpenApiTypes
 from drf_spectacular.utils import OpenApiParameter, OpenApiExample
-from .serializers import RentalSerializer
+from .serializers import RentalSerializer, BulkCreateMovieSerializer, BulkUpdateMovieSerializer, \
+    BulkDeleteMovieSerializer
+from .filters import MovieSearchFilter
+
+# the sparse fieldset parameters of the read endpoints (see common.serializers.SparseFieldset)
+sparse_fieldset_parameters = [
+    OpenApiParameter(name='fields', description='The fields to include in the results (comma separated).', type=str),
+    OpenApiParameter(name='exclude', description='The fields to exclude from the results (comma separated).',
+                     type=str),
+    OpenApiParameter(name='omit_url', description='Omits the url field from the results.', type=bool),
+]
 
 # genres
 list_genres = {
-    'parameters': [
+    'parameters': sparse_fieldset_parameters + [
         OpenApiParameter(name='order_by', description='Which field to use when ordering the results.',
                          type=str, enum=['name'])
     ]
 }
-retrieve_genre = {}
+retrieve_genre = {'parameters': sparse_fieldset_parameters}
 create_genre = {}
 partial_update_genre = {}
 destroy_genre = {}
 
 # movies
+# the search of the movies, documented by the filter on the list
+movie_search_parameter = OpenApiParameter(name='search', description=MovieSearchFilter.search_description, type=str)
+
 list_movies = {
-    'parameters': [
+    'parameters': sparse_fieldset_parameters + [
         OpenApiParameter(name='order_by', description='Which field to use when ordering the results.',
-                         type=str, enum=['title', 'year']),
-        OpenApiParameter(name='year', description='A year to filter the results.', type=int),
-        OpenApiParameter(name='director', description='A director to filter the results.', type=str),
+                         type=str, enum=['title', 'year', 'popularity']),
+        OpenApiParameter(name='year', description='A year to filter the results. Can filter by multiple years '
+                                                  '(comma separated).', type=str),
+        OpenApiParameter(name='year_min', description='The first year of the results.', type=int),
+        OpenApiParameter(name='year_max', description='The last year of the results.', type=int),
+        OpenApiParameter(name='decade', description='A decade to filter the results (its first year, e.g. 1990).',
+                         type=int),
+        OpenApiParameter(name='director', description='A director to filter the results (case insensitive). Can '
+                                                      'filter by multiple directors (comma separated).', type=str),
         OpenApiParameter(name='genre', type=str,
                          description='Genre to filter the results. Can filter by multiple genres (comma separated). '
                                      'When filtering by multiple genres, only the movies that are associated with all '
                                      'these genres will be listed.', ),
     ]
 }
-retrieve_movie = {}
+retrieve_movie = {'parameters': sparse_fieldset_parameters}
 create_movie = {}
 partial_update_movie = {}
 destroy_movie = {}
+bulk_create_movies = {
+    'request': BulkCreateMovieSerializer(many=True),
+    'responses': {201: OpenApiTypes.OBJECT},
+    'examples': [OpenApiExample('Created movies', response_only=True, status_codes=['201'],
+                                value={'count': 1, 'uuids': ['3fa85f64-5717-4562-b3fc-2c963f66afa6']})],
+}
+bulk_partial_update_movies = {
+    'request': BulkUpdateMovieSerializer(many=True),
+    'responses': {200: OpenApiTypes.OBJECT},
+    'examples': [OpenApiExample('Updated movies', response_only=True, value={'count': 1})],
+}
+bulk_destroy_movies = {
+    'request': BulkDeleteMovieSerializer(many=True),
+    'responses': {200: OpenApiTypes.OBJECT},
+    'examples': [OpenApiExample('Deleted movies', response_only=True, value={'count': 1})],
+}
+movie_facets = {
+    'parameters': [p for p in list_movies['parameters']
+                   if p not in sparse_fieldset_parameters and p.name != 'order_by'] + [
+        movie_search_parameter,
+    ],
+    'responses': {200: OpenApiTypes.OBJECT},
+    'examples': [OpenApiExample('Movie facets', response_only=True, value={
+        'count': 2,
+        'genres': [{'value': 'Drama', 'count': 2}, {'value': 'Crime', 'count': 1}],
+        'years': [{'value': 1972, 'count': 1}, {'value': 1994, 'count': 1}],
+        'decades': [{'value': 1970, 'count': 1}, {'value': 1990, 'count': 1}],
+        'directors': [{'value': 'Francis Ford Coppola', 'count': 1}, {'value': 'Frank Darabont', 'count': 1}],
+    })],
+}
+also_rented = {
+    'parameters': sparse_fieldset_parameters + [
+        OpenApiParameter(name='limit', description='Number of movies to return (10 by default, at most 50).',
+                         type=int),
+    ],
+    'responses': {200: OpenApiTypes.OBJECT},
+    'examples': [OpenApiExample('Customers also rented', response_only=True, value=[{
+        'movie': {
+            'url': 'http://127.0.0.1:9000/store/movies/966f1207-b163-44b6-9ec2-70df8c983b22/',
+            'genres': ['Action', 'Science Fiction'],
+            'uuid': '966f1207-b163-44b6-9ec2-70df8c983b22',
+            'title': 'Alita: Battle Angel',
+            'year': 2019,
+            'summary': 'When Alita awakens with no memory of who she is in a future world she does not recognize, '
+                       'she is taken in by Ido, a compassionate doctor.',
+            'director': 'Robert Rodriguez',
+        },
+        'count': 3,
+    }])],
+}
+export_movies = {
+    'parameters': [p for p in list_movies['parameters'] if p not in sparse_fieldset_parameters] + [
+        movie_search_parameter,
+        OpenApiParameter(name='export_format', description='The format of the exported file (ndjson by default).',
+                         type=str, enum=['ndjson', 'csv']),
+    ],
+    'responses': {(200, 'application/x-ndjson'): OpenApiTypes.STR, (200, 'text/csv'): OpenApiTypes.STR},
+}
 library = {
-    'parameters': [
-        OpenApiParameter(name='search', description='A search term.', type=str),
+    'parameters': sparse_fieldset_parameters + [
+        movie_search_parameter,
         OpenApiParameter(name='page', description='A page number within the paginated result set.', type=int),
         OpenApiParameter(name='page_size', description='Number of results to return per page.', type=int),
         OpenApiParameter(name='order_by', description='Which field to use when ordering the results.',
-                         type=str, enum=['title', 'year']),
-        OpenApiParameter(name='year', description='A year to filter the results.', type=int),
-        OpenApiParameter(name='director', description='A director to filter the results.', type=str),
+                         type=str, enum=['title', 'year', 'popularity']),
+        OpenApiParameter(name='year', description='A year to filter the results. Can filter by multiple years '
+                                                  '(comma separated).', type=str),
+        OpenApiParameter(name='year_min', description='The first year of the results.', type=int),
+        OpenApiParameter(name='year_max', description='The last year of the results.', type=int),
+        OpenApiParameter(name='decade', description='A decade to filter the results (its first year, e.g. 1990).',
+                         type=int),
+        OpenApiParameter(name='director', description='A director to filter the results (case insensitive). Can '
+                                                      'filter by multiple directors (comma separated).', type=str),
         OpenApiParameter(name='genre', type=str,
                          description='Genre to filter the results. Can filter by multiple genres (comma separated). '
                                      'When filtering by multiple genres, only the movies that are associated with all '
@@ -48,17 +132,31 @@ library = {
 
 # rentals
 list_rentals = {
-    'parameters': [
+    'parameters': sparse_fieldset_parameters + [
         OpenApiParameter(name='order_by', description='Which field to use when ordering the results.',
-                         type=str, enum=['movie__title', 'movie__year', 'rental_date', 'return_date', 'payment']),
+                         type=str, enum=['movie__title', 'movie__year', 'rental_date', 'return_date', 'payment',
+                                         'fee']),
         OpenApiParameter(name='user', type=str,
                          description='A user uuid to filter the results. Available only for admins.'),
         OpenApiParameter(name='movie', description='A movie uuid to filter the results.', type=str),
         OpenApiParameter(name='status', type=str, description='A status to filter the results',
                          enum=['active', 'returned']),
+        OpenApiParameter(name='fee_min', type=float,
+                         description='The lowest current fee (the fee of the returned rentals is 0).'),
+        OpenApiParameter(name='fee_max', description='The highest current fee.', type=float),
+        OpenApiParameter(name='rental_date_min', type=str,
+                         description='The first rental date (YYYY-MM-DD) or datetime (ISO 8601).'),
+        OpenApiParameter(name='rental_date_max', type=str,
+                         description='The last rental date (YYYY-MM-DD, included) or datetime (ISO 8601).'),
+        OpenApiParameter(name='archived', type=bool,
+                         description='Read only the archived rentals (the returned rentals older than the archive '
+                                     'horizon). By default the rentals and the archived rentals are read, unless the '
+                                     'filters exclude the archived rentals (the active rentals, or a rental_date_min '
+                                     'after the archive horizon).'),
     ]
 }
 retrieve_rental = {
+    'parameters': sparse_fieldset_parameters,
     'examples': [
         OpenApiExample(
             name='Get active rental',
@@ -140,3 +238,41 @@ create_rental = {
 }
 partial_update_rental = {'responses': {201: RentalSerializer}, }
 destroy_rental = {}
+rental_balance = {
+    'parameters': [
+        OpenApiParameter(name='user', type=str,
+                         description='A user uuid to get the balance of. Available only for admins.'),
+    ],
+    'responses': {200: OpenApiTypes.OBJECT},
+    'examples': [OpenApiExample('Balance', response_only=True, value={'active_rentals': 2, 'balance': 4.5})],
+}
+bulk_return_rentals = {
+    'responses': {200: OpenApiTypes.OBJECT},
+    'examples': [OpenApiExample('Returned rentals', response_only=True, value={'count': 1})],
+}
+export_rentals = {
+    'parameters': [p for p in list_rentals['parameters'] if p not in sparse_fieldset_parameters] + [
+        OpenApiParameter(name='search', description='A search term.', type=str),
+        OpenApiParameter(name='export_format', description='The format of the exported file (ndjson by default).',
+                         type=str, enum=['ndjson', 'csv']),
+    ],
+    'responses': {(200, 'application/x-ndjson'): OpenApiTypes.STR, (200, 'text/csv'): OpenApiTypes.STR},
+}
+
+# reports
+revenue_report = {
+    'parameters': [
+        OpenApiParameter(name='group_by', description='How to group the returns and the revenue (day by default).',
+                         type=str, enum=['day', 'month', 'movie', 'genre']),
+        OpenApiParameter(name='date_min', description='The first day of the report (YYYY-MM-DD).', type=str),
+        OpenApiParameter(name='date_max', description='The last day of the report (YYYY-MM-DD).', type=str),
+        OpenApiParameter(name='limit', description='The number of movies or genres (100 by default, at most 1000).',
+                         type=int),
+    ],
+    'responses': {200: OpenApiTypes.OBJECT},
+    'examples': [
+        OpenApiExample('Revenue per month', response_only=True, value={
+            'group_by': 'month', 'results': [{'month': '2026-09', 'returns': 12, 'revenue': 31.5},
+                                             {'month': '2026-10', 'returns': 4, 'revenue': 9.0}]}),
+    ],
+}
@@ -4,3 +4,14 @@ from django.apps import AppConfig
 class MovieStoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'movie_store'
+
+    def ready(self):
+        # track the versions of the models for the cached values (e.g. the pagination counts, the responses),
+        # the rentals, the archive and the rollups are deleted in bulk, with fast deletes
+        from common.cache import track_model_versions
+        bulk_deleted_models = [self.get_model(name) for name in ('Rental', 'ArchivedRental', 'CoRental',
+                                                                 'DailyRevenue')]
+        track_model_versions(*[model for model in self.get_models() if model not in bulk_deleted_models])
+        track_model_versions(*bulk_deleted_models, deletes=False)
+        # connect the signal receivers
+        from . import signals  # noqa: F401
@@ -0,0 +1,74 @@
+"""
+Archive of the rentals: the returned rentals rented before the archive horizon (the MOVIE_STORE_RENTAL_ARCHIVE
+setting) are moved to the ArchivedRental table, so that the lists, filters and counts of the active and the recent
+rentals only read the recent history, however long it grows. The rentals list reads both tables (through the
+RentalHistory view) unless its filters exclude the archived rentals (see views.RentalViewSet.get_rental_model).
+On postgres the archive is range partitioned by rental_date, with one partition per year, which is created before
+any rental of that year is moved, so the queries of the archive that filter the rental date only read the
+partitions of those years. The existing rentals are archived by running the archive_rentals command, in batches
+of moved rentals (one transaction each), and then periodically (e.g. every day) as they age.
+"""
+from datetime import datetime, timedelta
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from common.cache import bump_model_version_on_commit
+from .models import ArchivedRental, Rental
+from .popularity import popularity_windows
+
+
+def get_archive_horizon():
+    """The rental date before which the returned rentals are archived"""
+    return timezone.now() - timedelta(days=settings.MOVIE_STORE_RENTAL_ARCHIVE['HORIZON_DAYS'])
+
+
+def get_partition_name(year):
+    return '{}_{}'.format(ArchivedRental._meta.db_table, year)
+
+
+def create_partitions(first_year, last_year):
+    """Creates the missing yearly partitions of the archive (only on postgres)"""
+    if connection.vendor != 'postgresql':
+        return
+    quote_name = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        for year in range(first_year, last_year + 1):
+            cursor.execute('CREATE TABLE IF NOT EXISTS {} PARTITION OF {} FOR VALUES FROM (%s) TO (%s)'.format(
+                quote_name(get_partition_name(year)), quote_name(ArchivedRental._meta.db_table)),
+                [datetime(year, 1, 1, tzinfo=timezone.utc), datetime(year + 1, 1, 1, tzinfo=timezone.utc)])
+
+
+def archive_rentals(horizon=None, batch_size=None):
+    """
+    Moves the returned rentals rented before the horizon (by default the one of the settings) to the archive, in
+    batches of the oldest rentals, each with one INSERT ... SELECT and one DELETE in a transaction.
+    Yields the number of moved rentals of every batch. Raises ValueError if the horizon is in the longest popularity
+    window, since the popularity is recomputed from the rentals of that window.
+    """
+    horizon = get_archive_horizon() if horizon is None else horizon
+    longest_window = max(window for _, window in popularity_windows)
+    if horizon > timezone.now() - longest_window:
+        raise ValueError('The archive horizon should be at least {} days ago (the popularity window)'.format(
+            longest_window.days))
+    batch_size = batch_size or settings.MOVIE_STORE_RENTAL_ARCHIVE['BATCH_SIZE']
+    archived = Rental.objects.filter(returned=True, rental_date__lt=horizon)
+    table = connection.ops.quote_name(ArchivedRental._meta.db_table)
+    fields = ArchivedRental._meta.concrete_fields
+    columns = ', '.join(connection.ops.quote_name(field.column) for field in fields)
+    while True:
+        with transaction.atomic():
+            # the oldest rentals first, read from the partial index of the returned rentals
+            batch = list(archived.order_by('rental_date').values_list('pk', 'rental_date')[:batch_size])
+            if not batch:
+                return
+            ids = [pk for pk, _ in batch]
+            years = [rental_date.astimezone(timezone.utc).year for _, rental_date in batch]
+            create_partitions(min(years), max(years))
+            sql, params = Rental.objects.filter(pk__in=ids).order_by()\
+                .values_list(*[field.attname for field in fields]).query.sql_with_params()
+            with connection.cursor() as cursor:
+                cursor.execute('INSERT INTO {} ({}) {}'.format(table, columns, sql), params)
+            Rental.objects.filter(pk__in=ids).delete()
+            bump_model_version_on_commit(Rental)
+            bump_model_version_on_commit(ArchivedRental)
+        yield len(ids)
@@ -0,0 +1,269 @@
+"""
+Benchmarks for the performance sensitive parts of the movie store.
+
+Every benchmark creates its own data in a transaction that is rolled back when it finishes, so they can
+be run against any database without leaving data behind. They are run with the benchmark command,
+for example: python manage.py benchmark genre_filter --size 100000
+"""
+import random
+from time import perf_counter
+from django.contrib.auth import get_user_model
+from django.db import connection, reset_queries, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory, force_authenticate
+from common.cache import bump_model_version
+from iam.views import UserViewSet
+from .models import Genre, Movie, Rental
+from .filters import GenreFilter
+from .views import GenreViewSet, MovieViewSet, RentalViewSet
+
+BENCHMARKS = {}
+
+
+def benchmark(name, default_size):
+    """Registers a benchmark function under the given name"""
+    def decorator(func):
+        BENCHMARKS[name] = (func, default_size)
+        return func
+    return decorator
+
+
+class Measurement:
+    """Measures the elapsed time and the number of queries of a block of code"""
+
+    def __enter__(self):
+        # the query log has a maximum length, after which its length does not count the queries
+        reset_queries()
+        self.queries = CaptureQueriesContext(connection).__enter__()
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.elapsed = perf_counter() - self.start
+        self.queries.__exit__(*args)
+
+    @property
+    def number_of_queries(self):
+        return len(self.queries)
+
+    @property
+    def milliseconds(self):
+        return self.elapsed * 1000
+
+
+def run_benchmark(name, size=None, repeat=3):
+    """Runs a registered benchmark in a transaction that is rolled back and returns its report lines"""
+    func, default_size = BENCHMARKS[name]
+    with transaction.atomic():
+        report = func(size or default_size, repeat)
+        transaction.set_rollback(True)
+    return report
+
+
+def api_request(path, params):
+    """Creates a drf request, which can be given to the filter backends"""
+    return Request(APIRequestFactory().get(path, params))
+
+
+def create_staff_user():
+    return get_user_model().objects.create(email='benchmark@moviestore.com', is_staff=True)
+
+
+def create_movies(number_of_movies, batch_size=5000, **fields):
+    """Creates the given number of movies with bulk inserts and returns their ids"""
+    movies = (Movie(title='Benchmark movie {}'.format(i), year=1950 + i % 70, summary='Benchmark summary {}'.format(i),
+                    director='Benchmark director {}'.format(i % 1000), **fields) for i in range(number_of_movies))
+    created_movies = []
+    while True:
+        batch = [movie for _, movie in zip(range(batch_size), movies)]
+        if not batch:
+            break
+        created_movies.extend(Movie.objects.bulk_create(batch, batch_size=batch_size))
+    return [movie.id for movie in created_movies]
+
+
+@benchmark('genre_filter', default_size=100000)
+def genre_filter(number_of_movies, repeat):
+    """Filters a catalog by 1 to 10 genres, the cost should stay flat as the number of genres grows"""
+    genres = Genre.objects.bulk_create([Genre(name='Benchmark genre {}'.format(i)) for i in range(10)])
+    movie_ids = create_movies(number_of_movies)
+
+    # every movie gets 3 to 10 random genres, so that filtering by many genres still matches some movies
+    through_model = Movie.genres.through
+    random.seed(0)
+    movie_genres = (through_model(movie_id=movie_id, genre_id=genre.id) for movie_id in movie_ids
+                    for genre in random.sample(genres, random.randint(3, 10)))
+    through_model.objects.bulk_create(movie_genres, batch_size=10000)
+
+    report = ['Genre filter on {} movies'.format(number_of_movies)]
+    for number_of_genres in range(1, 11):
+        request = api_request('/store/movies/', {'genre': ','.join(g.name for g in genres[:number_of_genres])})
+        timings = []
+        for _ in range(repeat):
+            with Measurement() as measurement:
+                queryset = GenreFilter().filter_queryset(request, Movie.objects.all(), view=None)
+                count = queryset.count()
+                list(queryset.order_by('title')[:10])
+            timings.append(measurement.milliseconds)
+        report.append('{} genres: {} movies, {} queries, {:.1f} ms (best of {})'.format(
+            number_of_genres, count, measurement.number_of_queries, min(timings), repeat))
+    return report
+
+
+@benchmark('bulk_movies', default_size=10000)
+def bulk_movies(number_of_movies, repeat):
+    """Creates, updates and deletes a list of movies with one request each, through the bulk endpoints"""
+    Genre.objects.bulk_create([Genre(name='Benchmark genre {}'.format(i)) for i in range(10)])
+    user = create_staff_user()
+    factory = APIRequestFactory()
+    bulk_view = MovieViewSet.as_view({'post': 'bulk_create', 'patch': 'bulk_partial_update',
+                                      'delete': 'bulk_destroy'})
+    create_view = MovieViewSet.as_view({'post': 'create'})
+
+    def call(view, method, data):
+        request = getattr(factory, method)('/store/movies/bulk/', data, format='json')
+        force_authenticate(request, user=user)
+        with Measurement() as measurement:
+            response = view(request)
+        assert response.status_code in (200, 201), response.data
+        return response, measurement
+
+    movies_data = [{'title': 'Benchmark movie {}'.format(i), 'year': 1950 + i % 70,
+                    'summary': 'Benchmark summary {}'.format(i), 'director': 'Benchmark director {}'.format(i % 1000),
+                    'genres': ['Benchmark genre {}'.format(g) for g in range(i % 3 + 1)]}
+                   for i in range(number_of_movies)]
+    timings = {'create': [], 'update': [], 'delete': []}
+    for _ in range(repeat):
+        response, create_measurement = call(bulk_view, 'post', movies_data)
+        updates = [{'uuid': str(uuid), 'title': 'Updated benchmark movie', 'genres': ['Benchmark genre 9']}
+                   for uuid in response.data['uuids']]
+        _, update_measurement = call(bulk_view, 'patch', updates)
+        _, delete_measurement = call(bulk_view, 'delete', [{'uuid': update['uuid']} for update in updates])
+        for operation, measurement in (('create', create_measurement), ('update', update_measurement),
+                                       ('delete', delete_measurement)):
+            timings[operation].append((measurement.milliseconds, measurement.number_of_queries))
+
+    report = ['Bulk endpoints with {} movies per request'.format(number_of_movies)]
+    for operation, operation_timings in timings.items():
+        milliseconds, number_of_queries = min(operation_timings)
+        report.append('bulk {}: {} queries, {:.1f} ms, {:.0f} movies/s (best of {})'.format(
+            operation, number_of_queries, milliseconds, number_of_movies / milliseconds * 1000, repeat))
+
+    # the same movies created with one request each, on a sample of them
+    sample = movies_data[:100]
+    with Measurement() as measurement:
+        for movie_data in sample:
+            request = factory.post('/store/movies/', dict(movie_data, genres=movie_data['genres'][:1]), format='json')
+            force_authenticate(request, user=user)
+            create_view(request)
+    report.append('one request per movie: {:.1f} queries, {:.2f} ms, {:.0f} movies/s (on {} movies)'.format(
+        measurement.number_of_queries / len(sample), measurement.milliseconds / len(sample),
+        len(sample) / measurement.elapsed, len(sample)))
+    return report
+
+
+@benchmark('movie_serialization', default_size=1000)
+def movie_serialization(number_of_movies, repeat):
+    """Lists a page of movies with all the fields and with sparse fieldsets, comparing their size and time"""
+    genres = Genre.objects.bulk_create([Genre(name='Benchmark genre {}'.format(i)) for i in range(10)])
+    movie_ids = create_movies(number_of_movies)
+    through_model = Movie.genres.through
+    through_model.objects.bulk_create([through_model(movie_id=movie_id, genre_id=genre.id) for movie_id in movie_ids
+                                       for genre in genres[:3]], batch_size=10000)
+    user = create_staff_user()
+    list_view = MovieViewSet.as_view({'get': 'list'})
+
+    report = ['Movies list page of {} movies'.format(number_of_movies)]
+    for params in ({}, {'omit_url': 'true'}, {'exclude': 'summary'}, {'fields': 'uuid,title,year'}):
+        timings = []
+        for _ in range(repeat):
+            bump_model_version(Movie)  # the responses are cached
+            request = APIRequestFactory().get('/store/movies/', dict(params, page_size=number_of_movies))
+            force_authenticate(request, user=user)
+            with Measurement() as measurement:
+                response = list_view(request).render()
+            timings.append(measurement.milliseconds)
+        report.append('{}: {} bytes, {} queries, {:.1f} ms (best of {})'.format(
+            params or 'all fields', len(response.content), measurement.number_of_queries, min(timings), repeat))
+    return report
+
+
+@benchmark('compiled_read', default_size=1000)
+def compiled_read(number_of_rows, repeat):
+    """Lists a page of genres, movies, rentals and users with the compiled read serializers and the serializers"""
+    genres = Genre.objects.bulk_create([Genre(name='Benchmark genre {}'.format(i)) for i in range(number_of_rows)])
+    movie_ids = create_movies(number_of_rows)
+    through_model = Movie.genres.through
+    through_model.objects.bulk_create([through_model(movie_id=movie_id, genre_id=genre.id) for movie_id in movie_ids
+                                       for genre in random.sample(genres, 3)], batch_size=10000)
+    users = get_user_model().objects.bulk_create([
+        get_user_model()(email='benchmark{}@moviestore.com'.format(i), first_name='Benchmark', last_name=str(i))
+        for i in range(number_of_rows)])
+    Rental.objects.bulk_create([Rental(user=user, movie_id=movie_id) for user, movie_id in zip(users, movie_ids)])
+    user = create_staff_user()
+
+    report = ['Lists with a page of {} rows'.format(number_of_rows)]
+    for name, viewset, path in (('genres', GenreViewSet, '/store/genres/'), ('movies', MovieViewSet, '/store/movies/'),
+                                ('rentals', RentalViewSet, '/store/rentals/'), ('users', UserViewSet, '/iam/users/')):
+        list_view = viewset.as_view({'get': 'list'})
+        for compiled in (False, True):
+            timings = []
+            for _ in range(repeat):
+                bump_model_version(Genre)  # the responses are cached
+                bump_model_version(Movie)
+                request = APIRequestFactory().get(path, {'page_size': number_of_rows})
+                force_authenticate(request, user=user)
+                with override_settings(MOVIE_STORE_COMPILED_READ=compiled), Measurement() as measurement:
+                    list_view(request).render()
+                timings.append(measurement.elapsed)
+            report.append('{} {}: {} queries, {:.1f} ms, {:.0f} rows/s (best of {})'.format(
+                name, 'compiled' if compiled else 'serializer', measurement.number_of_queries, min(timings) * 1000,
+                number_of_rows / min(timings), repeat))
+    return report
+
+
+@benchmark('rental_returns', default_size=10000)
+def rental_returns(number_of_rentals, repeat, per_request_sample=500):
+    """Returns rentals with one request each (on a sample of them) and all of them with the bulk return endpoint"""
+    movie_ids = create_movies(number_of_rentals)
+    users = get_user_model().objects.bulk_create([
+        get_user_model()(email='benchmark{}@moviestore.com'.format(i), first_name='Benchmark', last_name=str(i))
+        for i in range(number_of_rentals)])
+    rentals = Rental.objects.bulk_create([Rental(user=user, movie_id=movie_id)
+                                          for user, movie_id in zip(users, movie_ids)])
+    user = create_staff_user()
+    factory = APIRequestFactory()
+    return_view = RentalViewSet.as_view({'patch': 'partial_update'})
+    bulk_return_view = RentalViewSet.as_view({'post': 'bulk_return'})
+
+    sample = rentals[:per_request_sample]
+    timings = {'one request per rental': [], 'bulk return': []}
+    for _ in range(repeat):
+        # every measurement returns the same active rentals, which are restored by a rollback
+        with transaction.atomic(), Measurement() as measurement:
+            for rental in sample:
+                request = factory.patch('/store/rentals/{}/'.format(rental.uuid), {'returned': True}, format='json')
+                force_authenticate(request, user=user)
+                response = return_view(request, uuid=str(rental.uuid))
+                assert response.status_code == 200, response.data
+                response.render()
+            transaction.set_rollback(True)
+        timings['one request per rental'].append((measurement.elapsed, measurement.number_of_queries, len(sample)))
+
+        with transaction.atomic(), Measurement() as measurement:
+            request = factory.post('/store/rentals/bulk-return/', {'uuids': [str(rental.uuid) for rental in rentals]},
+                                   format='json')
+            force_authenticate(request, user=user)
+            response = bulk_return_view(request)
+            assert response.data['count'] == len(rentals), response.data
+            response.render()
+            transaction.set_rollback(True)
+        timings['bulk return'].append((measurement.elapsed, measurement.number_of_queries, len(rentals)))
+
+    report = ['Rental returns with {} active rentals'.format(number_of_rentals)]
+    for name, operation_timings in timings.items():
+        elapsed, number_of_queries, number_of_returns = min(operation_timings)
+        report.append('{}: {} queries, {:.1f} ms, {:.0f} returns/s (best of {}, {} returns)'.format(
+            name, number_of_queries, elapsed * 1000, number_of_returns / elapsed, repeat, number_of_returns))
+    return report
@@ -0,0 +1,185 @@
+"""
+Batch operations on the movies, used by the bulk import command and the bulk endpoints.
+They write with bulk queries, which do not send the model signals, so they update the modification times
+and bump the model versions (see common.cache) themselves.
+"""
+from django.db import connection
+from django.db.models import CASCADE
+from django.db.models.functions import Lower
+from django.utils import timezone
+from common.cache import bump_deleted_model_versions, bump_model_version_on_commit
+from .genres import genre_resolver
+from .models import Genre, Movie
+
+movie_fields = ('title', 'year', 'summary', 'director')
+update_page_size = 1000
+
+
+class GenreMap:
+    """Maps genre names (case insensitive) to genre ids, resolving the unknown names in batches"""
+
+    def __init__(self, create_missing=False):
+        self.create_missing = create_missing
+        self.ids = {}
+        self.created = 0
+
+    def resolve(self, names):
+        """Resolves a batch of names from the genre cache (two queries if the missing genres are created)"""
+        missing_names = set(name.lower() for name in names) - set(self.ids.keys())
+        if not missing_names:
+            return
+        self.ids.update(self.lookup(missing_names))
+        missing_names -= set(self.ids.keys())
+        if missing_names and self.create_missing:
+            new_genres = {}
+            for name in names:
+                new_genres.setdefault(name.lower(), Genre(name=name))
+            new_genres = [new_genres[name] for name in missing_names]
+            Genre.objects.bulk_create(new_genres, ignore_conflicts=True)
+            # the genres that already exist (e.g. created concurrently) are skipped by the insert, so only the
+            # genres read back with the uuids of the new ones were created
+            new_uuids = set(genre.uuid for genre in new_genres)
+            genres = Genre.objects.annotate(lower_name=Lower('name')).filter(lower_name__in=missing_names)\
+                .values_list('lower_name', 'id', 'uuid')
+            for lower_name, genre_id, uuid in genres:
+                self.ids[lower_name] = genre_id
+                self.created += uuid in new_uuids
+            bump_model_version_on_commit(Genre)
+            genre_resolver.clear_on_write()
+
+    @staticmethod
+    def lookup(lower_names):
+        return genre_resolver.get_ids(lower_names)
+
+    def discard_deleted(self):
+        """Discards the genres deleted since they were resolved (with one query), returns their names"""
+        existing_ids = set(Genre.objects.filter(pk__in=self.ids.values()).values_list('pk', flat=True))
+        deleted_names = [name for name, genre_id in self.ids.items() if genre_id not in existing_ids]
+        for name in deleted_names:
+            del self.ids[name]
+        return deleted_names
+
+    def get(self, name):
+        return self.ids.get(name.lower())
+
+
+def get_existing_movies(keys):
+    """Gets the ids of the existing movies by (title, year) with one query"""
+    movies = Movie.objects.filter(title__in=set(title for title, _ in keys)).values_list('id', 'title', 'year')
+    return {(title, year): movie_id for movie_id, title, year in movies if (title, year) in keys}
+
+
+def save_movies(movies_data, genre_map, upsert=False):
+    """
+    Creates (or with upsert, creates or updates by title and year) a batch of movies with their genres.
+    The movies data are dicts with the movie fields and a list of genre names.
+    Returns the created and the updated movies.
+    """
+    genre_map.resolve(set(name for movie_data in movies_data for name in movie_data['genres']))
+
+    existing_movies = {}
+    if upsert:
+        # the last occurrence of a title and year in the batch wins
+        movies_data = list({(m['title'], m['year']): m for m in movies_data}.values())
+        existing_movies = get_existing_movies(set((m['title'], m['year']) for m in movies_data))
+    new_movies_data = [m for m in movies_data if (m['title'], m['year']) not in existing_movies]
+    updated_movies_data = [m for m in movies_data if (m['title'], m['year']) in existing_movies]
+    now = timezone.now()
+
+    new_movies = [Movie(modified=now, **{f: m[f] for f in movie_fields}) for m in new_movies_data]
+    Movie.objects.bulk_create(new_movies)
+    if new_movies and new_movies[0].pk is None:  # the database does not return the ids of bulk inserts
+        ids = dict(Movie.objects.filter(uuid__in=[m.uuid for m in new_movies]).values_list('uuid', 'id'))
+        for movie in new_movies:
+            movie.pk = ids[movie.uuid]
+
+    updated_movies = [Movie(pk=existing_movies[(m['title'], m['year'])], modified=now,
+                            **{f: m[f] for f in movie_fields}) for m in updated_movies_data]
+    update_movies(updated_movies, fields=movie_fields + ('modified',))
+
+    set_movies_genres(new_movies, [m['genres'] for m in new_movies_data], genre_map, replace=False)
+    set_movies_genres(updated_movies, [m['genres'] for m in updated_movies_data], genre_map)
+    bump_model_version_on_commit(Movie)
+    return new_movies, updated_movies
+
+
+def patch_movies(movies, movies_data, genre_map):
+    """
+    Partially updates a batch of movies, each with the fields (and genres) in its data,
+    with at most three queries.
+    """
+    now = timezone.now()
+    fields = set()
+    for movie, movie_data in zip(movies, movies_data):
+        for field in movie_fields:
+            if field in movie_data:
+                setattr(movie, field, movie_data[field])
+                fields.add(field)
+        movie.modified = now
+    update_movies(movies, fields=tuple(sorted(fields)) + ('modified',))
+
+    genres_data = [(movie, movie_data['genres']) for movie, movie_data in zip(movies, movies_data)
+                   if 'genres' in movie_data]
+    set_movies_genres([movie for movie, _ in genres_data], [genres for _, genres in genres_data], genre_map)
+    bump_model_version_on_commit(Movie)
+
+
+def delete_movies(movies):
+    """
+    Deletes a batch of movies with their rentals (archived or not), genre links, co-rentals and daily revenue.
+    The related rows are deleted with one query per table of the cascades (fast deletes, their models have no
+    delete receivers) and the movies with one query, instead of collecting and signaling the movies row by row,
+    and the versions are bumped once.
+    """
+    if not movies:
+        return
+    movie_ids = [movie.pk for movie in movies]
+    cascades = [field for field in Movie._meta.get_fields(include_hidden=True)
+                if field.auto_created and not field.concrete and field.on_delete is CASCADE]
+    for field in cascades:
+        field.related_model._base_manager.filter(**{field.field.name + '__in': movie_ids}).delete()
+    quote_name = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM {} WHERE {} IN ({})'.format(
+            quote_name(Movie._meta.db_table), quote_name(Movie._meta.pk.column), ', '.join(['%s'] * len(movie_ids))),
+            movie_ids)
+    bump_deleted_model_versions(Movie)
+
+
+def update_movies(movies, fields):
+    """
+    Updates the fields of a batch of movies.
+    On postgres it is one UPDATE ... FROM (VALUES ...) query per page of movies, since bulk_update builds
+    a CASE expression per field and movie, which is mostly python overhead for large batches.
+    """
+    if not movies:
+        return
+    if connection.vendor != 'postgresql':
+        Movie.objects.bulk_update(movies, fields=fields, batch_size=update_page_size)
+        return
+
+    from psycopg2.extras import execute_values
+    quote_name = connection.ops.quote_name
+    columns = [Movie._meta.get_field(field).column for field in fields]
+    sql = 'UPDATE {table} SET {assignments} FROM (VALUES %s) AS v (id, {columns}) WHERE {table}.id = v.id'.format(
+        table=quote_name(Movie._meta.db_table),
+        assignments=', '.join('{column} = v.{column}'.format(column=quote_name(column)) for column in columns),
+        columns=', '.join(quote_name(column) for column in columns))
+    rows = [(movie.pk, *(getattr(movie, field) for field in fields)) for movie in movies]
+    with connection.cursor() as cursor:
+        execute_values(cursor.cursor, sql, rows, page_size=update_page_size)
+
+
+def set_movies_genres(movies, movies_genres, genre_map, replace=True):
+    """Sets the genres of a batch of movies (the unknown genres are skipped) with at most two queries"""
+    if not movies:
+        return
+    through_model = Movie.genres.through
+    if replace:
+        # a fast delete, the through models have no delete receivers
+        through_model.objects.filter(movie_id__in=[movie.pk for movie in movies]).delete()
+    genre_ids = ((movie.pk, genre_map.get(name)) for movie, names in zip(movies, movies_genres) for name in names)
+    through_model.objects.bulk_create([through_model(movie_id=movie_id, genre_id=genre_id)
+                                       for movie_id, genre_id in genre_ids if genre_id is not None],
+                                      ignore_conflicts=True)
+    bump_model_version_on_commit(through_model)
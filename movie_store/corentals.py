@@ -0,0 +1,58 @@
+"""
+"Customers also rented": the movies rented by the same users, served from the precomputed CoRental table.
+A pair of movies counts the users who have rented both of them, so renting a movie again changes nothing.
+The table is updated incrementally when a rental is created (see add_rental), and rebuilt from all the rentals
+with the rebuild_corentals command, which also drops the counts of the deleted rentals (they are not subtracted).
+"""
+from django.db import connection, transaction
+from common.cache import bump_model_version_on_commit
+from common.db import insert_or_increment
+from .models import ArchivedRental, CoRental, Rental
+
+
+def add_rental(rental):
+    """Counts a new rental with the other movies of its user, with one query for them and one upsert"""
+    # the union of the rented and the archived movies of the user (without duplicates)
+    other_movie_ids = set(Rental.objects.filter(user_id=rental.user_id).exclude(pk=rental.pk).order_by()
+                          .values_list('movie_id', flat=True)
+                          .union(ArchivedRental.objects.filter(user_id=rental.user_id).order_by()
+                                 .values_list('movie_id', flat=True)))
+    if not other_movie_ids or rental.movie_id in other_movie_ids:
+        return
+    pairs = [pair for other_movie_id in other_movie_ids
+             for pair in ((rental.movie_id, other_movie_id), (other_movie_id, rental.movie_id))]
+    # the rows are upserted (and locked) in key order, like by the concurrent rentals, so they cannot deadlock
+    rows = [{'movie': movie_id, 'other_movie': other_movie_id, 'count': 1}
+            for movie_id, other_movie_id in sorted(pairs)]
+    insert_or_increment(CoRental, rows, unique_fields=('movie', 'other_movie'), increment_fields=('count',))
+    bump_model_version_on_commit(CoRental)
+
+
+def rebuild_corentals():
+    """Recomputes the co-rentals of all the movies from the rentals (archived or not), with one grouped query"""
+    quote_name = connection.ops.quote_name
+    corental_table = quote_name(CoRental._meta.db_table)
+    # the union has no duplicates
+    user_movies = 'SELECT user_id, movie_id FROM {} UNION SELECT user_id, movie_id FROM {}'.format(
+        quote_name(Rental._meta.db_table), quote_name(ArchivedRental._meta.db_table))
+    with transaction.atomic():
+        CoRental.objects.all().delete()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'INSERT INTO {corental_table} (movie_id, other_movie_id, count) '
+                'SELECT a.movie_id, b.movie_id, COUNT(*) FROM ({user_movies}) a '
+                'INNER JOIN ({user_movies}) b ON a.user_id = b.user_id AND a.movie_id <> b.movie_id '
+                'GROUP BY a.movie_id, b.movie_id'.format(corental_table=corental_table, user_movies=user_movies))
+            count = cursor.rowcount
+        bump_model_version_on_commit(CoRental)
+    return count
+
+
+def get_also_rented(movie_uuid, limit):
+    """
+    Gets the co-rentals of a movie, the other movies with the most common users first, with one lookup of the
+    (movie, -count, other_movie) index. The other movies are selected, with their genres prefetched.
+    """
+    return CoRental.objects.filter(movie__uuid=movie_uuid).order_by('-count', 'other_movie_id')\
+        .select_related('other_movie').defer('other_movie__search_vector')\
+        .prefetch_related('other_movie__genres')[:limit]
@@ -1,19 +1,111 @@
+import re
+from datetime import datetime, time, timedelta
+from functools import reduce
+from operator import add, and_, or_
 from django.core.exceptions import ValidationError
-from rest_framework.filters import BaseFilterBackend
-from .models import Genre
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connections
+from django.db.models import Case, Count, F, FloatField, Q, Value, When
+from django.db.models.functions import Cast, Upper
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.filters import BaseFilterBackend, OrderingFilter, SearchFilter
+from .genres import genre_resolver
+from .models import Movie
 
 
 # ----- Movie filters -----
-class YearFilter(BaseFilterBackend):
-    """Filtering by year"""
+class MovieSearchFilter(SearchFilter):
+    """
+    Full text search over the movies, with the results ordered by relevance (unless a valid ordering is requested).
+    On postgres it matches the search terms against the indexed search vector of the title, director and summary,
+    the last term as a word prefix too (e.g. godf matches Godfather).
+    On other databases it falls back to case insensitive matching of every term in the view's search_fields,
+    where a match in a field weighs more than a match in the fields that follow it.
+    """
+    search_config = 'english'
+    search_description = ('Search terms: all of them should match the title, director or summary, the last one as a '
+                          'word prefix too. The results are ordered by relevance, unless a valid order_by is given.')
+
     def filter_queryset(self, request, queryset, view):
-        year = request.query_params.get('year')
-        if year is not None:
-            try:
-                year = int(year)
-            except (ValueError, TypeError) as e:
+        search_terms = self.get_search_terms(request)
+        if not search_terms:
+            return queryset
+
+        if connections[queryset.db].vendor == 'postgresql':
+            search_query = self.get_search_query(search_terms)
+            if search_query is None:
                 return queryset.none()
-            return queryset.filter(year=year)
+            # ts_rank is a float4, cast to a float8 so that it compares exactly with its value in a cursor
+            queryset = queryset.filter(search_vector=search_query)\
+                .annotate(search_rank=Cast(SearchRank(F('search_vector'), search_query), FloatField()))
+        else:
+            search_fields = self.get_search_fields(view, request)
+            weights = range(len(search_fields), 0, -1)
+            term_matches = [reduce(or_, (Q(**{field + '__icontains': term}) for field in search_fields))
+                            for term in search_terms]
+            rank = reduce(add, (Case(When(Q(**{field + '__icontains': term}), then=Value(float(weight))),
+                                     default=Value(0.0), output_field=FloatField())
+                                for term in search_terms for field, weight in zip(search_fields, weights)))
+            queryset = queryset.filter(reduce(and_, term_matches)).annotate(search_rank=rank)
+
+        # order by relevance, keeping the default ordering for the ties
+        if not self.get_requested_ordering(request, queryset, view):
+            queryset = queryset.order_by('-search_rank', *queryset.query.order_by)
+        return queryset
+
+    def get_search_query(self, search_terms):
+        """
+        Gets the text search query of the words of the search terms, which should all match, the last one as a
+        prefix. Returns None when there are no words.
+        """
+        words = [word for term in search_terms for word in re.findall(r'[^\W_]+', term)]
+        if not words:
+            return None
+        return SearchQuery(' & '.join(words) + ':*', search_type='raw', config=self.search_config)
+
+    def get_requested_ordering(self, request, queryset, view):
+        """Gets the valid fields of the requested ordering (see OrderingFilter.get_ordering), or an empty list"""
+        ordering_filter = OrderingFilter()
+        params = request.query_params.get(ordering_filter.ordering_param)
+        if not params:
+            return []
+        fields = [param.strip() for param in params.split(',')]
+        return ordering_filter.remove_invalid_fields(queryset, fields, view, request)
+
+
+def parse_values(value, parse=str):
+    """Parses the comma separated values of a query parameter, raises a ValueError for an invalid value"""
+    values = set(parse(v.strip()) for v in value.split(',') if v.strip())
+    if not values:
+        raise ValueError('No values')
+    return values
+
+
+class YearFilter(BaseFilterBackend):
+    """
+    Filtering by year:
+    - year: one or more years (comma separated),
+    - year_min/year_max: the first/last year of a range,
+    - decade: the first year of a decade (e.g. 1990 or 1990s).
+    All of them are combined, in a single query. An invalid year returns no movies.
+    """
+    def filter_queryset(self, request, queryset, view):
+        query_params = request.query_params
+        try:
+            if query_params.get('year') is not None:
+                queryset = queryset.filter(year__in=parse_values(query_params['year'], int))
+            if query_params.get('year_min') is not None:
+                queryset = queryset.filter(year__gte=int(query_params['year_min']))
+            if query_params.get('year_max') is not None:
+                queryset = queryset.filter(year__lte=int(query_params['year_max']))
+            if query_params.get('decade') is not None:
+                decade = int(query_params['decade'].strip().rstrip('s'))
+                if decade % 10:
+                    raise ValueError('Not the first year of a decade')
+                queryset = queryset.filter(year__gte=decade, year__lte=decade + 9)
+        except (ValueError, TypeError):
+            return queryset.none()
         return queryset
 
 
@@ -25,15 +117,16 @@ class GenreFilter(BaseFilterBackend):
     def filter_queryset(self, request, queryset, view):
         queried_genres = request.query_params.get('genre')
         if queried_genres is not None:
-            cleared_genres = [genre.strip() for genre in queried_genres.split(',')]
-            genres = Genre.objects.none()
-            # get the requested genres
-            # case insensitive alternative to genres = Genre.objects.filter(name__in=cleared_genres)
-            for g in cleared_genres:
-                genres |= Genre.objects.filter(name__iexact=g)
-            if len(genres) > 0:
-                for genre in genres:
-                    queryset = queryset.filter(id__in=genre.movies.all())
+            cleared_genres = set(genre.strip().lower() for genre in queried_genres.split(','))
+            # get the requested genres from the genre cache (case insensitive)
+            genre_ids = list(genre_resolver.get_ids(cleared_genres).values())
+            if len(genre_ids) > 0:
+                # group the movie-genre pairs of the requested genres by movie and keep the movies
+                # that have a pair for every requested genre (GROUP BY movie_id HAVING COUNT(*) = n)
+                movies_with_all_genres = Movie.genres.through.objects.filter(genre_id__in=genre_ids)\
+                    .values('movie_id').annotate(genres_count=Count('genre_id'))\
+                    .filter(genres_count=len(genre_ids)).values('movie_id')
+                queryset = queryset.filter(id__in=movies_with_all_genres)
             else:
                 queryset = queryset.none()
         return queryset
@@ -41,12 +134,17 @@ class GenreFilter(BaseFilterBackend):
 
 class DirectorFilter(BaseFilterBackend):
     """
-    Filtering by director.
+    Filtering by director (case insensitive). Can filter by multiple directors (comma separated).
+    The upper case director is matched, which is indexed.
     """
     def filter_queryset(self, request, queryset, view):
         director = request.query_params.get('director')
         if director is not None:
-            return queryset.filter(director=director)
+            try:
+                directors = parse_values(director, str.upper)
+            except ValueError:
+                return queryset.none()
+            return queryset.alias(upper_director=Upper('director')).filter(upper_director__in=directors)
         return queryset
 
 
@@ -92,3 +190,58 @@ class StatusFilter(BaseFilterBackend):
         if status == 'active':
             return queryset.filter(returned=False)
         return queryset
+
+
+class RentalDateFilter(BaseFilterBackend):
+    """
+    Filtering by rental date:
+    - rental_date_min/rental_date_max: the first/last rental date (or datetime, in ISO 8601), the last date is
+      included as a whole.
+    The archived rentals are partitioned by rental date, so only the partitions of the dates are read, and a
+    rental_date_min after the archive horizon only reads the rentals (see views.RentalViewSet.get_rental_model).
+    An invalid date returns no rentals.
+    """
+    def filter_queryset(self, request, queryset, view):
+        query_params = request.query_params
+        try:
+            if query_params.get('rental_date_min') is not None:
+                queryset = queryset.filter(rental_date__gte=parse_date_or_datetime(query_params['rental_date_min']))
+            if query_params.get('rental_date_max') is not None:
+                value = query_params['rental_date_max']
+                if parse_datetime(value) is None:
+                    # a date includes the whole day
+                    queryset = queryset.filter(rental_date__lt=parse_date_or_datetime(value) + timedelta(days=1))
+                else:
+                    queryset = queryset.filter(rental_date__lte=parse_date_or_datetime(value))
+        except ValueError:
+            return queryset.none()
+        return queryset
+
+
+def parse_date_or_datetime(value):
+    """Parses an ISO 8601 datetime, or a date (as the start of the day), in the current time zone if naive"""
+    parsed = parse_datetime(value)
+    if parsed is None:
+        parsed_date = parse_date(value)
+        if parsed_date is None:
+            raise ValueError('Not a date: {}'.format(value))
+        parsed = datetime.combine(parsed_date, time())
+    return timezone.make_aware(parsed) if timezone.is_naive(parsed) else parsed
+
+
+class FeeFilter(BaseFilterBackend):
+    """
+    Filtering by the current fee of the rentals (the fee annotation, see logic.fee_expression):
+    - fee_min/fee_max: the lowest/highest fee.
+    An invalid fee returns no rentals.
+    """
+    def filter_queryset(self, request, queryset, view):
+        query_params = request.query_params
+        try:
+            if query_params.get('fee_min') is not None:
+                queryset = queryset.filter(fee__gte=float(query_params['fee_min']))
+            if query_params.get('fee_max') is not None:
+                queryset = queryset.filter(fee__lte=float(query_params['fee_max']))
+        except ValueError:
+            return queryset.none()
+        return queryset
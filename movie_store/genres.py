@@ -0,0 +1,99 @@
+"""
+In-process cache of the genres, which resolves genre names (case insensitive) and uuids without queries.
+The genres are a small table that rarely changes, so all of them are kept in memory, in a snapshot stamped with
+the latest modification time and the number of the genres. The stamp is checked against the database (with one
+aggregate query) at most every MOVIE_STORE_GENRE_CACHE['CHECK_INTERVAL'] seconds, and the genres are reloaded
+(with one query) when it has changed, so the writes of the other processes are seen after that interval at most.
+The local snapshot is also dropped on the genre writes (the genre signals, see movie_store.signals, and the bulk
+writes), so a process sees its own writes right away. After a write inside a transaction, the snapshots are not
+kept until the transaction is committed, since they include the uncommitted genres, which would remain after a
+rollback.
+"""
+from collections import namedtuple
+from threading import local
+from time import monotonic
+from uuid import UUID
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Count, Max
+from .models import Genre
+
+GenreSnapshot = namedtuple('GenreSnapshot', ('stamp', 'checked', 'by_name', 'by_uuid'))
+
+
+class GenreResolver:
+    """Maps the genre names (case insensitive) and uuids to genres, from a snapshot of the genres table"""
+
+    def __init__(self):
+        self.fields = [field.attname for field in Genre._meta.concrete_fields]
+        self.id_index = self.fields.index(Genre._meta.pk.attname)
+        self.snapshot = None
+        # the transactions are per thread, like the database connections
+        self.local = local()
+
+    def clear(self):
+        self.snapshot = None
+        self.local.uncommitted_writes = False
+
+    def clear_on_write(self):
+        """Drops the snapshot after a write of the genres, it is not kept again before the write is committed"""
+        self.clear()
+        if self.in_transaction():
+            self.local.uncommitted_writes = True
+            transaction.on_commit(self.clear, using=Genre.objects.db)
+
+    @staticmethod
+    def in_transaction():
+        return connections[Genre.objects.db].in_atomic_block
+
+    @staticmethod
+    def get_stamp():
+        stamp = Genre.objects.order_by().aggregate(modified=Max('modified'), count=Count('pk'))
+        return stamp['modified'], stamp['count']
+
+    def get_snapshot(self):
+        uncommitted_writes = getattr(self.local, 'uncommitted_writes', False)
+        if uncommitted_writes and not self.in_transaction():
+            # the transaction of the writes has been rolled back (a commit clears the snapshot)
+            self.clear()
+            uncommitted_writes = False
+        snapshot = self.snapshot
+        # after uncommitted writes, the snapshot of another thread does not have them
+        if snapshot is not None and not uncommitted_writes \
+                and monotonic() - snapshot.checked < settings.MOVIE_STORE_GENRE_CACHE['CHECK_INTERVAL']:
+            return snapshot
+        # the stamp is read before the genres, so a snapshot is never older than its stamp
+        stamp = self.get_stamp()
+        if snapshot is None or snapshot.stamp != stamp:
+            rows = list(Genre.objects.order_by().values_list(*self.fields))
+            uuid_index, name_index = self.fields.index('uuid'), self.fields.index('name')
+            snapshot = GenreSnapshot(stamp, monotonic(), {row[name_index].lower(): row for row in rows},
+                                     {row[uuid_index]: row for row in rows})
+        else:
+            snapshot = snapshot._replace(checked=monotonic())
+        if not uncommitted_writes:
+            # the snapshot is replaced as a whole, so concurrent readers always see a consistent one
+            self.snapshot = snapshot
+        return snapshot
+
+    def to_genre(self, row):
+        # a new instance every time, the cached rows are shared
+        return None if row is None else Genre.from_db(Genre.objects.db, self.fields, row)
+
+    def get_by_name(self, name):
+        return self.to_genre(self.get_snapshot().by_name.get(name.lower()))
+
+    def get_by_uuid(self, uuid):
+        try:
+            uuid = uuid if isinstance(uuid, UUID) else UUID(str(uuid))
+        except ValueError:
+            return None
+        return self.to_genre(self.get_snapshot().by_uuid.get(uuid))
+
+    def get_ids(self, names):
+        """Gets the ids of the known genre names, as a dict by lower case name"""
+        by_name = self.get_snapshot().by_name
+        return {name.lower(): by_name[name.lower()][self.id_index] for name in names if name.lower() in by_name}
+
+
+genre_resolver = GenreResolver()
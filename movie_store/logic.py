@@ -1,9 +1,15 @@
 from math import ceil
+from django.db import transaction
+from django.db.models import Case, DateTimeField, FloatField, Func, Value, When
+from django.db.models.functions import Ceil, Greatest, Least
 from django.utils import timezone
+from common.cache import bump_model_version_on_commit
+from .reports import add_returns
 
 
-def calculate_charge(rental, initial_charge=1.0, default_charge=0.5, initial_charge_days=3):
-    current_time = timezone.now()
+def calculate_charge(rental, initial_charge=1.0, default_charge=0.5, initial_charge_days=3, current_time=None):
+    if current_time is None:
+        current_time = timezone.now()
     if current_time < rental.rental_date:
         return 0.0
     time_diff = current_time - rental.rental_date
@@ -12,3 +18,48 @@ def calculate_charge(rental, initial_charge=1.0, default_charge=0.5, initial_cha
         return initial_charge * initial_charge_days + default_charge * (number_of_days - initial_charge_days)
     return initial_charge * number_of_days
 
+
+class ElapsedSeconds(Func):
+    """The seconds from a datetime expression until a datetime (negative if the expression is later)"""
+    arg_joiner = ' - '
+    output_field = FloatField()
+
+    def __init__(self, expression, until, **extra):
+        super().__init__(Value(until, output_field=DateTimeField()), expression, **extra)
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        return self.as_sql(compiler, connection, template='EXTRACT(EPOCH FROM (%(expressions)s))', **extra_context)
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return self.as_sql(compiler, connection, template='((julianday(%(expressions)s)) * 86400.0)',
+                           arg_joiner=') - julianday(', **extra_context)
+
+
+def charge_expression(until, initial_charge=1.0, default_charge=0.5, initial_charge_days=3):
+    """The charge of a rental (see calculate_charge) computed by the database, for the rentals returned until then"""
+    days = Greatest(Ceil(ElapsedSeconds('rental_date', until) / Value(86400.0)), Value(0.0))
+    return Value(initial_charge) * Least(days, Value(float(initial_charge_days))) + \
+        Value(default_charge) * Greatest(days - Value(float(initial_charge_days)), Value(0.0))
+
+
+def fee_expression(until):
+    """
+    The current fee of the rentals computed by the database, so that the rentals can be filtered, ordered and summed
+    by it: the charge until then of the active rentals (see calculate_charge), 0 for the returned rentals.
+    """
+    return Case(When(returned=False, then=charge_expression(until)), default=Value(0.0), output_field=FloatField())
+
+
+def return_rentals(rentals):
+    """
+    Returns the active rentals of a queryset with one conditional update, which computes their payments, so a
+    rental that is returned concurrently is returned (and charged) once. The payments are added to the daily
+    revenue of the movies (see reports.add_returns). Returns the number of the returned rentals.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        count = rentals.filter(returned=False).update(returned=True, return_date=now, payment=charge_expression(now))
+        if count:
+            add_returns(rentals.filter(returned=True, return_date=now), timezone.localdate(now))
+            bump_model_version_on_commit(rentals.model)
+    return count
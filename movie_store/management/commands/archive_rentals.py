@@ -0,0 +1,35 @@
+from datetime import timedelta
+from time import perf_counter
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from movie_store.archive import archive_rentals
+
+
+class Command(BaseCommand):
+    help = 'Moves the returned rentals rented before the archive horizon to the archived rentals, in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--horizon-days', type=int, default=None,
+                            help='Archive the rentals rented more than this many days ago (the setting by default, '
+                                 'or more)')
+        parser.add_argument('--batch-size', type=int, default=None, help='The number of rentals moved per batch')
+
+    def handle(self, *args, **options):
+        # the rentals list only reads the rentals after the horizon of the settings, which must not be archived
+        min_horizon_days = settings.MOVIE_STORE_RENTAL_ARCHIVE['HORIZON_DAYS']
+        if options['horizon_days'] is not None and options['horizon_days'] < min_horizon_days:
+            raise CommandError('--horizon-days should be at least {} (the horizon of the settings)'.format(
+                min_horizon_days))
+        horizon = None
+        if options['horizon_days'] is not None:
+            horizon = timezone.now() - timedelta(days=options['horizon_days'])
+        start = perf_counter()
+        count = 0
+        try:
+            for batch_count in archive_rentals(horizon=horizon, batch_size=options['batch_size']):
+                count += batch_count
+                print('{} rentals archived ({:.0f} rentals/s)'.format(count, count / (perf_counter() - start)))
+        except ValueError as e:
+            raise CommandError(e)
+        print('Archive finished in {:.1f}s: {} rentals archived'.format(perf_counter() - start, count))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand, CommandError
+from movie_store.benchmarks import BENCHMARKS, run_benchmark
+
+
+class Command(BaseCommand):
+    help = 'Runs a benchmark with generated data (the data is rolled back at the end)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('name', choices=sorted(BENCHMARKS.keys()), help='The benchmark to run')
+        parser.add_argument('--size', type=int, help='The number of generated rows (benchmark specific default)')
+        parser.add_argument('--repeat', type=int, default=3, help='How many times to repeat each measurement')
+
+    def handle(self, *args, **options):
+        if options['repeat'] < 1:
+            raise CommandError('--repeat should be at least 1')
+        for line in run_benchmark(options['name'], size=options['size'], repeat=options['repeat']):
+            print(line)
@@ -0,0 +1,87 @@
+import csv
+import json
+import sys
+from itertools import islice
+from time import perf_counter
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from movie_store.bulk import GenreMap, save_movies
+
+
+class Command(BaseCommand):
+    help = 'Imports movies from a CSV or JSONL file (streamed in chunks, with bulk inserts/updates)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='The file to import, - for the standard input')
+        parser.add_argument('--format', choices=('csv', 'jsonl'),
+                            help='The format of the file (by default from the file extension)')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Number of movies per bulk write')
+        parser.add_argument('--upsert', action='store_true',
+                            help='Update the existing movies with the same title and year, instead of adding new')
+        parser.add_argument('--create-genres', action='store_true',
+                            help='Create the missing genres, instead of skipping them')
+
+    def handle(self, *args, **options):
+        file_format = options['format'] or options['path'].rsplit('.', 1)[-1].lower()
+        if file_format not in ('csv', 'jsonl'):
+            raise CommandError('Unknown file format, it should be set with --format')
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size should be at least 1')
+
+        input_file = sys.stdin if options['path'] == '-' else open(options['path'], newline='', encoding='utf-8')
+        try:
+            self.import_movies(self.read_movies(input_file, file_format), options)
+        finally:
+            if input_file is not sys.stdin:
+                input_file.close()
+
+    def import_movies(self, movies_data, options):
+        genre_map = GenreMap(create_missing=options['create_genres'])
+        created, updated = 0, 0
+        start = perf_counter()
+        while True:
+            chunk = list(islice(movies_data, options['chunk_size']))
+            if not chunk:
+                break
+            with transaction.atomic():
+                created_movies, updated_movies = save_movies(chunk, genre_map, upsert=options['upsert'])
+            created, updated = created + len(created_movies), updated + len(updated_movies)
+            print('{} movies imported ({:.0f} movies/s)'.format(created + updated,
+                                                                 (created + updated) / (perf_counter() - start)))
+
+        elapsed = perf_counter() - start
+        print('Import finished in {:.1f}s: {} movies created, {} movies updated, {} genres created, '
+              '{} invalid rows skipped ({:.0f} movies/s)'.format(elapsed, created, updated, genre_map.created,
+                                                                 self.skipped, (created + updated) / elapsed))
+
+    def read_movies(self, input_file, file_format):
+        """Reads the movies one by one (the file is never loaded in memory) and skips the invalid ones"""
+        self.skipped = 0
+        if file_format == 'csv':
+            rows, parse_row, first_line = csv.DictReader(input_file), dict, 2
+        else:
+            rows, parse_row, first_line = input_file, json.loads, 1
+        for line_number, row in enumerate(rows, start=first_line):
+            if not row or (isinstance(row, str) and not row.strip()):
+                continue
+            try:
+                yield self.clean_movie_data(parse_row(row))
+            except (AttributeError, KeyError, TypeError, ValueError) as e:
+                self.skipped += 1
+                print('Skipping invalid row {}: {}'.format(line_number, e))
+
+    @staticmethod
+    def clean_movie_data(row):
+        genres = row.get('genres') or []
+        if isinstance(genres, str):
+            genres = genres.split(',')
+        movie_data = {
+            'title': str(row['title']).strip(),
+            'year': int(row['year']),
+            'summary': str(row.get('summary') or ''),
+            'director': str(row['director']).strip(),
+            'genres': [genre.strip() for genre in genres if genre.strip()],
+        }
+        if not movie_data['title'] or not 0 <= movie_data['year'] <= 32767:
+            raise ValueError('invalid title or year')
+        return movie_data
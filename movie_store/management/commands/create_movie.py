@@ -1,5 +1,6 @@
 from django.apps import apps
 from django.core.management.base import BaseCommand
+from movie_store.genres import genre_resolver
 
 
 class Command(BaseCommand):
@@ -7,7 +8,6 @@ class Command(BaseCommand):
 
     def handle(self, *args, **options):
         movie_model = apps.get_model('movie_store', 'Movie')
-        genre_model = apps.get_model('movie_store', 'Genre')
         title = input('Enter title: ')
         year = input('Enter year: ')
         director = input('Enter director: ')
@@ -18,11 +18,11 @@ class Command(BaseCommand):
             movie = movie_model.objects.create(title=title, year=year, director=director, summary=summary)
             genres = [g.strip() for g in genres.split(',')]
             for g in genres:
-                try:
-                    genre = genre_model.objects.get(name=g)
-                    movie.genres.add(genre)
-                except genre_model.DoesNotExist:
+                genre = genre_resolver.get_by_name(g)
+                if genre is None:
                     print('Genre {} does not exist. Skipping...'.format(g))
+                    continue
+                movie.genres.add(genre)
             print("Movie {} created with id {} and uuid {}".format(movie.title, movie.pk, movie.uuid))
         except Exception as e:
             print('Movie creation failed: {}'.format(e))
@@ -0,0 +1,12 @@
+from time import perf_counter
+from django.core.management.base import BaseCommand
+from movie_store.corentals import rebuild_corentals
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the co-rentals ("customers also rented") of all the movies from the rentals'
+
+    def handle(self, *args, **options):
+        start = perf_counter()
+        count = rebuild_corentals()
+        print('Co-rentals rebuilt in {:.1f}s: {} movie pairs'.format(perf_counter() - start, count))
@@ -0,0 +1,12 @@
+from time import perf_counter
+from django.core.management.base import BaseCommand
+from movie_store.reports import rebuild_revenue
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the daily revenue of all the movies (the rollups of the revenue reports) from the returned rentals'
+
+    def handle(self, *args, **options):
+        start = perf_counter()
+        count = rebuild_revenue()
+        print('Daily revenue rebuilt in {:.1f}s: {} movie days'.format(perf_counter() - start, count))
@@ -0,0 +1,12 @@
+from time import perf_counter
+from django.core.management.base import BaseCommand
+from movie_store.popularity import refresh_popularity
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the popularity of the movies from the recent rentals (should run periodically)'
+
+    def handle(self, *args, **options):
+        start = perf_counter()
+        count = refresh_popularity()
+        print('Popularity refreshed in {:.1f}s: {} movies with recent rentals'.format(perf_counter() - start, count))
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.25 on 2026-10-18 09:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movie_store', '0002_add_genres_movies'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='rental',
+            index=models.Index(fields=['user', 'returned', 'movie'], name='rental_user_returned_movie_idx'),
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 3.2.25 on 2026-10-18 09:30
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+# the search document weights the title (A) over the director (B) and the summary (C)
+search_vector_sql = '''
+    setweight(to_tsvector('pg_catalog.english', coalesce({row}title, '')), 'A') ||
+    setweight(to_tsvector('pg_catalog.english', coalesce({row}director, '')), 'B') ||
+    setweight(to_tsvector('pg_catalog.english', coalesce({row}summary, '')), 'C')
+'''
+
+
+def add_search_vector_trigger(apps, schema_editor):
+    """Keeps the search vector in sync on every write and indexes it (only on postgres)"""
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    table = apps.get_model('movie_store', 'Movie')._meta.db_table
+    schema_editor.execute('''
+        CREATE FUNCTION {table}_search_vector_update() RETURNS trigger AS $$
+        BEGIN
+            NEW.search_vector := {search_vector};
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql;
+    '''.format(table=table, search_vector=search_vector_sql.format(row='NEW.')))
+    schema_editor.execute('''
+        CREATE TRIGGER {table}_search_vector_trigger
+        BEFORE INSERT OR UPDATE OF title, director, summary ON {table}
+        FOR EACH ROW EXECUTE PROCEDURE {table}_search_vector_update();
+    '''.format(table=table))
+    schema_editor.execute('UPDATE {table} SET search_vector = {search_vector};'.format(
+        table=table, search_vector=search_vector_sql.format(row='')))
+    schema_editor.execute('CREATE INDEX movie_search_vector_idx ON {table} USING gin (search_vector);'.format(
+        table=table))
+
+
+def remove_search_vector_trigger(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    table = apps.get_model('movie_store', 'Movie')._meta.db_table
+    schema_editor.execute('DROP INDEX IF EXISTS movie_search_vector_idx;')
+    schema_editor.execute('DROP TRIGGER IF EXISTS {table}_search_vector_trigger ON {table};'.format(table=table))
+    schema_editor.execute('DROP FUNCTION IF EXISTS {table}_search_vector_update();'.format(table=table))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movie_store', '0003_rental_user_returned_movie_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='movie',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(add_search_vector_trigger, remove_search_vector_trigger),
+    ]
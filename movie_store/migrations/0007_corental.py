@@ -0,0 +1,31 @@
+# Generated by Django 3.2.25 on 2026-10-18 10:16
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movie_store', '0006_movie_year_title_director_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CoRental',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('movie', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='movie_store.movie')),
+                ('other_movie', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='movie_store.movie')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='corental',
+            index=models.Index(fields=['movie', '-count', 'other_movie'], name='corental_movie_count_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='corental',
+            constraint=models.UniqueConstraint(fields=('movie', 'other_movie'), name='corental_movie_other_movie_unique'),
+        ),
+    ]
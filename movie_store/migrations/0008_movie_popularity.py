@@ -0,0 +1,33 @@
+# Generated by Django 3.2.25 on 2026-10-18 10:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movie_store', '0007_corental'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='movie',
+            name='popularity',
+            field=models.FloatField(db_index=True, default=0.0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='rentals_24h',
+            field=models.FloatField(default=0.0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='rentals_30d',
+            field=models.FloatField(default=0.0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='rentals_7d',
+            field=models.FloatField(default=0.0, editable=False),
+        ),
+    ]
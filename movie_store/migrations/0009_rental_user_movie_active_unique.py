@@ -0,0 +1,31 @@
+# Generated by Django 3.2.25 on 2026-10-18 10:25
+
+from django.db import migrations, models
+
+
+def close_duplicate_active_rentals(apps, schema_editor):
+    """
+    Closes the duplicate active rentals of a user and a movie, which the constraint would reject: all but the
+    newest one are marked as returned, on the rental date of the newest one and without a payment.
+    """
+    Rental = apps.get_model('movie_store', 'Rental')
+    rentals = Rental.objects.using(schema_editor.connection.alias)
+    newest = rentals.filter(returned=False, user=models.OuterRef('user'), movie=models.OuterRef('movie'))\
+        .order_by('-rental_date', '-id')
+    rentals.filter(returned=False).exclude(pk=models.Subquery(newest.values('pk')[:1]))\
+        .update(returned=True, payment=0.0, return_date=models.Subquery(newest.values('rental_date')[:1]))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movie_store', '0008_movie_popularity'),
+    ]
+
+    operations = [
+        migrations.RunPython(close_duplicate_active_rentals, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='rental',
+            constraint=models.UniqueConstraint(condition=models.Q(('returned', False)), fields=('user', 'movie'), name='rental_user_movie_active_unique'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 3.2.25 on 2026-10-18 10:36
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movie_store', '0009_rental_user_movie_active_unique'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyRevenue',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('returns', models.PositiveIntegerField(default=0)),
+                ('revenue', models.FloatField(default=0.0)),
+                ('movie', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='movie_store.movie')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='dailyrevenue',
+            constraint=models.UniqueConstraint(fields=('day', 'movie'), name='dailyrevenue_day_movie_unique'),
+        ),
+    ]
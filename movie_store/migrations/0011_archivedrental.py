@@ -0,0 +1,80 @@
+# Generated by Django 3.2.25 on 2026-10-18 10:41
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def create_archived_rental_table(apps, schema_editor):
+    """
+    Creates the archived rentals table, range partitioned by rental_date on postgres (the partitions are created
+    when rentals are archived, see movie_store.archive), a regular table on the other databases.
+    A primary key (and any unique constraint) of a partitioned table must include the partition key.
+    """
+    model = apps.get_model('movie_store', 'ArchivedRental')
+    if schema_editor.connection.vendor != 'postgresql':
+        schema_editor.create_model(model)
+        return
+    connection = schema_editor.connection
+    quote_name = schema_editor.quote_name
+    definitions = ['{} {} {}'.format(quote_name(field.column), field.db_type(connection),
+                                     'NULL' if field.null else 'NOT NULL')
+                   for field in model._meta.local_concrete_fields]
+    definitions.append('PRIMARY KEY ({}, {})'.format(quote_name('id'), quote_name('rental_date')))
+    definitions.extend('FOREIGN KEY ({}) REFERENCES {} ({}) DEFERRABLE INITIALLY DEFERRED'.format(
+        quote_name(field.column), quote_name(field.related_model._meta.db_table),
+        quote_name(field.target_field.column)) for field in model._meta.local_concrete_fields if field.is_relation)
+    schema_editor.execute('CREATE TABLE {} ({}) PARTITION BY RANGE ({})'.format(
+        quote_name(model._meta.db_table), ', '.join(definitions), quote_name('rental_date')))
+    # the indexes of a partitioned table are created on every partition
+    for sql in schema_editor._model_indexes_sql(model):
+        schema_editor.execute(sql)
+
+
+def drop_archived_rental_table(apps, schema_editor):
+    # dropping a partitioned table drops its partitions
+    schema_editor.delete_model(apps.get_model('movie_store', 'ArchivedRental'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('movie_store', '0010_dailyrevenue'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='ArchivedRental',
+                    fields=[
+                        ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                        ('uuid', models.UUIDField(db_index=True, editable=False)),
+                        ('rental_date', models.DateTimeField()),
+                        ('return_date', models.DateTimeField(blank=True, null=True)),
+                        ('returned', models.BooleanField(default=True)),
+                        ('payment', models.FloatField(editable=False, null=True)),
+                        ('movie', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE,
+                                                    related_name='archived_rentals',
+                                                    related_query_name='archived_rental', to='movie_store.movie')),
+                        ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE,
+                                                   related_name='archived_rentals',
+                                                   related_query_name='archived_rental', to=settings.AUTH_USER_MODEL)),
+                    ],
+                    options={
+                        'ordering': ('rental_date',),
+                    },
+                ),
+                migrations.AddIndex(
+                    model_name='archivedrental',
+                    index=models.Index(fields=['user', 'rental_date'], name='archivedrental_user_date_idx'),
+                ),
+            ],
+        ),
+        migrations.RunPython(create_archived_rental_table, drop_archived_rental_table),
+        migrations.AddIndex(
+            model_name='rental',
+            index=models.Index(condition=models.Q(('returned', True)), fields=['rental_date'], name='rental_returned_date_idx'),
+        ),
+    ]
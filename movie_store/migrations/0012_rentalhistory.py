@@ -0,0 +1,40 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:20
+
+from django.db import migrations, models
+
+# the rentals and the archived rentals (a rental is in one of them), the filters of the rental date of a query of
+# the view are applied to both tables, so only the partitions of the archive of those dates are read
+columns = 'id, uuid, rental_date, return_date, returned, payment, movie_id, user_id'
+create_rental_history_view = '''
+CREATE VIEW movie_store_rentalhistory AS
+SELECT {columns} FROM movie_store_rental
+UNION ALL
+SELECT {columns} FROM movie_store_archivedrental
+'''.format(columns=columns)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movie_store', '0011_archivedrental'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RentalHistory',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('uuid', models.UUIDField(editable=False)),
+                ('rental_date', models.DateTimeField()),
+                ('return_date', models.DateTimeField(blank=True, null=True)),
+                ('returned', models.BooleanField()),
+                ('payment', models.FloatField(editable=False, null=True)),
+            ],
+            options={
+                'db_table': 'movie_store_rentalhistory',
+                'ordering': ('rental_date',),
+                'managed': False,
+            },
+        ),
+        migrations.RunSQL(create_rental_history_view, 'DROP VIEW movie_store_rentalhistory'),
+    ]
@@ -1,11 +1,14 @@
 from uuid import uuid4
 from django.db import models
+from django.db.models.functions import Upper
 from django.conf import settings
+from django.contrib.postgres.search import SearchVectorField
 
 
 class Genre(models.Model):
     uuid = models.UUIDField(unique=True, editable=False, default=uuid4)
     name = models.CharField(unique=True, max_length=255)
+    modified = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         return self.name
@@ -21,12 +24,27 @@ class Movie(models.Model):
     summary = models.TextField()
     director = models.CharField(max_length=255)
     genres = models.ManyToManyField(Genre, related_name='movies', related_query_name='movie')
+    # also updated when the genres of the movie change (see signals)
+    modified = models.DateTimeField(auto_now=True, db_index=True)
+    # full text search document of the title, director and summary, kept in sync by a trigger on postgres
+    search_vector = SearchVectorField(null=True, editable=False)
+    # decayed rental counts over time windows and the popularity score computed from them (see popularity)
+    rentals_24h = models.FloatField(default=0.0, editable=False)
+    rentals_7d = models.FloatField(default=0.0, editable=False)
+    rentals_30d = models.FloatField(default=0.0, editable=False)
+    popularity = models.FloatField(default=0.0, editable=False, db_index=True)
 
     def __str__(self):
         return '{title} ({year})'.format(title=self.title, year=self.year)
 
     class Meta:
         ordering = ('year',)
+        indexes = [
+            # the year filters (exact, range, decade) with the title ordering
+            models.Index(fields=('year', 'title'), name='movie_year_title_idx'),
+            # the case insensitive director filter
+            models.Index(Upper('director'), name='movie_upper_director_idx'),
+        ]
 
 
 class Rental(models.Model):
@@ -41,3 +59,95 @@ class Rental(models.Model):
 
     class Meta:
         ordering = ('rental_date',)
+        indexes = [
+            models.Index(fields=('user', 'returned', 'movie'), name='rental_user_returned_movie_idx'),
+            # the returned rentals to archive, by age
+            models.Index(fields=('rental_date',), condition=models.Q(returned=True), name='rental_returned_date_idx'),
+        ]
+        constraints = [
+            # a user can have one active rental of a movie
+            models.UniqueConstraint(fields=('user', 'movie'), condition=models.Q(returned=False),
+                                    name='rental_user_movie_active_unique'),
+        ]
+
+
+class ArchivedRental(models.Model):
+    """
+    A returned rental older than the archive horizon, moved from the rentals with the same id and fields (see
+    movie_store.archive), so that the rentals table only grows with the recent history.
+    On postgres the table is range partitioned by rental_date, one partition per year (see the migration), so the
+    primary key includes the rental date and the uuid is indexed but not unique (it is unique in the rentals).
+    """
+    id = models.BigIntegerField(primary_key=True)
+    uuid = models.UUIDField(editable=False, db_index=True)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='archived_rentals',
+                             related_query_name='archived_rental')
+    movie = models.ForeignKey(Movie, on_delete=models.CASCADE, related_name='archived_rentals',
+                              related_query_name='archived_rental')
+    rental_date = models.DateTimeField()
+    return_date = models.DateTimeField(blank=True, null=True)
+    returned = models.BooleanField(default=True)
+    payment = models.FloatField(null=True, editable=False)
+
+    class Meta:
+        ordering = ('rental_date',)
+        indexes = [
+            models.Index(fields=('user', 'rental_date'), name='archivedrental_user_date_idx'),
+        ]
+
+
+class RentalHistory(models.Model):
+    """
+    The rentals and the archived rentals, read (only) from a database view of both tables (see the migration), so
+    that the lists of rentals that reach before the archive horizon read the whole history.
+    A rental is in one of the tables (it is moved with the same id), so the ids are unique.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    uuid = models.UUIDField(editable=False)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.DO_NOTHING, related_name='+',
+                             db_constraint=False)
+    movie = models.ForeignKey(Movie, on_delete=models.DO_NOTHING, related_name='+', db_constraint=False)
+    rental_date = models.DateTimeField()
+    return_date = models.DateTimeField(blank=True, null=True)
+    returned = models.BooleanField()
+    payment = models.FloatField(null=True, editable=False)
+
+    class Meta:
+        managed = False
+        db_table = 'movie_store_rentalhistory'
+        ordering = ('rental_date',)
+
+
+class CoRental(models.Model):
+    """
+    The number of users who have rented both a movie and another movie, precomputed from the rentals (see
+    movie_store.corentals). Every pair is stored in both directions, so the movies rented with a movie are read
+    with one index lookup.
+    """
+    movie = models.ForeignKey(Movie, on_delete=models.CASCADE, related_name='+')
+    other_movie = models.ForeignKey(Movie, on_delete=models.CASCADE, related_name='+')
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=('movie', 'other_movie'), name='corental_movie_other_movie_unique'),
+        ]
+        indexes = [
+            models.Index(fields=('movie', '-count', 'other_movie'), name='corental_movie_count_idx'),
+        ]
+
+
+class DailyRevenue(models.Model):
+    """
+    The returns and the revenue (the sum of the payments) of a movie on a day, rolled up from the returned rentals
+    (see movie_store.reports), so that the revenue reports do not read the rentals.
+    """
+    day = models.DateField()
+    movie = models.ForeignKey(Movie, on_delete=models.CASCADE, related_name='+')
+    returns = models.PositiveIntegerField(default=0)
+    revenue = models.FloatField(default=0.0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=('day', 'movie'), name='dailyrevenue_day_movie_unique'),
+        ]
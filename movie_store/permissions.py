@@ -29,6 +29,10 @@ class MoviePermissions(IsSuperuser):
             'create': user_is_superuser,
             'partial_update': user_is_superuser,
             'destroy': user_is_superuser,
+            'bulk_create': user_is_superuser,
+            'bulk_partial_update': user_is_superuser,
+            'bulk_destroy': user_is_superuser,
+            'export': user_is_superuser,
             'get_user_library': user_is_authenticated
         }.get(view.action, user_is_authenticated)
 
@@ -42,7 +46,9 @@ class RentalPermissions(IsSuperuser):
         user_is_authenticated = self.user_is_authenticated(request)
         user_is_superuser = self.user_is_superuser(request)
         return {
-            'destroy': user_is_superuser
+            'destroy': user_is_superuser,
+            'export': user_is_superuser,
+            'bulk_return': user_is_superuser,
         }.get(view.action, user_is_authenticated)
 
     def has_object_permission(self, request, view, obj):
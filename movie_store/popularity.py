@@ -0,0 +1,65 @@
+"""
+Popularity of the movies, denormalized on the movies so that they can be ordered by it without joins.
+Every time window (24 hours, 7 days, 30 days) has a count of the rentals of the movie in the window, decayed
+linearly with the age of the rental: a new rental counts 1 and a rental as old as the window counts 0.
+The popularity is the sum of the counts divided by the days of their windows, i.e. a blend of the average daily
+rentals over the windows, where the recent rentals weigh more.
+A new rental is added to the counts right away (see increment_popularity), while the decay is applied by
+recomputing the counts from the rentals of the longest window (see refresh_popularity), which is run
+periodically with the refresh_popularity command.
+The counts are written with update queries, which change neither the modification time nor the version of the
+movies, so that the cached movie responses are not invalidated by every rental (the responses that are ordered
+by popularity are not cached).
+"""
+from collections import defaultdict
+from datetime import timedelta
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from .bulk import update_movies
+from .models import Movie, Rental
+
+popularity_windows = (
+    ('rentals_24h', timedelta(days=1)),
+    ('rentals_7d', timedelta(days=7)),
+    ('rentals_30d', timedelta(days=30)),
+)
+popularity_fields = tuple(field for field, _ in popularity_windows) + ('popularity',)
+refresh_chunk_size = 5000
+
+
+def get_popularity(counts):
+    return sum(count / (window / timedelta(days=1)) for count, (_, window) in zip(counts, popularity_windows))
+
+
+def increment_popularity(rental):
+    """Adds a new rental to the counts and the popularity of its movie, with one update query"""
+    increments = {field: F(field) + 1 for field, _ in popularity_windows}
+    Movie.objects.filter(pk=rental.movie_id)\
+        .update(popularity=F('popularity') + get_popularity([1] * len(popularity_windows)), **increments)
+
+
+def refresh_popularity(now=None):
+    """
+    Recomputes the counts and the popularity of all the movies from the rentals of the longest window, which
+    are read once. Returns the number of the movies with rentals in the windows.
+    """
+    now = now or timezone.now()
+    longest_window = max(window for _, window in popularity_windows)
+    counts = defaultdict(lambda: [0.0] * len(popularity_windows))
+    rentals = Rental.objects.filter(rental_date__gt=now - longest_window).order_by()\
+        .values_list('movie_id', 'rental_date').iterator(chunk_size=refresh_chunk_size)
+    for movie_id, rental_date in rentals:
+        age = max(now - rental_date, timedelta(0))
+        for i, (_, window) in enumerate(popularity_windows):
+            if age < window:
+                counts[movie_id][i] += 1 - age / window
+
+    movies = [Movie(pk=movie_id, popularity=get_popularity(movie_counts),
+                    **{field: count for (field, _), count in zip(popularity_windows, movie_counts)})
+              for movie_id, movie_counts in counts.items()]
+    with transaction.atomic():
+        # the movies without recent rentals are reset, the others are updated in batches
+        Movie.objects.exclude(popularity=0.0).update(**{field: 0.0 for field in popularity_fields})
+        update_movies(movies, popularity_fields)
+    return len(movies)
@@ -0,0 +1,81 @@
+"""
+Revenue reports, served from the DailyRevenue rollup table instead of the rentals, so that their cost depends on
+the number of days and movies of a report, not on the size of the rentals history.
+The rollups are updated incrementally when rentals are returned (see logic.return_rentals), on the day of the
+return, and when returned rentals are deleted through the API (see remove_return), and rebuilt from all the returned
+rentals (archived or not) with the rebuild_revenue command, which also drops the revenue of the rentals deleted
+otherwise (e.g. with their users).
+"""
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import Coalesce, TruncDate, TruncMonth
+from django.utils import timezone
+from common.cache import bump_model_version_on_commit
+from common.db import insert_or_increment, insert_or_increment_from_query
+from .models import ArchivedRental, DailyRevenue, Rental
+
+report_groups = ('day', 'month', 'movie', 'genre')
+
+
+def add_returns(rentals, day):
+    """Adds returned rentals (a queryset) to the revenue of their movies on a day, with a grouped query and an upsert"""
+    rows = [{'day': day, 'movie': row['movie'], 'returns': row['returns'], 'revenue': row['revenue']}
+            for row in rentals.order_by('movie').values('movie')
+            .annotate(returns=Count('pk'), revenue=Coalesce(Sum('payment'), 0.0))]
+    insert_or_increment(DailyRevenue, rows, unique_fields=('day', 'movie'), increment_fields=('returns', 'revenue'))
+    bump_model_version_on_commit(DailyRevenue)
+
+
+def remove_return(rental):
+    """Subtracts a deleted returned rental from the revenue of its movie on the day of its return"""
+    if not rental.returned:
+        return
+    revenue = DailyRevenue.objects.filter(day=timezone.localdate(rental.return_date), movie_id=rental.movie_id)
+    revenue.update(returns=F('returns') - 1, revenue=F('revenue') - (rental.payment or 0.0))
+    # like the rebuilt rollups, which have no movie days without returns
+    revenue.filter(returns__lte=0).delete()
+    bump_model_version_on_commit(DailyRevenue)
+
+
+def rebuild_revenue():
+    """
+    Recomputes the daily revenue of all the movies from the returned rentals, with one grouped query for the
+    rentals and one for the archived rentals. Returns the number of movie days.
+    """
+    with transaction.atomic():
+        DailyRevenue.objects.all().delete()
+        for model in (Rental, ArchivedRental):
+            revenue = model.objects.filter(returned=True).order_by().annotate(day=TruncDate('return_date'))\
+                .values('day', 'movie').annotate(returns=Count('pk'), revenue=Coalesce(Sum('payment'), 0.0))
+            insert_or_increment_from_query(DailyRevenue, revenue, unique_fields=('day', 'movie'),
+                                           increment_fields=('returns', 'revenue'))
+        bump_model_version_on_commit(DailyRevenue)
+    return DailyRevenue.objects.count()
+
+
+def get_revenue_report(group_by, date_min=None, date_max=None, limit=None):
+    """
+    Gets the returns and the revenue of the days between two dates (all of them by default), grouped by day or
+    month (in date order) or by movie or genre (the highest revenue first), with one grouped query of the rollups.
+    The limit applies to the movie and genre groups.
+    """
+    assert group_by in report_groups, 'Unknown report group {}'.format(group_by)
+    queryset = DailyRevenue.objects.all()
+    if date_min is not None:
+        queryset = queryset.filter(day__gte=date_min)
+    if date_max is not None:
+        queryset = queryset.filter(day__lte=date_max)
+
+    totals = {'returns': Sum('returns'), 'revenue': Sum('revenue')}
+    if group_by == 'day':
+        return list(queryset.values('day').annotate(**totals).order_by('day'))
+    if group_by == 'month':
+        rows = queryset.annotate(month=TruncMonth('day')).values('month').annotate(**totals).order_by('month')
+        return [dict(row, month=row['month'].strftime('%Y-%m')) for row in rows]
+    if group_by == 'movie':
+        rows = queryset.values(uuid=F('movie__uuid'), title=F('movie__title')).annotate(**totals)\
+            .order_by('-revenue', 'uuid')
+    else:
+        rows = queryset.filter(movie__genres__isnull=False).values(genre=F('movie__genres__name'))\
+            .annotate(**totals).order_by('-revenue', 'genre')
+    return list(rows[:limit])
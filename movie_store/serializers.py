@@ -1,10 +1,15 @@
-from django.utils import timezone
 from django.contrib.auth import get_user_model
+from collections import Counter
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
+from rest_framework.settings import api_settings
 from drf_spectacular.utils import extend_schema_serializer
-from .models import Genre, Movie, Rental
-from .logic import calculate_charge
+from common.serializers import SparseFieldsetMixin
+from .models import ArchivedRental, Genre, Movie, Rental, RentalHistory
+from .logic import calculate_charge, return_rentals
+from .reports import report_groups
+from .bulk import GenreMap, movie_fields
+from .genres import genre_resolver
 
 
 class BasicUserSerializer(serializers.ModelSerializer):
@@ -14,67 +19,233 @@ class BasicUserSerializer(serializers.ModelSerializer):
         fields = ('uuid', 'email', 'first_name', 'last_name', )
 
 
-class GenreSerializer(serializers.HyperlinkedModelSerializer):
+class GenreSerializer(SparseFieldsetMixin, serializers.HyperlinkedModelSerializer):
     url = serializers.HyperlinkedIdentityField(view_name='genres-detail', format='html', lookup_field="uuid")
 
     class Meta:
         model = Genre
-        fields = '__all__'
+        exclude = ('modified',)
+
+
+class GenreNameField(serializers.SlugRelatedField):
+    """A genre by name, resolved (case insensitive) by the in-process genre cache instead of a query per name"""
 
+    def to_internal_value(self, data):
+        if not isinstance(data, str):
+            self.fail('invalid')
+        genre = genre_resolver.get_by_name(data)
+        if genre is None:
+            self.fail('does_not_exist', slug_name=self.slug_field, value=data)
+        return genre
 
-class MovieSerializer(serializers.HyperlinkedModelSerializer):
+
+class MovieSerializer(SparseFieldsetMixin, serializers.HyperlinkedModelSerializer):
     url = serializers.HyperlinkedIdentityField(view_name='movies-detail', format='html', lookup_field="uuid")
-    genres = serializers.SlugRelatedField(many=True, slug_field='name', queryset=Genre.objects.all())
+    genres = GenreNameField(many=True, slug_field='name', queryset=Genre.objects.all())
 
     class Meta:
         model = Movie
-        fields = '__all__'
+        # the popularity changes on every rental, it is only used for the ordering
+        exclude = ('search_vector', 'modified', 'rentals_24h', 'rentals_7d', 'rentals_30d', 'popularity')
+
+    def get_deleted_genre_errors(self):
+        """
+        Gets the errors of the genres of the validated data that have been deleted since they were resolved (see
+        views.MovieViewSet.genre_write), or an empty dict.
+        """
+        genres = self.validated_data.get('genres', [])
+        existing_ids = set(Genre.objects.filter(pk__in=[genre.pk for genre in genres]).values_list('pk', flat=True))
+        field = self.fields['genres'].child_relation
+        messages = [field.error_messages['does_not_exist'].format(slug_name=field.slug_field, value=genre.name)
+                    for genre in genres if genre.pk not in existing_ids]
+        return {'genres': messages} if messages else {}
+
+
+class BulkMovieListSerializer(serializers.ListSerializer):
+    """
+    Validates the list of movies of a bulk request.
+    The genres of all the movies are resolved (by name, case insensitive) by the in-process genre cache, instead
+    of one query per movie and genre. The errors are reported per item, as a list with the errors of every movie
+    (an empty dict for the valid ones).
+    """
+    max_items = 10000
+    does_not_exist_message = 'Object with {field}={value} does not exist.'
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('allow_empty', False)
+        super().__init__(*args, **kwargs)
+
+    def to_internal_value(self, data):
+        if not isinstance(data, list) or not data:
+            return super().to_internal_value(data)
+        if len(data) > self.max_items:
+            message = 'Ensure this list has no more than {} items.'.format(self.max_items)
+            raise ValidationError({api_settings.NON_FIELD_ERRORS_KEY: [message]}, code='max_items')
+
+        movies_data, errors = [], []
+        for item in data:
+            try:
+                movies_data.append(self.child.run_validation(item))
+                errors.append({})
+            except ValidationError as exc:
+                movies_data.append(None)
+                errors.append(exc.detail)
+
+        self.resolve([movie_data for movie_data in movies_data if movie_data is not None])
+        for movie_data, movie_errors in zip(movies_data, errors):
+            if movie_data is not None:
+                movie_errors.update(self.validate_movie(movie_data))
+        if any(errors):
+            raise ValidationError(errors)
+        return movies_data
+
+    def resolve(self, movies_data):
+        """Resolves the references of all the valid movies in batches"""
+        self.genre_map = GenreMap()
+        self.genre_map.resolve(set(name for movie_data in movies_data for name in movie_data.get('genres', [])))
+
+    def get_deleted_genre_errors(self):
+        """
+        Gets the errors of the movies with genres that have been deleted since they were resolved (see
+        views.MovieViewSet.genre_write), or an empty list.
+        """
+        if not self.genre_map.discard_deleted():
+            return []
+        return [self.validate_movie(movie_data) for movie_data in self.validated_data]
+
+    def validate_movie(self, movie_data):
+        """Returns the errors of the references of a movie"""
+        unknown_genres = [name for name in movie_data.get('genres', []) if self.genre_map.get(name) is None]
+        if unknown_genres:
+            return {'genres': [self.does_not_exist_message.format(field='name', value=name)
+                               for name in unknown_genres]}
+        return {}
+
+
+class BulkMovieByUuidListSerializer(BulkMovieListSerializer):
+    """Validates a list of movies that are looked up by uuid, the movies are fetched with one query"""
+
+    def resolve(self, movies_data):
+        super().resolve(movies_data)
+        uuids = [movie_data['uuid'] for movie_data in movies_data]
+        self.uuid_counts = Counter(uuids)
+        self.movies = Movie.objects.only('id', 'uuid', *movie_fields).in_bulk(uuids, field_name='uuid')
+
+    def validate_movie(self, movie_data):
+        errors = super().validate_movie(movie_data)
+        if movie_data['uuid'] not in self.movies:
+            errors['uuid'] = [self.does_not_exist_message.format(field='uuid', value=movie_data['uuid'])]
+        elif self.uuid_counts[movie_data['uuid']] > 1:
+            errors['uuid'] = ['Duplicate uuid.']
+        return errors
+
+    def get_movies(self):
+        """Gets the movies of the validated data, in the same order"""
+        return [self.movies[movie_data['uuid']] for movie_data in self.validated_data]
+
+
+class BulkCreateMovieSerializer(serializers.ModelSerializer):
+    genres = serializers.ListField(child=serializers.CharField(max_length=255))
+
+    class Meta:
+        model = Movie
+        fields = movie_fields + ('genres',)
+        list_serializer_class = BulkMovieListSerializer
+
+
+class BulkUpdateMovieSerializer(BulkCreateMovieSerializer):
+    uuid = serializers.UUIDField()
+    genres = serializers.ListField(child=serializers.CharField(max_length=255), required=False)
+
+    class Meta:
+        model = Movie
+        fields = ('uuid',) + movie_fields + ('genres',)
+        extra_kwargs = {field: {'required': False} for field in movie_fields}
+        list_serializer_class = BulkMovieByUuidListSerializer
+
+
+class BulkDeleteMovieSerializer(serializers.Serializer):
+    uuid = serializers.UUIDField()
+
+    class Meta:
+        list_serializer_class = BulkMovieByUuidListSerializer
 
 
 @extend_schema_serializer(exclude_fields=['user'])
 class CreateRentalSerializer(serializers.ModelSerializer):
-    user = serializers.SlugRelatedField(slug_field='email', queryset=get_user_model().objects.all())
+    """
+    A new rental of the user who sends the request (it is saved with the user).
+    A second active rental of a movie is rejected by the database (see the constraints of Rental), which is
+    atomic, unlike a check before the insert.
+    """
     movie = serializers.SlugRelatedField(slug_field='uuid', queryset=Movie.objects.all())
 
-    def validate(self, attrs):
-        active_rental_data = {'user': attrs['user'], 'movie': attrs['movie'], 'returned': False}
-        active_rental_exists = Rental.objects.filter(**active_rental_data).exists()
-        if active_rental_exists:
-            raise ValidationError('This movie is already rented.', code='non_field_errors')
-        return attrs
-
     class Meta:
         model = Rental
-        fields = ('uuid', 'user', 'movie')
+        fields = ('uuid', 'movie')
 
 
 class UpdateRentalSerializer(serializers.ModelSerializer):
 
     def save(self, **kwargs):
-        instance = super().save()
-        if self.validated_data['returned'] is True:
-            instance.return_date = timezone.now()
-            instance.payment = calculate_charge(instance)
-            instance.save()
-        return instance
+        # returned is the only field, an active rental can only be returned
+        if self.validated_data.get('returned') is not True:
+            return self.instance
+        if not return_rentals(Rental.objects.filter(pk=self.instance.pk)):
+            raise ValidationError({'detail': 'This movie is already returned.'})
+        self.instance.refresh_from_db(fields=('returned', 'return_date', 'payment'))
+        return self.instance
 
     class Meta:
         model = Rental
         fields = ('returned',)
 
 
-class RentalSerializer(serializers.HyperlinkedModelSerializer):
+class BulkReturnRentalSerializer(serializers.Serializer):
+    uuids = serializers.ListField(child=serializers.UUIDField(), allow_empty=False, max_length=10000)
+
+
+class RentalSerializer(SparseFieldsetMixin, serializers.HyperlinkedModelSerializer):
     url = serializers.HyperlinkedIdentityField(view_name='rentals-detail', format='html', lookup_field="uuid")
     user = BasicUserSerializer()
     movie = MovieSerializer()
 
+    # the instance fields used by finalize_representation (see common.serializers.CompiledReadSerializer), with the
+    # fee annotation of the rentals queryset
+    compiled_instance_fields = ('rental_date', 'return_date', 'fee')
+
     def to_representation(self, instance):
-        representation = super().to_representation(instance)
-        if instance.return_date is None:
-            representation['fee'] = calculate_charge(instance)
-            return representation
+        return self.finalize_representation(instance, super().to_representation(instance))
+
+    def finalize_representation(self, instance, representation):
+        if instance.return_date is None and self.fieldset.includes('fee'):
+            # the fee annotation of the rentals queryset (see views.RentalViewSet), or the same charge in python
+            fee = getattr(instance, 'fee', None)
+            representation['fee'] = calculate_charge(instance) if fee is None else fee
         return representation
 
     class Meta:
         model = Rental
         fields = '__all__'
+
+
+class ArchivedRentalSerializer(RentalSerializer):
+
+    class Meta:
+        model = ArchivedRental
+        fields = '__all__'
+
+
+class RentalHistorySerializer(RentalSerializer):
+
+    class Meta:
+        model = RentalHistory
+        fields = '__all__'
+
+
+class RevenueReportSerializer(serializers.Serializer):
+    """The query parameters of the revenue report"""
+    group_by = serializers.ChoiceField(choices=report_groups, default='day')
+    date_min = serializers.DateField(required=False)
+    date_max = serializers.DateField(required=False)
+    limit = serializers.IntegerField(min_value=1, max_value=1000, default=100)
@@ -0,0 +1,39 @@
+from django.db.models.signals import post_save, post_delete, pre_delete, m2m_changed
+from django.dispatch import receiver
+from django.utils import timezone
+from .genres import genre_resolver
+from .models import Genre, Movie
+
+
+def touch_movies(movies):
+    """Updates the modification time of some movies, whose representation has changed"""
+    movies.update(modified=timezone.now())
+
+
+@receiver(post_save, sender=Genre)
+def touch_genre_movies_on_rename(sender, instance, created, **kwargs):
+    if not created:
+        touch_movies(Movie.objects.filter(genres=instance))
+
+
+@receiver(pre_delete, sender=Genre)
+def touch_genre_movies_on_delete(sender, instance, **kwargs):
+    touch_movies(Movie.objects.filter(genres=instance))
+
+
+@receiver([post_save, post_delete], sender=Genre)
+def clear_genre_resolver(sender, **kwargs):
+    # the other processes reload their genres when they check the stamp of the genres
+    genre_resolver.clear_on_write()
+
+
+@receiver(m2m_changed, sender=Movie.genres.through)
+def touch_movies_on_genres_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        touch_movies(Movie.objects.filter(pk=instance.pk))
+    elif action == 'pre_clear':
+        touch_movies(Movie.objects.filter(genres=instance))
+    else:
+        touch_movies(Movie.objects.filter(pk__in=pk_set))
@@ -0,0 +1,214 @@
+import json
+from datetime import timedelta
+import pytest
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.utils import timezone
+from django.contrib.auth import get_user_model
+from movie_store.archive import archive_rentals
+from movie_store.bulk import GenreMap
+from movie_store.corentals import add_rental
+from movie_store.logic import return_rentals
+from movie_store.popularity import increment_popularity
+from movie_store.models import ArchivedRental, CoRental, DailyRevenue, Genre, Movie, Rental
+
+# mark all tests as needing database access
+pytestmark = pytest.mark.django_db
+
+
+# bulk import tests
+def test_bulk_import_catalog_csv(tmp_path):
+    catalog = tmp_path / 'catalog.csv'
+    catalog.write_text('title,year,director,summary,genres\n'
+                       + ''.join('Movie {i},{year},Director {i},Summary {i},"Drama, comedy"\n'.format(
+                           i=i, year=2000 + i % 10) for i in range(25))
+                       + 'Invalid movie,not a year,Director,Summary,Drama\n', encoding='utf-8')
+    call_command('bulk_import_catalog', str(catalog), chunk_size=10)
+
+    imported_movies = Movie.objects.filter(title__startswith='Movie ')
+    assert imported_movies.count() == 25
+    assert not Movie.objects.filter(title='Invalid movie').exists()
+    # the genres are matched case insensitively
+    assert all(set(m.genres.values_list('name', flat=True)) == {'Drama', 'Comedy'} for m in imported_movies)
+
+
+def test_bulk_import_catalog_jsonl_upsert(tmp_path, capsys):
+    catalog = tmp_path / 'catalog.jsonl'
+    movies = [{'title': 'Movie {}'.format(i), 'year': 2000 + i, 'director': 'Director', 'summary': 'Summary',
+               'genres': ['Drama']} for i in range(5)]
+    catalog.write_text('\n'.join(json.dumps(m) for m in movies), encoding='utf-8')
+    call_command('bulk_import_catalog', str(catalog))
+
+    # update two of the movies with new genres (one of them does not exist) and add a new one
+    updated_movies = [dict(m, summary='Updated', genres=['Action', 'New genre']) for m in movies[:2]]
+    new_movie = dict(movies[0], year=1999)
+    catalog.write_text('\n'.join(json.dumps(m) for m in updated_movies + [new_movie]), encoding='utf-8')
+    call_command('bulk_import_catalog', str(catalog), upsert=True)
+
+    assert Movie.objects.filter(title__startswith='Movie ').count() == 6
+    for movie in Movie.objects.filter(title__in=[m['title'] for m in updated_movies], year__gte=2000):
+        assert movie.summary == 'Updated'
+        assert list(movie.genres.values_list('name', flat=True)) == ['Action']
+    assert not Genre.objects.filter(name='New genre').exists()
+
+    # the missing genres can be created
+    call_command('bulk_import_catalog', str(catalog), upsert=True, create_genres=True)
+    assert Genre.objects.filter(name='New genre').exists()
+    assert Movie.objects.filter(title__startswith='Movie ', genres__name='New genre').count() == 2
+    assert '1 genres created' in capsys.readouterr().out
+
+
+def test_bulk_import_catalog_existing_genres(tmp_path, capsys, monkeypatch):
+    catalog = tmp_path / 'catalog.jsonl'
+    catalog.write_text(json.dumps({'title': 'Movie', 'year': 2000, 'director': 'Director', 'summary': 'Summary',
+                                   'genres': ['Drama', 'New genre']}), encoding='utf-8')
+    # genres missing from a stale genre cache are skipped by the insert and not counted as created
+    monkeypatch.setattr(GenreMap, 'lookup', staticmethod(lambda lower_names: {}))
+    call_command('bulk_import_catalog', str(catalog), create_genres=True)
+    assert '1 genres created' in capsys.readouterr().out
+    assert set(Movie.objects.get(title='Movie').genres.values_list('name', flat=True)) == {'Drama', 'New genre'}
+
+
+# co-rentals tests
+def test_rebuild_corentals():
+    users = list(get_user_model().objects.all())
+    movies = list(Movie.objects.all())
+    for i, user in enumerate(users):
+        for movie in movies[i:i + 4]:
+            add_rental(Rental.objects.create(user=user, movie=movie))
+        # a movie rented again
+        add_rental(Rental.objects.create(user=user, movie=movies[i], returned=True))
+    corentals = set(CoRental.objects.values_list('movie_id', 'other_movie_id', 'count'))
+    assert corentals
+
+    # the rebuilt co-rentals are the same as the incremental ones, without the deleted rentals
+    call_command('rebuild_corentals')
+    assert set(CoRental.objects.values_list('movie_id', 'other_movie_id', 'count')) == corentals
+    assert CoRental.objects.get(movie=movies[1], other_movie=movies[2]).count == 2
+    Rental.objects.filter(user=users[0]).delete()
+    call_command('rebuild_corentals')
+    assert CoRental.objects.get(movie=movies[1], other_movie=movies[2]).count == 1
+
+
+def test_add_rental_lock_order(monkeypatch):
+    # the co-rentals of a rental are upserted in the order of their unique fields, whatever the rented movie
+    user = get_user_model().objects.first()
+    movies = list(Movie.objects.order_by('pk')[:4])
+    for movie in movies[:3]:
+        add_rental(Rental.objects.create(user=user, movie=movie))
+    upserted_rows = []
+    monkeypatch.setattr('movie_store.corentals.insert_or_increment',
+                        lambda model, rows, **kwargs: upserted_rows.append(rows))
+    add_rental(Rental.objects.create(user=user, movie=movies[3]))
+    pairs = [(row['movie'], row['other_movie']) for row in upserted_rows[0]]
+    assert len(pairs) == 6 and pairs == sorted(pairs)
+
+
+# popularity tests
+def test_refresh_popularity():
+    user = get_user_model().objects.first()
+    movie, other_movie, old_movie = Movie.objects.all()[:3]
+    for rented_movie, age in ((movie, timedelta(hours=12)), (other_movie, timedelta(days=3)),
+                              (old_movie, timedelta(days=40))):
+        rental = Rental.objects.create(user=user, movie=rented_movie)
+        increment_popularity(rental)
+        Rental.objects.filter(pk=rental.pk).update(rental_date=timezone.now() - age)
+    # every new rental counts 1 in every window
+    assert set(Movie.objects.filter(rentals_24h=1, rentals_7d=1, rentals_30d=1).values_list('pk', flat=True)) == \
+        {movie.pk, other_movie.pk, old_movie.pk}
+
+    # the refreshed counts are decayed with the age of the rentals
+    call_command('refresh_popularity')
+    movie, other_movie, old_movie = [Movie.objects.get(pk=m.pk) for m in (movie, other_movie, old_movie)]
+    assert movie.rentals_24h == pytest.approx(0.5, abs=0.01)
+    assert movie.rentals_7d == pytest.approx(1 - 0.5 / 7, abs=0.01)
+    assert (other_movie.rentals_24h, other_movie.rentals_7d) == (0, pytest.approx(4 / 7, abs=0.01))
+    assert movie.popularity > other_movie.popularity > old_movie.popularity == 0
+    assert (old_movie.rentals_24h, old_movie.rentals_7d, old_movie.rentals_30d) == (0, 0, 0)
+
+
+# revenue tests
+def test_rebuild_revenue():
+    users = list(get_user_model().objects.all())
+    movies = list(Movie.objects.all()[:4])
+    for i, user in enumerate(users):
+        for movie in movies[i:i + 2]:
+            rental = Rental.objects.create(user=user, movie=movie)
+            Rental.objects.filter(pk=rental.pk).update(rental_date=timezone.now() - timedelta(days=i + 1, hours=1))
+    assert return_rentals(Rental.objects.exclude(movie=movies[-1])) == 2 * len(users) - 1
+    revenue = set(DailyRevenue.objects.values_list('day', 'movie_id', 'returns', 'revenue'))
+    assert sum(returns for _, _, returns, _ in revenue) == 2 * len(users) - 1
+
+    # the rebuilt revenue is the same as the incremental one, without the deleted rentals
+    call_command('rebuild_revenue')
+    assert set(DailyRevenue.objects.values_list('day', 'movie_id', 'returns', 'revenue')) == revenue
+    Rental.objects.filter(user=users[0]).delete()
+    call_command('rebuild_revenue')
+    assert not DailyRevenue.objects.filter(movie=movies[0]).exists()
+    assert DailyRevenue.objects.get(movie=movies[1]).returns == 1
+
+
+# archive tests
+def test_archive_rentals(capsys):
+    users = list(get_user_model().objects.all())
+    movies = list(Movie.objects.all()[:6])
+    for i, user in enumerate(users):
+        for age, movie in zip((400, 800, 1200, 10), movies[i:i + 4]):
+            rental = Rental.objects.create(user=user, movie=movie)
+            add_rental(rental)
+            Rental.objects.filter(pk=rental.pk).update(rental_date=timezone.now() - timedelta(days=age))
+    # the rentals of a movie are still active, so they are not archived
+    return_rentals(Rental.objects.exclude(movie=movies[2]))
+    corentals = set(CoRental.objects.values_list('movie_id', 'other_movie_id', 'count'))
+    revenue = set(DailyRevenue.objects.values_list('day', 'movie_id', 'returns', 'revenue'))
+    rentals = {rental.pk: rental for rental in Rental.objects.all()}
+
+    # the returned rentals older than the horizon are moved, in batches, with the same ids and fields
+    call_command('archive_rentals', horizon_days=365, batch_size=2)
+    archived_rentals = list(ArchivedRental.objects.all())
+    # 3 old rentals per user, one of them still active
+    assert len(archived_rentals) == 2 * len(users)
+    assert 'rentals archived' in capsys.readouterr().out
+    assert all(rental.returned and rental.rental_date < timezone.now() - timedelta(days=365)
+               for rental in archived_rentals)
+    for archived_rental in archived_rentals:
+        rental = rentals[archived_rental.pk]
+        assert [getattr(archived_rental, field.attname) for field in ArchivedRental._meta.concrete_fields] == \
+            [getattr(rental, field.attname) for field in ArchivedRental._meta.concrete_fields]
+    assert Rental.objects.count() == len(rentals) - len(archived_rentals)
+    assert not Rental.objects.filter(pk__in=[rental.pk for rental in archived_rentals]).exists()
+    call_command('archive_rentals', horizon_days=365)
+    assert ArchivedRental.objects.count() == len(archived_rentals)
+
+    # the archived rentals are still counted by the co-rentals and the revenue
+    call_command('rebuild_corentals')
+    assert set(CoRental.objects.values_list('movie_id', 'other_movie_id', 'count')) == corentals
+    call_command('rebuild_revenue')
+    assert set(DailyRevenue.objects.values_list('day', 'movie_id', 'returns', 'revenue')) == revenue
+    add_rental(Rental.objects.create(user=users[0], movie=movies[1], returned=True))
+    assert set(CoRental.objects.values_list('movie_id', 'other_movie_id', 'count')) == corentals
+
+    # the archive is partitioned by year on postgres
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT COUNT(*) FROM pg_inherits WHERE inhparent = %s::regclass',
+                           [ArchivedRental._meta.db_table])
+            assert cursor.fetchone()[0] == len(set(rental.rental_date.year for rental in archived_rentals))
+
+
+def test_archive_rentals_horizon(settings):
+    rental = Rental.objects.create(user=get_user_model().objects.first(), movie=Movie.objects.first(), returned=True)
+    Rental.objects.filter(pk=rental.pk).update(rental_date=timezone.now() - timedelta(days=20))
+    # the rentals after the horizon of the settings are never archived
+    with pytest.raises(CommandError):
+        call_command('archive_rentals', horizon_days=30)
+    # nor the rentals of the popularity window, whatever the settings
+    settings.MOVIE_STORE_RENTAL_ARCHIVE = dict(settings.MOVIE_STORE_RENTAL_ARCHIVE, HORIZON_DAYS=10)
+    with pytest.raises(CommandError):
+        call_command('archive_rentals')
+    with pytest.raises(ValueError):
+        list(archive_rentals(horizon=timezone.now() - timedelta(days=10)))
+    assert not ArchivedRental.objects.exists()
+    call_command('archive_rentals', horizon_days=30)
+    assert not ArchivedRental.objects.exists()
@@ -1,5 +1,9 @@
 import pytest
+from django.db import transaction
+from django.utils import timezone
 from common.tests import data
+from common.tests.utils import get_all_pages, get_compiled_and_serializer_responses
+from movie_store.genres import GenreResolver, genre_resolver
 from movie_store.models import Genre
 
 auth_url = '/iam/auth/'
@@ -130,3 +134,96 @@ def test_destroy_genre__admin(client):
         assert response.status_code == 204
     remaining_genres = Genre.objects.all()
     assert len(remaining_genres) == 0
+
+
+def test_list_genres_cursor_pagination__user(client):
+    client.post(auth_url, data.user1_credentials, **request_args)
+    pages = get_all_pages(client, genres_url, {'page_size': 3, 'pagination': 'cursor'})
+    assert [g['name'] for page in pages for g in page] == list(Genre.objects.values_list('name', flat=True))
+
+
+def test_list_genres_response_cache__admin(client):
+    client.post(auth_url, data.admin_credentials, **request_args)
+    assert client.get(genres_url)['X-Cache'] == 'MISS'
+    assert client.get(genres_url)['X-Cache'] == 'HIT'
+
+    # creating a genre invalidates the cached responses
+    client.post(genres_url, {'name': 'Test'}, **request_args)
+    response = client.get(genres_url, {'page_size': 100})
+    assert response['X-Cache'] == 'MISS'
+    assert 'Test' in set(g['name'] for g in response.json()['results'])
+
+
+def test_retrieve_genre_conditional_get__admin(client):
+    client.post(auth_url, data.admin_credentials, **request_args)
+    genre = Genre.objects.first()
+    response = client.get(genre_url.format(genre_uuid=str(genre.uuid)))
+    etag, last_modified = response['ETag'], response['Last-Modified']
+    assert client.get(genre_url.format(genre_uuid=str(genre.uuid)), HTTP_IF_NONE_MATCH=etag).status_code == 304
+    assert client.get(genre_url.format(genre_uuid=str(genre.uuid)),
+                      HTTP_IF_MODIFIED_SINCE=last_modified).status_code == 304
+
+    # updating the genre changes its etag
+    client.patch(genre_url.format(genre_uuid=str(genre.uuid)), {'name': 'Renamed'}, **request_args)
+    response = client.get(genre_url.format(genre_uuid=str(genre.uuid)), HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200 and response.json()['name'] == 'Renamed'
+
+
+def test_list_genres_omit_url__user(client):
+    client.post(auth_url, data.user1_credentials, **request_args)
+    response = client.get(genres_url, {'omit_url': 'true'})
+    assert response.status_code == 200
+    assert all(set(g.keys()) == {'uuid', 'name'} for g in response.json()['results'])
+
+
+def test_list_genres_compiled_read__user(client, settings):
+    client.post(auth_url, data.user1_credentials, **request_args)
+    for params in ({}, {'order_by': '-name', 'page_size': 3}, {'search': 'ac', 'fields': 'name'}):
+        compiled_response, serializer_response = get_compiled_and_serializer_responses(client, settings, genres_url,
+                                                                                       params)
+        assert compiled_response.status_code == 200
+        assert compiled_response.content == serializer_response.content
+
+
+def test_genre_resolver(client, django_assert_num_queries, monkeypatch, settings):
+    # the requests of the tests run in the transaction of the test, instead of committing their writes
+    monkeypatch.setattr(GenreResolver, 'in_transaction', staticmethod(lambda: False))
+    genre = Genre.objects.get(name='Drama')
+    genre_resolver.get_snapshot()
+    # the genres are resolved without queries, by name (case insensitive) and by uuid
+    with django_assert_num_queries(0):
+        assert genre_resolver.get_by_name('dRAMA') == genre
+        assert genre_resolver.get_by_uuid(str(genre.uuid)) == genre
+        assert genre_resolver.get_by_name('Test') is None
+        assert genre_resolver.get_by_uuid('not a uuid') is None
+        assert genre_resolver.get_ids(['drama', 'Test']) == {'drama': genre.pk}
+
+    # the genres are reloaded after a write
+    client.post(auth_url, data.admin_credentials, **request_args)
+    client.patch(genre_url.format(genre_uuid=str(genre.uuid)), {'name': 'Drama movies'}, **request_args)
+    client.post(genres_url, {'name': 'Test'}, **request_args)
+    assert genre_resolver.get_by_name('drama') is None
+    assert genre_resolver.get_by_name('drama movies') == genre
+    assert genre_resolver.get_by_name('test') == Genre.objects.get(name='Test')
+
+    # and after a write of another process, once the stamp of the genres is checked
+    genre_resolver.get_snapshot()
+    Genre.objects.filter(pk=genre.pk).update(name='Dramas', modified=timezone.now())
+    assert genre_resolver.get_by_name('dramas') is None
+    settings.MOVIE_STORE_GENRE_CACHE = {'CHECK_INTERVAL': 0}
+    assert genre_resolver.get_by_name('dramas') == genre
+
+    # the deleted genres are detected by the number of the genres
+    Genre.objects.filter(name='Test').delete()
+    assert genre_resolver.get_by_name('test') is None
+
+
+def test_genre_resolver_uncommitted_writes():
+    genre_resolver.get_snapshot()
+    # after a write inside a transaction, the snapshots include the uncommitted genres, so they are not kept
+    with transaction.atomic():
+        Genre.objects.create(name='Uncommitted')
+        assert genre_resolver.get_by_name('uncommitted') is not None
+        assert genre_resolver.snapshot is None
+        transaction.set_rollback(True)
+    assert genre_resolver.get_by_name('uncommitted') is None
@@ -1,14 +1,30 @@
+import csv
+import json
+from uuid import uuid4
 import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from common.cache import get_cascade_models, get_model_versions
 from common.tests import data
+from common.tests.utils import get_all_pages, get_compiled_and_serializer_responses
 from movie_store.data.sample_data import genres, movies
-from movie_store.models import Movie
+from movie_store.bulk import GenreMap
+from movie_store.genres import genre_resolver
+from movie_store.models import Genre, Movie, Rental
 from .utils import get_random_movies
 
 auth_url = '/iam/auth/'
 movies_url = '/store/movies/'
 movie_url = '/store/movies/{movie_uuid}/'
+bulk_movies_url = '/store/movies/bulk/'
+movies_export_url = '/store/movies/export/'
 library_url = '/store/movies/library/'
 rentals_url = '/store/rentals/'
+response_cache_stats_url = '/stats/response-cache/'
+
+# maximum number of queries per endpoint (authentication, freshness check, count, page and genres prefetch)
+# the library is not conditional, so there is no freshness check
+movies_query_budget = {'list': 5, 'retrieve': 4, 'library': 4}
 
 # post/patch default arguments
 request_args = {'content_type': 'application/json'}
@@ -78,6 +94,19 @@ def test_create_movie__admin(client):
     assert all(response.json()[k] == data.new_movie_data[k] for k in data.new_movie_data.keys())
 
 
+def test_create_movie_genres_case_insensitive__admin(client, django_assert_max_num_queries):
+    client.post(auth_url, data.admin_credentials, **request_args)
+    client.post(movies_url, data.new_movie_data, **request_args)
+    new_movie_data = dict(data.new_movie_data, genres=['crime', 'DRAMA'])
+    # authentication, movie insert, genre links (current, existing and insert), modification time
+    # and response genres, there are no genre lookups (plus the savepoint queries of the write transaction, which
+    # are only run in the tests)
+    with django_assert_max_num_queries(9):
+        response = client.post(movies_url, new_movie_data, **request_args)
+    assert response.status_code == 201
+    assert sorted(response.json()['genres']) == ['Crime', 'Drama']
+
+
 def test_create_movie_genre_does_not_exist__admin(client):
     client.post(auth_url, data.admin_credentials, **request_args)
     new_movie_data = dict(data.new_movie_data, genres=['Test'])
@@ -85,6 +114,50 @@ def test_create_movie_genre_does_not_exist__admin(client):
     assert response.status_code == 400
 
 
+def use_deleted_genre(monkeypatch):
+    """
+    Resolves a Deleted genre, like the genre cache of a process does for a genre just deleted by another process,
+    and checks the foreign keys right away, since the transactions of the tests are never committed
+    """
+    deleted_genre = Genre.from_db(Genre.objects.db, ['id', 'uuid', 'name'],
+                                  [Genre.objects.order_by('-pk').first().pk + 1000, uuid4(), 'Deleted'])
+    get_by_name, lookup = genre_resolver.get_by_name, GenreMap.lookup
+    monkeypatch.setattr(genre_resolver, 'get_by_name',
+                        lambda name: deleted_genre if name.lower() == 'deleted' else get_by_name(name))
+    monkeypatch.setattr(GenreMap, 'lookup', staticmethod(
+        lambda lower_names: dict(lookup(lower_names), **({'deleted': deleted_genre.pk} if 'deleted' in lower_names
+                                                          else {}))))
+    with connection.cursor() as cursor:
+        cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+
+
+def test_write_movie_deleted_genre__admin(client, monkeypatch):
+    client.post(auth_url, data.admin_credentials, **request_args)
+    use_deleted_genre(monkeypatch)
+    movie = get_random_movies(number_of_movies=1)[0]
+
+    # the deleted genre is reported like an unknown genre, and nothing is written
+    response = client.post(movies_url, dict(data.new_movie_data, genres=['Drama', 'Deleted']), **request_args)
+    assert response.status_code == 400
+    assert response.json() == {'genres': ['Object with name=Deleted does not exist.']}
+    assert not Movie.objects.filter(title=data.new_movie_data['title']).exists()
+    response = client.patch(movie_url.format(movie_uuid=str(movie.uuid)), {'genres': ['Deleted']}, **request_args)
+    assert response.status_code == 400
+    assert response.json() == {'genres': ['Object with name=Deleted does not exist.']}
+
+    # the bulk endpoints report it per item
+    new_movies_data = [dict(data.new_movie_data, title='Bulk movie {}'.format(i), genres=genres)
+                       for i, genres in enumerate((['Drama'], ['Drama', 'Deleted']))]
+    response = client.post(bulk_movies_url, new_movies_data, **request_args)
+    assert response.status_code == 400
+    assert response.json() == [{}, {'genres': ['Object with name=Deleted does not exist.']}]
+    assert not Movie.objects.filter(title__startswith='Bulk movie').exists()
+    response = client.patch(bulk_movies_url, [{'uuid': str(movie.uuid), 'genres': ['Deleted']}], **request_args)
+    assert response.status_code == 400
+    assert response.json() == [{'genres': ['Object with name=Deleted does not exist.']}]
+    assert 'Deleted' not in [genre.name for genre in movie.genres.all()]
+
+
 def test_partial_update_movie__unauthenticated(client):
     all_movies = Movie.objects.all()
     for movie in all_movies:
@@ -137,6 +210,110 @@ def test_delete_movie__admin(client):
     assert len(remaining_movies) == 0
 
 
+def test_bulk_movies__user(client):
+    client.post(auth_url, data.user1_credentials, **request_args)
+    movie = Movie.objects.first()
+    assert client.post(bulk_movies_url, [data.new_movie_data], **request_args).status_code == 403
+    assert client.patch(bulk_movies_url, [{'uuid': str(movie.uuid), 'title': 'Updated'}],
+                        **request_args).status_code == 403
+    assert client.delete(bulk_movies_url, [{'uuid': str(movie.uuid)}], **request_args).status_code == 403
+
+
+def test_bulk_create_movies__admin(client, django_assert_max_num_queries):
+    client.post(auth_url, data.admin_credentials, **request_args)
+    new_movies_data = [dict(data.new_movie_data, title='Bulk movie {}'.format(i), genres=['crime', 'Drama'])
+                       for i in range(50)]
+    # authentication, genres stamp and lookup, movies insert and genre links insert (plus the savepoint)
+    with django_assert_max_num_queries(7):
+        response = client.post(bulk_movies_url, new_movies_data, **request_args)
+    assert response.status_code == 201
+    assert response.json()['count'] == 50
+    created_movies = Movie.objects.filter(uuid__in=response.json()['uuids']).prefetch_related('genres')
+    assert sorted(m.title for m in created_movies) == sorted(m['title'] for m in new_movies_data)
+    assert all(sorted(g.name for g in m.genres.all()) == ['Crime', 'Drama'] for m in created_movies)
+
+
+def test_bulk_create_movies_errors__admin(client):
+    client.post(auth_url, data.admin_credentials, **request_args)
+    number_of_movies = Movie.objects.count()
+    new_movies_data = [data.new_movie_data, dict(data.new_movie_data, genres=['Test']),
+                       {k: v for k, v in data.new_movie_data.items() if k != 'title'}]
+    response = client.post(bulk_movies_url, new_movies_data, **request_args)
+    assert response.status_code == 400
+    errors = response.json()
+    assert errors[0] == {}
+    assert list(errors[1].keys()) == ['genres']
+    assert list(errors[2].keys()) == ['title']
+    assert Movie.objects.count() == number_of_movies
+
+    response = client.post(bulk_movies_url, data.new_movie_data, **request_args)
+    assert response.status_code == 400
+
+
+def test_bulk_movies_empty__admin(client):
+    client.post(auth_url, data.admin_credentials, **request_args)
+    for method in (client.post, client.patch, client.delete):
+        response = method(bulk_movies_url, [], **request_args)
+        assert response.status_code == 400
+        assert list(response.json().keys()) == ['non_field_errors']
+
+
+def test_bulk_partial_update_movies__admin(client):
+    client.post(auth_url, data.admin_credentials, **request_args)
+    all_movies = list(Movie.objects.all())
+    updates = [{'uuid': str(movie.uuid), 'title': 'Updated {}'.format(movie.title)} for movie in all_movies]
+    updates[0]['genres'] = ['Drama']
+    response = client.patch(bulk_movies_url, updates, **request_args)
+    assert response.status_code == 200
+    assert response.json()['count'] == len(all_movies)
+    for movie in all_movies:
+        updated_movie = Movie.objects.get(pk=movie.pk)
+        assert updated_movie.title == 'Updated {}'.format(movie.title)
+        assert (updated_movie.year, updated_movie.director) == (movie.year, movie.director)
+    assert [g.name for g in Movie.objects.get(pk=all_movies[0].pk).genres.all()] == ['Drama']
+
+    response = client.get(movie_url.format(movie_uuid=str(all_movies[1].uuid)))
+    assert response.json()['title'] == 'Updated {}'.format(all_movies[1].title)
+
+
+def test_bulk_partial_update_movies_errors__admin(client):
+    client.post(auth_url, data.admin_credentials, **request_args)
+    movie, other_movie = get_random_movies(2)
+    updates = [{'uuid': str(movie.uuid), 'title': 'Updated'}, {'uuid': str(uuid4()), 'title': 'Updated'},
+               {'uuid': str(movie.uuid), 'year': 2000}, {'uuid': str(other_movie.uuid), 'year': 'invalid'}]
+    response = client.patch(bulk_movies_url, updates, **request_args)
+    assert response.status_code == 400
+    errors = response.json()
+    assert list(errors[0].keys()) == ['uuid']  # duplicate
+    assert list(errors[1].keys()) == ['uuid']  # does not exist
+    assert list(errors[2].keys()) == ['uuid']  # duplicate
+    assert list(errors[3].keys()) == ['year']
+    assert Movie.objects.get(pk=movie.pk).title == movie.title
+
+
+def test_bulk_delete_movies__admin(client, django_assert_max_num_queries, django_capture_on_commit_callbacks):
+    client.post(auth_url, data.admin_credentials, **request_args)
+    movies_to_delete = get_random_movies(3)
+    client.post(rentals_url, {'movie': str(movies_to_delete[0].uuid)}, **request_args)
+    versions = get_model_versions([Movie, Rental])
+    # authentication, movies lookup, one query per table for the cascades (fast deletes) and one for the movies
+    # (plus the savepoint and its release), and the versions are bumped once per model, not per movie
+    with django_assert_max_num_queries(11), django_capture_on_commit_callbacks(execute=True) as callbacks:
+        response = client.delete(bulk_movies_url, [{'uuid': str(movie.uuid)} for movie in movies_to_delete],
+                                 **request_args)
+    assert response.status_code == 200
+    assert len(callbacks) == 1 + len(get_cascade_models(Movie))
+    # the versions of the movies and of the rentals deleted by the cascade are bumped
+    assert all(new_version != version for new_version, version in zip(get_model_versions([Movie, Rental]),
+                                                                       versions))
+    assert response.json()['count'] == 3
+    assert not Movie.objects.filter(pk__in=[movie.pk for movie in movies_to_delete]).exists()
+    assert not Rental.objects.filter(movie_id__in=[movie.pk for movie in movies_to_delete]).exists()
+
+    response = client.delete(bulk_movies_url, [{'uuid': str(movies_to_delete[0].uuid)}], **request_args)
+    assert response.status_code == 400
+
+
 def test_filter_movies_by_year__user(client):
     client.post(auth_url, data.user1_credentials, **request_args)
     years = set([m['year'] for m in movies])
@@ -157,6 +334,67 @@ def test_filter_movies_by_director__user(client):
         assert len(response.json()['results']) == len(movies_by_that_director)
 
 
+def test_filter_movies_by_years__user(client):
+    client.post(auth_url, data.user1_credentials, **request_args)
+    years = sorted(set(m['year'] for m in movies))
+    filters = [
+        ({'year': '{},{}'.format(years[0], years[-1])}, lambda year: year in (years[0], years[-1])),
+        ({'year_min': years[1]}, lambda year: year >= years[1]),
+        ({'year_min': years[1], 'year_max': years[-2]}, lambda year: years[1] <= year <= years[-2]),
+        ({'decade': '1990s'}, lambda year: 1990 <= year <= 1999),
+        ({'decade': 1990, 'year': '1994, 2004'}, lambda year: year == 1994),
+    ]
+    for params, matches in filters:
+        response = client.get(movies_url, dict(params, page_size=100))
+        assert response.status_code == 200
+        assert sorted(m['title'] for m in response.json()['results']) == \
+            sorted(m['title'] for m in movies if matches(m['year'])), params
+
+    for params in ({'year': '1999,x'}, {'year_min': 'x'}, {'decade': 1995}, {'year': ','}):
+        response = client.get(movies_url, params)
+        assert response.status_code == 200
+        assert response.json()['results'] == []
+
+
+def test_filter_movies_by_directors_case_insensitive__user(client):
+    client.post(auth_url, data.user1_credentials, **request_args)
+    directors = sorted(set(m['director'] for m in movies))[:2]
+    response = client.get(movies_url, {'director': '{} , {}'.format(directors[0].upper(), directors[1].lower()),
+                                       'page_size': 100})
+    assert response.status_code == 200
+    assert sorted(m['title'] for m in response.json()['results']) == \
+        sorted(m['title'] for m in movies if m['director'] in directors)
+
+
+def get_movies_filter_plans(client, params, column):
+    """
+    Gets the query plans of the queries of a movies list request that filter by a column, with the sequential
+    scans disabled, since the test tables are too small for the indexes to be used otherwise.
+    """
+    with CaptureQueriesContext(connection) as context:
+        assert client.get(movies_url, params).status_code == 200
+    filter_queries = [query['sql'] for query in context.captured_queries
+                      if 'WHERE' in query['sql'] and column in query['sql'].split('WHERE', 1)[1]]
+    assert filter_queries
+    with connection.cursor() as cursor:
+        cursor.execute('SET enable_seqscan = off')
+        plans = []
+        for sql in filter_queries:
+            cursor.execute('EXPLAIN ' + sql)
+            plans.append('\n'.join(row[0] for row in cursor.fetchall()))
+        cursor.execute('RESET enable_seqscan')
+    return plans
+
+
+def test_filter_movies_indexes__user(client):
+    client.post(auth_url, data.user1_credentials, **request_args)
+    for params in ({'year': '1994,1999'}, {'year_min': 1990, 'year_max': 1999}, {'decade': 1990}):
+        plans = get_movies_filter_plans(client, params, '"movie_store_movie"."year"')
+        assert all('movie_year_title_idx' in plan for plan in plans), plans
+    plans = get_movies_filter_plans(client, {'director': 'joss whedon,Peter Jackson'}, 'UPPER(')
+    assert all('movie_upper_director_idx' in plan for plan in plans), plans
+
+
 def test_filter_movies_by_one_genre__user(client):
     client.post(auth_url, data.user1_credentials, **request_args)
     for genre in genres:
@@ -188,6 +426,62 @@ def test_filter_movies_by_multiple_genres__user(client):
     assert set(m['title'] for m in response_2_movies) == set(m['title'] for m in movies_for_comb_2)
 
 
+def test_filter_movies_by_multiple_genres_case_insensitive__user(client, django_assert_max_num_queries):
+    client.post(auth_url, data.user1_credentials, **request_args)
+    combination = ['Adventure', 'Fantasy', 'Action']
+    movies_for_comb = [movie for movie in movies if all(genre in movie['genres'] for genre in combination)]
+
+    # the genres are resolved by the genre cache, which is loaded once,
+    # regardless of the number of the requested genres
+    client.get(movies_url, {'genre': 'action'})
+    with django_assert_max_num_queries(movies_query_budget['list']):
+        response = client.get(movies_url, {'genre': ' adventure,FANTASY , Action,action'})
+    assert response.status_code == 200
+    assert set(m['title'] for m in response.json()['results']) == set(m['title'] for m in movies_for_comb)
+
+
+def test_search_movies__user(client):
+    client.post(auth_url, data.user1_credentials, **request_args)
+    summary_match = Movie.objects.create(title='Another movie', year=2020, director='Someone',
+                                         summary='A movie about a zorblax and its friends.')
+    title_match = Movie.objects.create(title='The zorblax', year=2021, director='Someone else',
+                                       summary='Nothing to see here.')
+    director_match = Movie.objects.create(title='Yet another movie', year=2019, director='Jane Zorblax',
+                                          summary='Nothing to see here either.')
+
+    # the title, director and summary are searched and the results are ordered by relevance
+    response = client.get(movies_url, {'search': 'zorblax'})
+    assert response.status_code == 200
+    assert [m['uuid'] for m in response.json()['results']] == \
+           [str(title_match.uuid), str(director_match.uuid), str(summary_match.uuid)]
+
+    # all the search terms should match
+    response = client.get(movies_url, {'search': 'zorblax friends'})
+    assert [m['uuid'] for m in response.json()['results']] == [str(summary_match.uuid)]
+
+    # the last search term matches word prefixes too
+    response = client.get(movies_url, {'search': 'zorbl'})
+    assert len(response.json()['results']) == 3
+    response = client.get(movies_url, {'search': 'zorbl friends'})
+    assert response.json()['results'] == []
+    response = client.get(movies_url, {'search': "friends zorbl'"})
+    assert [m['uuid'] for m in response.json()['results']] == [str(summary_match.uuid)]
+
+    # an explicit ordering overrides the relevance, an invalid one does not
+    response = client.get(movies_url, {'search': 'zorblax', 'order_by': 'year'})
+    assert [m['uuid'] for m in response.json()['results']] == \
+           [str(director_match.uuid), str(summary_match.uuid), str(title_match.uuid)]
+    response = client.get(movies_url, {'search': 'zorblax', 'order_by': 'bogus'})
+    assert [m['uuid'] for m in response.json()['results']] == \
+           [str(title_match.uuid), str(director_match.uuid), str(summary_match.uuid)]
+
+    # the search vector is kept in sync on updates
+    client.post(auth_url, data.admin_credentials, **request_args)
+    client.patch(movie_url.format(movie_uuid=str(title_match.uuid)), {'title': 'Renamed'}, **request_args)
+    response = client.get(movies_url, {'search': 'zorblax'})
+    assert [m['uuid'] for m in response.json()['results']] == [str(director_match.uuid), str(summary_match.uuid)]
+
+
 def test_list_library__user(client):
     client.post(auth_url, data.user1_credentials, **request_args)
 
@@ -209,3 +503,378 @@ def test_list_library__user(client):
     second_response = client.get(library_url)
     assert second_response.status_code == 200
     assert len(second_response.json()['results']) == 0
+
+
+def test_list_library_filtering_ordering_pagination__user(client):
+    client.post(auth_url, data.user1_credentials, **request_args)
+    rented_movies = get_random_movies(number_of_movies=6)
+    for movie in rented_movies:
+        client.post(rentals_url, {'movie': str(movie.uuid)}, **request_args)
+
+    # ordering and pagination
+    titles = sorted(m.title for m in rented_movies)
+    first_page = client.get(library_url, {'order_by': 'title', 'page_size': 4})
+    second_page = client.get(library_url, {'order_by': 'title', 'page_size': 4, 'page': 2})
+    assert first_page.status_code == 200 and second_page.status_code == 200
+    assert first_page.json()['count'] == len(rented_movies)
+    assert [m['title'] for m in first_page.json()['results'] + second_page.json()['results']] == titles
+
+    # filtering
+    year = rented_movies[0].year
+    year_response = client.get(library_url, {'year': year})
+    assert year_response.status_code == 200
+    assert len(year_response.json()['results']) == len([m for m in rented_movies if m.year == year])
+
+    # returned rentals are not in the library
+    rental = client.get(rentals_url, {'movie': str(rented_movies[0].uuid)}).json()['results'][0]
+    client.patch(rental['url'], {'returned': True}, **request_args)
+    response = client.get(library_url)
+    assert response.json()['count'] == len(rented_movies) - 1
+    assert str(rented_movies[0].uuid) not in set(m['uuid'] for m in response.json()['results'])
+
+
+def test_movie_facets__user(client, django_assert_max_num_queries):
+    client.post(auth_url, data.user1_credentials, **request_args)
+    facets_url = movies_url + 'facets/'
+    for params in ({}, {'genre': 'Action'}, {'decade': 2000, 'director': 'peter jackson'}, {'search': 'ring'}):
+        # authentication and one grouped query per facet
+        with django_assert_max_num_queries(4):
+            response = client.get(facets_url, params)
+        assert response.status_code == 200
+        assert response['X-Cache'] == 'MISS'
+        facets = response.json()
+
+        # the counts are the counts of the list, with the facet value as an extra filter
+        # (the genres filter keeps the movies of all the genres)
+        assert facets['count'] == client.get(movies_url, params).json()['count'] > 0
+        for facet, param in (('genres', 'genre'), ('years', 'year'), ('decades', 'decade'),
+                             ('directors', 'director')):
+            if param in params and param != 'genre':
+                continue
+            assert facets[facet]
+            for value in facets[facet]:
+                filter_value = ','.join(v for v in (params.get(param), str(value['value'])) if v)
+                assert client.get(movies_url, dict(params, **{param: filter_value})).json()['count'] == value['count']
+
+        # the facets are cached per filters
+        assert client.get(facets_url, params)['X-Cache'] == 'HIT'
+
+
+def test_movie_also_rented__user(client, django_assert_max_num_queries):
+    movie, other_movie, third_movie = get_random_movies(number_of_movies=3)
+    client.post(auth_url, data.user1_credentials, **request_args)
+    for rented_movie in (movie, other_movie, third_movie):
+        client.post(rentals_url, {'movie': str(rented_movie.uuid)}, **request_args)
+    client.post(auth_url, data.user2_credentials, **request_args)
+    for rented_movie in (movie, other_movie):
+        rental_uuid = client.post(rentals_url, {'movie': str(rented_movie.uuid)}, **request_args).json()['uuid']
+    # renting a movie again is not counted twice
+    client.patch(rentals_url + rental_uuid + '/', {'returned': True}, **request_args)
+    client.post(rentals_url, {'movie': str(other_movie.uuid)}, **request_args)
+
+    # authentication, the co-rentals with their movies and the genres of the movies
+    with django_assert_max_num_queries(3):
+        response = client.get(movie_url.format(movie_uuid=movie.uuid) + 'also-rented/')
+    assert response.status_code == 200
+    assert [(r['movie']['uuid'], r['count']) for r in response.json()] == \
+        [(str(other_movie.uuid), 2), (str(third_movie.uuid), 1)]
+    assert response.json()[0]['movie'] == client.get(movie_url.format(movie_uuid=other_movie.uuid)).json()
+
+    # the ties are ordered by movie id
+    response = client.get(movie_url.format(movie_uuid=third_movie.uuid) + 'also-rented/',
+                          {'limit': 1, 'fields': 'uuid'})
+    first_movie = min(movie, other_movie, key=lambda m: m.pk)
+    assert response.json() == [{'movie': {'uuid': str(first_movie.uuid)}, 'count': 1}]
+
+    unrented_movie = Movie.objects.exclude(pk__in=[movie.pk, other_movie.pk, third_movie.pk]).first()
+    assert client.get(movie_url.format(movie_uuid=unrented_movie.uuid) + 'also-rented/').json() == []
+    for movie_uuid in (uuid4(), 'invalid'):
+        assert client.get(movie_url.format(movie_uuid=movie_uuid) + 'also-rented/').status_code == 404
+
+
+def test_list_movies_by_popularity__user(client, settings):
+    movie, other_movie = get_random_movies(number_of_movies=2)
+    client.post(auth_url, data.user1_credentials, **request_args)
+    client.get(movies_url, {'order_by': '-popularity'})
+    for rented_movie in (movie, other_movie):
+        client.post(rentals_url, {'movie': str(rented_movie.uuid)}, **request_args)
+    client.post(auth_url, data.user2_credentials, **request_args)
+    client.post(rentals_url, {'movie': str(other_movie.uuid)}, **request_args)
+
+    # the responses ordered by popularity are neither cached nor conditional, since the rentals do not change
+    # the versions and the modification times of the movies
+    response = client.get(movies_url, {'order_by': '-popularity,title'})
+    assert response.status_code == 200
+    assert 'X-Cache' not in response and 'ETag' not in response
+    assert [m['uuid'] for m in response.json()['results'][:2]] == [str(other_movie.uuid), str(movie.uuid)]
+    assert 'popularity' not in response.json()['results'][0]
+
+    compiled_response, serializer_response = get_compiled_and_serializer_responses(
+        client, settings, movies_url, {'order_by': '-popularity', 'pagination': 'cursor'})
+    assert compiled_response.json() == serializer_response.json()
+
+
+def test_export_movies__user(client):
+    client.post(auth_url, data.user1_credentials, **request_args)
+    response = client.get(movies_export_url)
+    assert response.status_code == 403
+
+
+def test_export_movies__admin(client, django_assert_max_num_queries):
+    client.post(auth_url, data.admin_credentials, **request_args)
+    create_extra_movies(30)
+    all_movies = get_all_pages(client, movies_url, {'page_size': 1000})[0]
+
+    # the genres are read with one query per chunk of movies
+    with django_assert_max_num_queries(10):
+        response = client.get(movies_export_url, {'export_format': 'ndjson'})
+        content = b''.join(response.streaming_content).decode('utf-8')
+    assert response.status_code == 200
+    rows = [json.loads(line) for line in content.splitlines()]
+    assert rows == [{k: movie[k] for k in ('uuid', 'title', 'year', 'director', 'summary', 'genres')}
+                    for movie in all_movies]
+
+    # the filters of the list are applied
+    genre = Genre.objects.first().name
+    response = client.get(movies_export_url, {'genre': genre, 'export_format': 'csv'})
+    assert response['Content-Disposition'] == 'attachment; filename="movies.csv"'
+    rows = list(csv.DictReader(b''.join(response.streaming_content).decode('utf-8').splitlines()))
+    genre_movies = client.get(movies_url, {'genre': genre, 'page_size': 1000}).json()['results']
+    assert [row['uuid'] for row in rows] == [movie['uuid'] for movie in genre_movies]
+    assert all(genre in row['genres'].split(',') for row in rows)
+
+
+def test_list_movies_cursor_pagination__user(client):
+    client.post(auth_url, data.user1_credentials, **request_args)
+    create_extra_movies(number_of_movies=15)
+    for ordering in ('title', '-year', 'year'):
+        all_movies = client.get(movies_url, {'order_by': ordering, 'page_size': 1000}).json()['results']
+
+        # follow the next links (there are many movies with the same year, so the id tiebreaker is needed)
+        pages = get_all_pages(client, movies_url, {'order_by': ordering, 'page_size': 4, 'pagination': 'cursor'})
+        paged_movies = [m for page in pages for m in page]
+        field = ordering.lstrip('-')
+        assert [m[field] for m in paged_movies] == [m[field] for m in all_movies]
+        assert sorted(m['uuid'] for m in paged_movies) == sorted(m['uuid'] for m in all_movies)
+        assert all(len(page) == 4 for page in pages[:-1])
+
+        # and then back, following the previous links from the last page
+        last_page = client.get(movies_url, {'order_by': ordering, 'page_size': 4, 'pagination': 'cursor'})
+        while last_page.json()['next'] is not None:
+            last_page = client.get(last_page.json()['next'])
+        assert 'count' not in last_page.json()
+        previous_pages = get_all_pages(client, last_page.json()['previous'], {}, link='previous')
+        assert list(reversed(previous_pages)) == pages[:-1]
+
+
+def test_search_movies_cursor_pagination__user(client):
+    # movies with the same text have tied search ranks (which are not exact as a float8 literal)
+    client.post(auth_url, data.user1_credentials, **request_args)
+    tied_movies = [Movie.objects.create(title='Zorblax returns', year=2000 + i, director='Someone',
+                                        summary='The zorblax is back, with its friends.') for i in range(5)]
+    Movie.objects.create(title='Another zorblax movie', year=2010, director='Someone else', summary='Nothing.')
+    all_movies = client.get(movies_url, {'search': 'zorblax', 'page_size': 1000}).json()['results']
+    assert len(all_movies) == 6
+
+    # no tied movie is skipped at the page boundaries
+    pages = get_all_pages(client, movies_url, {'search': 'zorblax', 'page_size': 2, 'pagination': 'cursor'})
+    assert [m['uuid'] for page in pages for m in page] == [m['uuid'] for m in all_movies]
+    assert set(str(movie.uuid) for movie in tied_movies) <= set(m['uuid'] for m in all_movies)
+
+
+def test_list_movies_invalid_cursor__user(client):
+    client.post(auth_url, data.user1_credentials, **request_args)
+    response = client.get(movies_url, {'cursor': 'invalid'})
+    assert response.status_code == 404
+
+
+def test_list_movies_cached_count__user(client):
+    client.post(auth_url, data.user1_credentials, **request_args)
+    response = client.get(movies_url)
+    assert response.status_code == 200
+    assert response.json()['count_mode'] == 'cached'
+    assert response.json()['count'] == len(movies)
+
+    # the cached count is invalidated on writes
+    Movie.objects.create(**{k: v for k, v in data.new_movie_data.items() if k != 'genres'})
+    response = client.get(movies_url)
+    assert response.json()['count'] == len(movies) + 1
+
+    # including writes to the other tables of the query
+    genre = Genre.objects.get(name='Drama')
+    filtered_count = client.get(movies_url, {'genre': 'Drama'}).json()['count']
+    Movie.objects.exclude(genres=genre).first().genres.add(genre)
+    assert client.get(movies_url, {'genre': 'Drama'}).json()['count'] == filtered_count + 1
+
+
+def test_list_movies_response_cache__user(client, django_assert_max_num_queries):
+    client.post(auth_url, data.user1_credentials, **request_args)
+    first_response = client.get(movies_url, {'order_by': 'year', 'page_size': 5})
+    assert first_response['X-Cache'] == 'MISS'
+
+    # only the authentication queries on a hit, the validators are cached with the response, the query
+    # parameters are normalized
+    with django_assert_max_num_queries(1):
+        second_response = client.get(movies_url, {'page_size': 5, 'order_by': 'year'})
+    assert second_response['X-Cache'] == 'HIT'
+    assert second_response.content == first_response.content
+    assert second_response['ETag'] == first_response['ETag']
+
+    # the cached responses are invalidated by writes to the movies, the genres and the movie genres
+    movie = Movie.objects.get(uuid=first_response.json()['results'][0]['uuid'])
+    genre = Genre.objects.exclude(movie=movie).first()
+    genre.name = 'Renamed'
+    writes = [lambda: movie.save(), lambda: movie.genres.add(genre), lambda: genre.save()]
+    for write in writes:
+        write()
+        response = client.get(movies_url, {'order_by': 'year', 'page_size': 5})
+        assert response['X-Cache'] == 'MISS'
+    assert 'Renamed' in response.json()['results'][0]['genres']
+
+    # the library is not cached
+    client.get(library_url)
+    assert client.get(library_url).get('X-Cache') is None
+
+
+def test_retrieve_movie_response_cache_file_backend__user(client, settings, tmp_path):
+    settings.CACHES = {'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                                   'LOCATION': str(tmp_path)}}
+    client.post(auth_url, data.user1_credentials, **request_args)
+    movie = get_random_movies(number_of_movies=1)[0]
+    first_response = client.get(movie_url.format(movie_uuid=str(movie.uuid)))
+    second_response = client.get(movie_url.format(movie_uuid=str(movie.uuid)))
+    assert first_response['X-Cache'] == 'MISS' and second_response['X-Cache'] == 'HIT'
+    assert second_response.json() == first_response.json()
+
+    movie.delete()
+    assert client.get(movie_url.format(movie_uuid=str(movie.uuid))).status_code == 404
+
+
+def test_response_cache_stats(client):
+    client.post(auth_url, data.user1_credentials, **request_args)
+    for _ in range(3):
+        client.get(movies_url)
+    assert client.get(response_cache_stats_url).status_code == 403
+
+    client.post(auth_url, data.admin_credentials, **request_args)
+    response = client.get(response_cache_stats_url)
+    assert response.status_code == 200
+    assert response.json()['movies'] == {'hits': 2, 'misses': 1}
+    assert response.json()['genres'] == {'hits': 0, 'misses': 0}
+
+
+def test_list_movies_conditional_get__user(client, django_assert_max_num_queries):
+    client.post(auth_url, data.user1_credentials, **request_args)
+    response = client.get(movies_url, {'order_by': 'year'})
+    etag = response['ETag']
+    # the lists have no Last-Modified, which cannot tell deletions
+    assert 'Last-Modified' not in response
+
+    # the client's copy is fresh, the freshness is checked without serializing the movies
+    with django_assert_max_num_queries(2):
+        not_modified_response = client.get(movies_url, {'order_by': 'year'}, HTTP_IF_NONE_MATCH=etag)
+    assert not_modified_response.status_code == 304
+
+    # other query parameters give another response
+    assert client.get(movies_url, {'order_by': 'title'}, HTTP_IF_NONE_MATCH=etag).status_code == 200
+
+    # updating or deleting a movie changes the etag
+    movie = Movie.objects.order_by('year').first()
+    movie.genres.add(Genre.objects.exclude(movie=movie).first())
+    response = client.get(movies_url, {'order_by': 'year'}, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200 and response['ETag'] != etag
+    etag = response['ETag']
+    movie.delete()
+    response = client.get(movies_url, {'order_by': 'year'}, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200 and response['ETag'] != etag
+
+
+def test_retrieve_movie_conditional_get__user(client):
+    client.post(auth_url, data.user1_credentials, **request_args)
+    movie = Movie.objects.filter(genres__isnull=False).first()
+    response = client.get(movie_url.format(movie_uuid=str(movie.uuid)))
+    etag = response['ETag']
+    assert client.get(movie_url.format(movie_uuid=str(movie.uuid)), HTTP_IF_NONE_MATCH=etag).status_code == 304
+
+    # renaming a genre of the movie changes its representation and its etag
+    genre = movie.genres.first()
+    genre.name = 'Renamed'
+    genre.save()
+    response = client.get(movie_url.format(movie_uuid=str(movie.uuid)), HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200 and response['ETag'] != etag
+    assert 'Renamed' in response.json()['genres']
+
+
+def create_extra_movies(number_of_movies):
+    """Creates some extra movies with genres, in order to have more movies than the sample data"""
+    all_genres = list(Genre.objects.all())
+    for i in range(number_of_movies):
+        movie = Movie.objects.create(title='Extra movie {}'.format(i), year=2000 + i % 20,
+                                     summary='Summary {}'.format(i), director='Director {}'.format(i % 5))
+        movie.genres.set(all_genres[:1 + i % len(all_genres)])
+
+
+def test_list_movies_query_budget__user(client, django_assert_max_num_queries):
+    client.post(auth_url, data.user1_credentials, **request_args)
+    create_extra_movies(number_of_movies=30)
+
+    # the number of queries should not depend on the page size
+    for page_size in (1, 10, 1000):
+        with django_assert_max_num_queries(movies_query_budget['list']):
+            response = client.get(movies_url, {'page_size': page_size})
+        assert response.status_code == 200
+        assert all(len(m['genres']) > 0 for m in response.json()['results'])
+
+
+def test_list_movies_sparse_fieldsets__user(client, django_assert_max_num_queries):
+    client.post(auth_url, data.user1_credentials, **request_args)
+    full_response = client.get(movies_url)
+
+    response = client.get(movies_url, {'fields': 'uuid,title,year'})
+    assert response.status_code == 200
+    assert [m for m in response.json()['results']] == [{k: m[k] for k in ('uuid', 'title', 'year')}
+                                                       for m in full_response.json()['results']]
+
+    # without the genres, they are not prefetched
+    with django_assert_max_num_queries(movies_query_budget['list'] - 1):
+        response = client.get(movies_url, {'exclude': 'genres,summary', 'omit_url': 'true'})
+    assert all(set(m.keys()) == {'uuid', 'title', 'year', 'director'} for m in response.json()['results'])
+    assert len(response.content) < len(full_response.content)
+
+    movie = Movie.objects.first()
+    response = client.get(movie_url.format(movie_uuid=str(movie.uuid)), {'fields': 'title'})
+    assert response.json() == {'title': movie.title}
+
+
+def test_list_movies_compiled_read__user(client, settings):
+    client.post(auth_url, data.user1_credentials, **request_args)
+    create_extra_movies(number_of_movies=30)
+    for movie in get_random_movies(number_of_movies=3):
+        client.post(rentals_url, {'movie': str(movie.uuid)}, **request_args)
+
+    # the compiled read serializer responds with exactly the same bytes as the serializer
+    for url, params in ((movies_url, {'page_size': 1000}), (movies_url, {'order_by': '-year', 'fields': 'url,title'}),
+                        (movies_url, {'genre': 'action', 'search': 'movie', 'omit_url': 'true'}),
+                        (movies_url, {'pagination': 'cursor', 'order_by': 'title'}), (library_url, {})):
+        compiled_response, serializer_response = get_compiled_and_serializer_responses(client, settings, url, params)
+        assert compiled_response.status_code == 200
+        assert compiled_response.content == serializer_response.content
+
+
+def test_retrieve_movie_query_budget__user(client, django_assert_max_num_queries):
+    client.post(auth_url, data.user1_credentials, **request_args)
+    movie = get_random_movies(number_of_movies=1)[0]
+    with django_assert_max_num_queries(movies_query_budget['retrieve']):
+        response = client.get(movie_url.format(movie_uuid=str(movie.uuid)))
+    assert response.status_code == 200
+
+
+def test_list_library_query_budget__user(client, django_assert_max_num_queries):
+    client.post(auth_url, data.user1_credentials, **request_args)
+    for movie in get_random_movies(number_of_movies=5):
+        client.post(rentals_url, {'movie': str(movie.uuid)}, **request_args)
+
+    with django_assert_max_num_queries(movies_query_budget['library']):
+        response = client.get(library_url, {'page_size': 1000})
+    assert response.status_code == 200
+    assert len(response.json()['results']) == 5
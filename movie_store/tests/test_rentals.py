@@ -1,11 +1,37 @@
+import csv
+import json
+import random
+import re
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from threading import Barrier
+from uuid import uuid4
 import pytest
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from common.paginations import CountingPaginator
 from common.tests import data
-from common.tests.utils import get_random_string
+from common.tests.utils import get_random_string, get_all_pages, get_compiled_and_serializer_responses
+from movie_store.archive import archive_rentals
+from movie_store.logic import calculate_charge, fee_expression
+from movie_store.models import ArchivedRental, Rental
 from .utils import get_random_movies
 
 auth_url = '/iam/auth/'
 rentals_url = '/store/rentals/'
 rental_url = '/store/rentals/{rental_uuid}/'
+rentals_export_url = '/store/rentals/export/'
+rentals_bulk_return_url = '/store/rentals/bulk-return/'
+rentals_balance_url = '/store/rentals/balance/'
+
+# maximum number of queries per endpoint, regardless of the number of rentals (authentication, the rentals with
+# their users and movies, the genres of the movies, plus the estimated and exact counts of the list, and the
+# movie lookup and the writes of create (with the co-rentals and the popularity, in a transaction whose savepoint
+# queries are only run in the tests) and update (with the daily revenue, in a transaction too))
+rentals_query_budget = {'list': 5, 'retrieve': 3, 'create': 9, 'partial_update': 9}
 
 # post/patch default arguments
 request_args = {'content_type': 'application/json'}
@@ -211,6 +237,29 @@ def test_return_rental_again__user(client):
     assert rereturn_response.status_code == 400
 
 
+def test_return_rental_payment__user(client):
+    # login as user 1 and rent movies, rented some days ago
+    client.post(auth_url, data.user1_credentials, **request_args)
+    for days, movie in zip((0, 1, 3, 5, 10), get_random_movies(number_of_movies=5)):
+        rental_response = client.post(rentals_url, {'movie': str(movie.uuid)}, **request_args)
+        rental = Rental.objects.get(uuid=rental_response.json()['uuid'])
+        Rental.objects.filter(pk=rental.pk).update(rental_date=timezone.now() - timedelta(days=days, minutes=1))
+        rental.refresh_from_db()
+        expected_payment = calculate_charge(rental)
+
+        # the payment computed by the database is the same
+        response = client.patch(rental_response.json()['url'], {'returned': True}, **request_args)
+        assert response.status_code == 200
+        assert response.json()['payment'] == pytest.approx(expected_payment)
+        assert Rental.objects.get(pk=rental.pk).payment == pytest.approx(expected_payment)
+
+        # returning again does not change it
+        response = client.patch(rental_response.json()['url'], {'returned': True}, **request_args)
+        assert response.status_code == 400
+        assert Rental.objects.get(pk=rental.pk).payment == pytest.approx(expected_payment)
+    assert expected_payment == 3 * 1.0 + 8 * 0.5
+
+
 def test_ractivate_rental__user(client):
     # login as user 1 and rent a movie
     client.post(auth_url, data.user1_credentials, **request_args)
@@ -447,3 +496,460 @@ def test_filter_rentals_by_status__user(client):
     random_response = client.get(rentals_url, {'status': 'returned'})
     assert random_response.status_code == 200
     assert len(random_response.json()['results']) == number_of_returns
+
+
+def test_rental_fee_expression():
+    # the fee computed by the database is the charge of calculate_charge, for random rental dates around the day
+    # boundaries of the tariff (and in the future), over some rounds of rentals
+    user = get_user_model().objects.get(email=data.user1_credentials['email'])
+    rentals = Rental.objects.bulk_create([Rental(user=user, movie=movie)
+                                          for movie in get_random_movies(number_of_movies=10)])
+    rng = random.Random(0)
+    now = timezone.now()
+    for _ in range(20):
+        for rental in rentals:
+            days = rng.choice([rng.randint(0, 40), rng.random() * 40, -rng.random()])
+            offset = timedelta(microseconds=rng.choice([0, 1, -1, rng.randint(-10 ** 6, 10 ** 6)]))
+            rental.rental_date = now - timedelta(days=days) + offset
+        Rental.objects.bulk_update(rentals, ['rental_date'])
+        fees = dict(Rental.objects.annotate(fee=fee_expression(now)).values_list('pk', 'fee'))
+        for rental in rentals:
+            assert fees[rental.pk] == calculate_charge(rental, current_time=now), rental.rental_date
+
+    # the returned rentals have no fee
+    Rental.objects.update(returned=True)
+    assert set(Rental.objects.annotate(fee=fee_expression(now)).values_list('fee', flat=True)) == {0.0}
+
+
+def test_order_and_filter_rentals_by_fee__user(client):
+    # login as user 1, rent some movies some days ago and return one of them
+    client.post(auth_url, data.user1_credentials, **request_args)
+    for days, movie in zip((0, 1, 3, 5, 10), get_random_movies(number_of_movies=5)):
+        rental_response = client.post(rentals_url, {'movie': str(movie.uuid)}, **request_args)
+        Rental.objects.filter(uuid=rental_response.json()['uuid'])\
+            .update(rental_date=timezone.now() - timedelta(days=days, minutes=1))
+    returned_rental = Rental.objects.order_by('rental_date').last()
+    client.patch(rental_url.format(rental_uuid=returned_rental.uuid), {'returned': True}, **request_args)
+
+    # order by fee, the returned rental has none
+    response = client.get(rentals_url, {'order_by': '-fee'})
+    assert response.status_code == 200
+    assert [rental.get('fee') for rental in response.json()['results']] == [7.0, 4.5, 3.5, 2.0, None]
+    pages = get_all_pages(client, rentals_url, {'order_by': 'fee', 'pagination': 'cursor', 'page_size': 2})
+    assert [rental['uuid'] for page in pages for rental in page] == \
+        [rental['uuid'] for rental in client.get(rentals_url, {'order_by': 'fee'}).json()['results']]
+
+    # filter by fee
+    for params, fees in (({'fee_min': 3}, [3.5, 4.5, 7.0]), ({'fee_max': 3.5}, [None, 2.0, 3.5]),
+                         ({'fee_min': 2.5, 'fee_max': 5}, [3.5, 4.5]), ({'fee_min': 100}, [])):
+        response = client.get(rentals_url, {'order_by': 'fee', **params})
+        assert response.status_code == 200
+        assert [rental.get('fee') for rental in response.json()['results']] == fees
+    response = client.get(rentals_url, {'fee_min': 'invalid'})
+    assert response.status_code == 200
+    assert response.json()['results'] == []
+
+
+def test_rental_balance__user(client):
+    # login as user 1 and rent some movies some days ago
+    client.post(auth_url, data.user1_credentials, **request_args)
+    response = client.get(rentals_balance_url)
+    assert response.status_code == 200
+    assert response.json() == {'active_rentals': 0, 'balance': 0.0}
+    for days, movie in zip((1, 5, 10), get_random_movies(number_of_movies=3)):
+        rental_response = client.post(rentals_url, {'movie': str(movie.uuid)}, **request_args)
+        Rental.objects.filter(uuid=rental_response.json()['uuid'])\
+            .update(rental_date=timezone.now() - timedelta(days=days, minutes=1))
+
+    # the returned rentals are not in the balance
+    rentals = client.get(rentals_url, {'order_by': 'fee'}).json()['results']
+    assert client.get(rentals_balance_url).json() == {'active_rentals': 3, 'balance': 2.0 + 4.5 + 7.0}
+    client.patch(rentals[0]['url'], {'returned': True}, **request_args)
+    assert client.get(rentals_balance_url).json() == {'active_rentals': 2, 'balance': 4.5 + 7.0}
+
+    # the other users have their own balance
+    client.post(auth_url, data.user2_credentials, **request_args)
+    assert client.get(rentals_balance_url).json() == {'active_rentals': 0, 'balance': 0.0}
+
+
+def test_rental_balance__admin(client):
+    # rent a movie with each user, rented a day and a minute ago (a charge of two days)
+    user_uuids = []
+    for credentials in (data.user1_credentials, data.user2_credentials):
+        auth_response = client.post(auth_url, credentials, **request_args)
+        movie = get_random_movies(number_of_movies=1)[0]
+        rental_response = client.post(rentals_url, {'movie': str(movie.uuid)}, **request_args)
+        Rental.objects.filter(uuid=rental_response.json()['uuid'])\
+            .update(rental_date=timezone.now() - timedelta(days=1, minutes=1))
+        user_uuids.append(rental_response.json()['user']['uuid'])
+
+    # the balance of a user or of all users
+    client.post(auth_url, data.admin_credentials, **request_args)
+    assert client.get(rentals_balance_url, {'user': user_uuids[0]}).json() == {'active_rentals': 1, 'balance': 2.0}
+    assert client.get(rentals_balance_url).json() == {'active_rentals': 2, 'balance': 4.0}
+
+
+def test_list_rentals_cursor_pagination__user(client):
+    # login as user 1, rent some movies and return some of them
+    client.post(auth_url, data.user1_credentials, **request_args)
+    for movie in get_random_movies(number_of_movies=7):
+        client.post(rentals_url, {'movie': str(movie.uuid)}, **request_args)
+    rentals = client.get(rentals_url).json()['results']
+    for rental in rentals[:3]:
+        client.patch(rental['url'], {'returned': True}, **request_args)
+
+    # the return date and the payment are null for the active rentals
+    for ordering in ('rental_date', '-return_date', 'return_date', 'payment', '-movie__title'):
+        all_rentals = client.get(rentals_url, {'order_by': ordering, 'page_size': 1000}).json()['results']
+        pages = get_all_pages(client, rentals_url, {'order_by': ordering, 'page_size': 2, 'pagination': 'cursor'})
+        paged_rentals = [r for page in pages for r in page]
+        field = ordering.lstrip('-').replace('movie__', '')
+        get_value = (lambda r: r['movie'][field]) if ordering.endswith('movie__title') else (lambda r: r[field])
+        assert [get_value(r) for r in paged_rentals] == [get_value(r) for r in all_rentals]
+        assert sorted(r['uuid'] for r in paged_rentals) == sorted(r['uuid'] for r in all_rentals)
+
+
+def test_list_rentals_estimated_count__admin(client, settings, monkeypatch):
+    client.post(auth_url, data.admin_credentials, **request_args)
+    for movie in get_random_movies(number_of_movies=3):
+        client.post(rentals_url, {'movie': str(movie.uuid)}, **request_args)
+
+    # below the threshold the rentals are counted exactly
+    response = client.get(rentals_url)
+    assert response.status_code == 200
+    assert response.json()['count_mode'] == 'exact'
+    assert response.json()['count'] == 3
+
+    # above the threshold the count is estimated by the planner
+    settings.MOVIE_STORE_PAGINATION = dict(settings.MOVIE_STORE_PAGINATION, COUNT_ESTIMATE_THRESHOLD=0)
+    response = client.get(rentals_url)
+    assert response.status_code == 200
+    assert response.json()['count_mode'] == 'estimated'
+    assert response.json()['count'] >= 0
+    assert len(response.json()['results']) == 3
+
+    # the pages do not depend on the estimate, whether it is too low or too high
+    for estimated_count in (1, 1000):
+        def get_estimated_count(paginator, sql, params):
+            paginator.count_mode = 'estimated'
+            return estimated_count
+        monkeypatch.setattr(CountingPaginator, 'get_estimated_count', get_estimated_count)
+        response = client.get(rentals_url, {'page_size': 2})
+        assert response.json()['count'] == max(estimated_count, 3)
+        assert len(response.json()['results']) == 2 and response.json()['next'] is not None
+        response = client.get(response.json()['next'])
+        assert response.status_code == 200
+        assert len(response.json()['results']) == 1 and response.json()['next'] is None
+        assert response.json()['count'] == 3
+        response = client.get(rentals_url, {'page_size': 2, 'page': 3})
+        assert response.status_code == 404
+
+
+def test_list_rentals_sparse_fieldsets__user(client):
+    client.post(auth_url, data.user1_credentials, **request_args)
+    for movie in get_random_movies(number_of_movies=3):
+        client.post(rentals_url, {'movie': str(movie.uuid)}, **request_args)
+
+    response = client.get(rentals_url, {'exclude': 'user,movie,fee', 'omit_url': '1'})
+    assert response.status_code == 200
+    assert all(set(r.keys()) == {'uuid', 'rental_date', 'return_date', 'returned', 'payment'}
+               for r in response.json()['results'])
+
+    response = client.get(rentals_url, {'fields': 'uuid,fee'})
+    assert all(set(r.keys()) == {'uuid', 'fee'} for r in response.json()['results'])
+
+    # the fields of the other requests are not affected
+    rental_uuid = response.json()['results'][0]['uuid']
+    response = client.patch(rental_url.format(rental_uuid=rental_uuid) + '?fields=uuid', {'returned': True},
+                            **request_args)
+    assert response.status_code == 200
+    assert response.json()['returned'] is True
+
+
+def test_list_rentals_compiled_read__admin(client, settings):
+    # login as user 1, rent some movies and return some of them
+    client.post(auth_url, data.user1_credentials, **request_args)
+    for movie in get_random_movies(number_of_movies=5):
+        client.post(rentals_url, {'movie': str(movie.uuid)}, **request_args)
+    for rental in client.get(rentals_url).json()['results'][:2]:
+        client.patch(rental['url'], {'returned': True}, **request_args)
+
+    # the compiled read serializer responds with exactly the same bytes as the serializer
+    client.post(auth_url, data.admin_credentials, **request_args)
+    for params in ({}, {'order_by': '-movie__title', 'pagination': 'cursor'}, {'status': 'active', 'exclude': 'fee'},
+                   {'user': data.user1_uuid, 'fields': 'uuid,fee,movie'}):
+        compiled_response, serializer_response = get_compiled_and_serializer_responses(client, settings, rentals_url,
+                                                                                       params)
+        assert compiled_response.status_code == 200
+        assert compiled_response.content == serializer_response.content
+
+
+def test_list_rentals_compiled_read_fee__user(client, settings, monkeypatch):
+    # the compiled read serializer reads the fee annotation of the rows, it does not compute the charge in python
+    client.post(auth_url, data.user1_credentials, **request_args)
+    for movie in get_random_movies(number_of_movies=3):
+        client.post(rentals_url, {'movie': str(movie.uuid)}, **request_args)
+    settings.MOVIE_STORE_COMPILED_READ = True
+    monkeypatch.setattr('movie_store.serializers.calculate_charge', lambda rental: pytest.fail('charge computed'))
+    response = client.get(rentals_url)
+    assert response.status_code == 200
+    assert [rental['fee'] for rental in response.json()['results']] == [1.0, 1.0, 1.0]
+
+
+def test_export_rentals__user(client):
+    client.post(auth_url, data.user1_credentials, **request_args)
+    response = client.get(rentals_export_url)
+    assert response.status_code == 403
+
+
+def test_export_rentals__admin(client):
+    # login as user 1 and user 2, rent some movies and return some of them
+    client.post(auth_url, data.user1_credentials, **request_args)
+    for movie in get_random_movies(number_of_movies=3):
+        client.post(rentals_url, {'movie': str(movie.uuid)}, **request_args)
+    client.post(auth_url, data.user2_credentials, **request_args)
+    for movie in get_random_movies(number_of_movies=4):
+        rental = client.post(rentals_url, {'movie': str(movie.uuid)}, **request_args).json()
+        client.patch(rental['url'], {'returned': True}, **request_args)
+
+    # login as admin and export the rentals of user 2 as ndjson and all the active rentals as csv
+    client.post(auth_url, data.admin_credentials, **request_args)
+    response = client.get(rentals_export_url, {'user': data.user2_uuid})
+    assert response.status_code == 200
+    assert response.streaming
+    assert response['Content-Type'] == 'application/x-ndjson'
+    rows = [json.loads(line) for line in b''.join(response.streaming_content).decode('utf-8').splitlines()]
+    all_rentals = client.get(rentals_url, {'user': data.user2_uuid}).json()['results']
+    assert [row['uuid'] for row in rows] == [rental['uuid'] for rental in all_rentals]
+    assert all(row['user'] == data.user2_credentials['email'] and row['returned'] for row in rows)
+
+    response = client.get(rentals_export_url, {'status': 'active', 'export_format': 'csv'})
+    assert response.status_code == 200
+    assert response['Content-Type'] == 'text/csv'
+    rows = list(csv.DictReader(b''.join(response.streaming_content).decode('utf-8').splitlines()))
+    assert len(rows) == 3
+    assert all(row['user'] == data.user1_credentials['email'] and row['returned'] == 'False' for row in rows)
+
+    response = client.get(rentals_export_url, {'export_format': 'xml'})
+    assert response.status_code == 400
+
+
+def test_bulk_return_rentals__user(client):
+    client.post(auth_url, data.user1_credentials, **request_args)
+    movie = get_random_movies(number_of_movies=1)[0]
+    rental_response = client.post(rentals_url, {'movie': str(movie.uuid)}, **request_args)
+    response = client.post(rentals_bulk_return_url, {'uuids': [rental_response.json()['uuid']]}, **request_args)
+    assert response.status_code == 403
+    assert Rental.objects.filter(returned=False).count() == 1
+
+
+def test_bulk_return_rentals__admin(client):
+    # rent movies with two users, and return one of them as an admin
+    rental_uuids = []
+    for credentials in (data.user1_credentials, data.user2_credentials):
+        client.post(auth_url, credentials, **request_args)
+        for movie in get_random_movies(number_of_movies=5):
+            rental_response = client.post(rentals_url, {'movie': str(movie.uuid)}, **request_args)
+            rental_uuids.append(rental_response.json()['uuid'])
+    client.post(auth_url, data.admin_credentials, **request_args)
+    returned_rental = Rental.objects.get(uuid=rental_uuids[0])
+    client.patch(rental_url.format(rental_uuid=returned_rental.uuid), {'returned': True}, **request_args)
+    returned_rental.refresh_from_db()
+    assert returned_rental.returned
+
+    for invalid_data in ({}, {'uuids': []}, {'uuids': ['invalid']}):
+        response = client.post(rentals_bulk_return_url, invalid_data, **request_args)
+        assert response.status_code == 400
+
+    # the returned rental is not returned again, the unknown uuids are skipped
+    response = client.post(rentals_bulk_return_url, {'uuids': rental_uuids[:8] + [str(uuid4())]},
+                           **request_args)
+    assert response.status_code == 200
+    assert response.json() == {'count': 7}
+    assert Rental.objects.get(pk=returned_rental.pk).return_date == returned_rental.return_date
+    assert Rental.objects.filter(returned=False).count() == 2
+    assert all(rental.payment is not None and rental.return_date is not None
+               for rental in Rental.objects.filter(returned=True))
+
+    # the list shows the returned rentals
+    response = client.get(rentals_url, {'status': 'returned', 'page_size': 100})
+    assert len(response.json()['results']) == 8
+
+    response = client.post(rentals_bulk_return_url, {'uuids': rental_uuids}, **request_args)
+    assert response.json() == {'count': 2}
+
+
+def archive_user_rentals(client, credentials, ages):
+    """Rents some movies, rented some days ago, returns them and archives the ones older than a year"""
+    client.post(auth_url, credentials, **request_args)
+    rental_uuids = []
+    for age, movie in zip(ages, get_random_movies(number_of_movies=len(ages))):
+        rental_response = client.post(rentals_url, {'movie': str(movie.uuid)}, **request_args)
+        client.patch(rental_response.json()['url'], {'returned': True}, **request_args)
+        Rental.objects.filter(uuid=rental_response.json()['uuid'])\
+            .update(rental_date=timezone.now() - timedelta(days=age))
+        rental_uuids.append(rental_response.json()['uuid'])
+    list(archive_rentals(horizon=timezone.now() - timedelta(days=365)))
+    return rental_uuids
+
+
+def test_list_archived_rentals__user(client):
+    archive_user_rentals(client, data.user2_credentials, (400,))
+    rental_uuids = archive_user_rentals(client, data.user1_credentials, (10, 400, 800, 1200))
+
+    # the rentals list the whole history, only the archived rentals are listed with ?archived=true
+    response = client.get(rentals_url)
+    assert [rental['uuid'] for rental in response.json()['results']] == rental_uuids[::-1]
+    response = client.get(rentals_url, {'archived': 'true'})
+    assert response.status_code == 200
+    assert [rental['uuid'] for rental in response.json()['results']] == rental_uuids[:0:-1]
+    assert all(rental['returned'] and rental['payment'] is not None and 'fee' not in rental
+               for rental in response.json()['results'])
+
+    # the archived rentals are filtered by rental date
+    rental_date_min = (timezone.now() - timedelta(days=900)).date().isoformat()
+    response = client.get(rentals_url, {'archived': 'true', 'rental_date_min': rental_date_min})
+    assert [rental['uuid'] for rental in response.json()['results']] == rental_uuids[2:0:-1]
+    rental_date_max = (timezone.now() - timedelta(days=1000)).isoformat()
+    response = client.get(rentals_url, {'archived': '1', 'rental_date_max': rental_date_max})
+    assert [rental['uuid'] for rental in response.json()['results']] == rental_uuids[3:]
+    for params in ({'status': 'active'}, {'rental_date_min': 'invalid'}):
+        response = client.get(rentals_url, {'archived': 'true', **params})
+        assert response.status_code == 200
+        assert response.json()['results'] == []
+
+    # the archived rentals keep their urls, but they cannot be changed
+    response = client.get(rental_url.format(rental_uuid=rental_uuids[1]))
+    assert response.status_code == 200
+    assert response.json()['uuid'] == rental_uuids[1]
+    response = client.patch(rental_url.format(rental_uuid=rental_uuids[1]), {'returned': False}, **request_args)
+    assert response.status_code == 404
+
+
+def test_list_rental_history__user(client):
+    rental_uuids = archive_user_rentals(client, data.user1_credentials, (10, 400, 800))
+    # an active rental older than the horizon is not archived
+    movie = get_random_movies(number_of_movies=1)[0]
+    active_uuid = client.post(rentals_url, {'movie': str(movie.uuid)}, **request_args).json()['uuid']
+    Rental.objects.filter(uuid=active_uuid).update(rental_date=timezone.now() - timedelta(days=500))
+
+    # the lists that reach before the archive horizon read the rentals and the archived rentals
+    with CaptureQueriesContext(connection) as context:
+        response = client.get(rentals_url)
+    assert [rental['uuid'] for rental in response.json()['results']] == \
+        [rental_uuids[2], active_uuid, rental_uuids[1], rental_uuids[0]]
+    assert any('movie_store_rentalhistory' in query['sql'] for query in context.captured_queries)
+    rental_date_max = (timezone.now() - timedelta(days=300)).date().isoformat()
+    response = client.get(rentals_url, {'rental_date_max': rental_date_max})
+    assert [rental['uuid'] for rental in response.json()['results']] == [rental_uuids[2], active_uuid, rental_uuids[1]]
+    response = client.get(rentals_url, {'rental_date_max': rental_date_max, 'status': 'returned'})
+    assert [rental['uuid'] for rental in response.json()['results']] == rental_uuids[:0:-1]
+    pages = get_all_pages(client, rentals_url, {'order_by': '-rental_date', 'pagination': 'cursor', 'page_size': 3})
+    assert [rental['uuid'] for page in pages for rental in page] == \
+        [rental_uuids[0], rental_uuids[1], active_uuid, rental_uuids[2]]
+
+    # the active rentals and the rentals rented after the horizon are only read from the rentals
+    for params, uuids in (({'status': 'active'}, [active_uuid]),
+                          ({'rental_date_min': (timezone.now() - timedelta(days=30)).isoformat()}, rental_uuids[:1])):
+        with CaptureQueriesContext(connection) as context:
+            response = client.get(rentals_url, params)
+        assert [rental['uuid'] for rental in response.json()['results']] == uuids
+        assert not any('movie_store_rentalhistory' in query['sql'] or 'movie_store_archivedrental' in query['sql']
+                       for query in context.captured_queries)
+
+    # the history is serialized like the rentals (with the fee of the active rentals), and exported too
+    response = client.get(rentals_url)
+    assert [rental.get('fee') for rental in response.json()['results']] == \
+        [None, calculate_charge(Rental.objects.get(uuid=active_uuid)), None, None]
+    client.post(auth_url, data.admin_credentials, **request_args)
+    response = client.get(rentals_export_url, {'user': data.user1_uuid})
+    assert len(b''.join(response.streaming_content).splitlines()) == 4
+
+
+def test_list_archived_rentals__admin(client, settings):
+    user1_rental_uuids = archive_user_rentals(client, data.user1_credentials, (400, 800))
+    user2_rental_uuids = archive_user_rentals(client, data.user2_credentials, (600,))
+
+    # the admins list the archived rentals of all the users
+    client.post(auth_url, data.admin_credentials, **request_args)
+    response = client.get(rentals_url, {'archived': 'true', 'order_by': 'rental_date'})
+    assert [rental['uuid'] for rental in response.json()['results']] == \
+        [user1_rental_uuids[1], user2_rental_uuids[0], user1_rental_uuids[0]]
+    pages = get_all_pages(client, rentals_url, {'archived': 'true', 'pagination': 'cursor', 'page_size': 2})
+    assert [rental['uuid'] for page in pages for rental in page] == \
+        [rental['uuid'] for rental in response.json()['results']]
+    assert client.get(rental_url.format(rental_uuid=user2_rental_uuids[0])).status_code == 200
+
+    # the archived rentals are serialized like the rentals
+    compiled_response, serializer_response = get_compiled_and_serializer_responses(
+        client, settings, rentals_url, {'archived': 'true'})
+    assert compiled_response.json() == serializer_response.json()
+    assert set(compiled_response.json()['results'][0]) == \
+        {'url', 'uuid', 'user', 'movie', 'rental_date', 'return_date', 'returned', 'payment'}
+
+    # the export has the archived rentals too
+    response = client.get(rentals_export_url, {'archived': 'true'})
+    assert len(b''.join(response.streaming_content).splitlines()) == 3
+
+
+def test_list_archived_rentals_partitions__admin(client):
+    if connection.vendor != 'postgresql':
+        pytest.skip('The archived rentals are partitioned on postgres only')
+    archive_user_rentals(client, data.user1_credentials, (400, 800, 1200))
+
+    # a rental date filter only reads the partitions of its years
+    client.post(auth_url, data.admin_credentials, **request_args)
+    rental_date_min = timezone.now() - timedelta(days=450)
+    plan = ArchivedRental.objects.filter(rental_date__gte=rental_date_min).explain()
+    partitions = set(re.findall(r'movie_store_archivedrental_\d{4}', plan))
+    assert partitions and all(int(name[-4:]) >= rental_date_min.year for name in partitions)
+    assert ArchivedRental.objects.filter(rental_date__year__lt=rental_date_min.year).exists()
+    response = client.get(rentals_url, {'archived': 'true', 'rental_date_min': rental_date_min.isoformat()})
+    assert len(response.json()['results']) == 1
+
+
+def test_rentals_query_budget__admin(client, settings, django_assert_max_num_queries):
+    # the serializer is used, not the compiled read serializer of the list
+    settings.MOVIE_STORE_COMPILED_READ = False
+    for credentials in (data.user1_credentials, data.user2_credentials, data.admin_credentials):
+        client.post(auth_url, credentials, **request_args)
+        for movie in get_random_movies(number_of_movies=5):
+            with django_assert_max_num_queries(rentals_query_budget['create']):
+                response = client.post(rentals_url, {'movie': str(movie.uuid)}, **request_args)
+            assert response.status_code == 201
+
+    with django_assert_max_num_queries(rentals_query_budget['list']):
+        response = client.get(rentals_url, {'page_size': 100})
+    assert len(response.json()['results']) == 15
+    assert all(rental['movie']['genres'] for rental in response.json()['results'])
+
+    first_rental_url = response.json()['results'][0]['url']
+    with django_assert_max_num_queries(rentals_query_budget['retrieve']):
+        assert client.get(first_rental_url).status_code == 200
+    with django_assert_max_num_queries(rentals_query_budget['partial_update']):
+        response = client.patch(first_rental_url, {'returned': True}, **request_args)
+    assert response.status_code == 200
+
+
+# the requests run in threads, with their own database connections, so the data is committed (and flushed at the end)
+@pytest.mark.django_db(transaction=True)
+def test_create_rental_concurrently__user():
+    movie = get_random_movies(number_of_movies=1)[0]
+    number_of_requests = 8
+    barrier = Barrier(number_of_requests)
+
+    def create_rental():
+        try:
+            client = Client()
+            client.post(auth_url, data.user1_credentials, **request_args)
+            barrier.wait()
+            return client.post(rentals_url, {'movie': str(movie.uuid)}, **request_args).status_code
+        finally:
+            connection.close()
+
+    with ThreadPoolExecutor(max_workers=number_of_requests) as executor:
+        status_codes = list(executor.map(lambda _: create_rental(), range(number_of_requests)))
+
+    # only one of the concurrent rentals of the same movie is created
+    assert sorted(status_codes) == [201] + [400] * (number_of_requests - 1)
+    assert Rental.objects.filter(movie=movie, returned=False).count() == 1
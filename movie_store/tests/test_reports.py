@@ -0,0 +1,119 @@
+from datetime import date, timedelta
+import pytest
+from django.utils import timezone
+from common.tests import data
+from movie_store.models import DailyRevenue, Genre, Rental
+from .utils import get_random_movies
+
+auth_url = '/iam/auth/'
+rentals_url = '/store/rentals/'
+revenue_report_url = '/store/reports/revenue/'
+
+# post/patch default arguments
+request_args = {'content_type': 'application/json'}
+
+# mark all tests as needing database access
+pytestmark = pytest.mark.django_db
+
+
+# reports tests
+def test_revenue_report__unauthenticated(client):
+    response = client.get(revenue_report_url)
+    assert response.status_code == 401
+
+
+def test_revenue_report__user(client):
+    client.post(auth_url, data.user1_credentials, **request_args)
+    response = client.get(revenue_report_url)
+    assert response.status_code == 403
+
+
+def test_revenue_report__admin(client):
+    # rent movies with user 1, rented some days ago, and return them
+    client.post(auth_url, data.user1_credentials, **request_args)
+    movies = get_random_movies(number_of_movies=3)
+    for days, movie in zip((1, 5, 10), movies):
+        rental_response = client.post(rentals_url, {'movie': str(movie.uuid)}, **request_args)
+        Rental.objects.filter(uuid=rental_response.json()['uuid'])\
+            .update(rental_date=timezone.now() - timedelta(days=days, minutes=1))
+        client.patch(rental_response.json()['url'], {'returned': True}, **request_args)
+
+    # the returns of today are in the report
+    client.post(auth_url, data.admin_credentials, **request_args)
+    today = timezone.localdate()
+    response = client.get(revenue_report_url)
+    assert response.status_code == 200
+    assert response.json() == {'group_by': 'day',
+                               'results': [{'day': str(today), 'returns': 3, 'revenue': 2.0 + 4.5 + 7.0}]}
+
+    # add the revenue of older days
+    DailyRevenue.objects.bulk_create([DailyRevenue(day=date(2020, 1, 1), movie=movies[0], returns=2, revenue=5.0),
+                                      DailyRevenue(day=date(2020, 1, 31), movie=movies[1], returns=1, revenue=1.0),
+                                      DailyRevenue(day=date(2020, 2, 1), movie=movies[0], returns=1, revenue=2.5)])
+    response = client.get(revenue_report_url, {'group_by': 'month', 'date_max': '2020-12-31'})
+    assert response.json()['results'] == [{'month': '2020-01', 'returns': 3, 'revenue': 6.0},
+                                           {'month': '2020-02', 'returns': 1, 'revenue': 2.5}]
+    response = client.get(revenue_report_url, {'date_min': '2020-01-02', 'date_max': '2020-02-01'})
+    assert [row['day'] for row in response.json()['results']] == ['2020-01-31', '2020-02-01']
+
+    # per movie and per genre, the highest revenue first
+    response = client.get(revenue_report_url, {'group_by': 'movie'})
+    assert response.json()['results'] == [
+        {'uuid': str(movies[0].uuid), 'title': movies[0].title, 'returns': 4, 'revenue': 2.0 + 5.0 + 2.5},
+        {'uuid': str(movies[2].uuid), 'title': movies[2].title, 'returns': 1, 'revenue': 7.0},
+        {'uuid': str(movies[1].uuid), 'title': movies[1].title, 'returns': 2, 'revenue': 4.5 + 1.0},
+    ]
+    response = client.get(revenue_report_url, {'group_by': 'movie', 'limit': 1})
+    assert len(response.json()['results']) == 1
+    response = client.get(revenue_report_url, {'group_by': 'genre'})
+    genre_revenue = {genre.name: sum(row.revenue for row in DailyRevenue.objects.filter(movie__genres=genre))
+                     for genre in Genre.objects.filter(movie__in=movies).distinct()}
+    assert {row['genre']: row['revenue'] for row in response.json()['results']} == pytest.approx(genre_revenue)
+    assert [row['revenue'] for row in response.json()['results']] == \
+        sorted(genre_revenue.values(), reverse=True)
+
+    # invalid parameters
+    for params in ({'group_by': 'user'}, {'date_min': 'yesterday'}, {'limit': 0}):
+        response = client.get(revenue_report_url, params)
+        assert response.status_code == 400
+
+
+def test_revenue_report_delete_rental__admin(client):
+    # return two rentals of a movie, and delete one of them
+    client.post(auth_url, data.admin_credentials, **request_args)
+    movie = get_random_movies(number_of_movies=1)[0]
+    rental_urls = []
+    for days in (1, 5):
+        rental_response = client.post(rentals_url, {'movie': str(movie.uuid)}, **request_args)
+        Rental.objects.filter(uuid=rental_response.json()['uuid'])\
+            .update(rental_date=timezone.now() - timedelta(days=days, minutes=1))
+        client.patch(rental_response.json()['url'], {'returned': True}, **request_args)
+        rental_urls.append(rental_response.json()['url'])
+    response = client.get(revenue_report_url)
+    assert response.json()['results'][0]['returns'] == 2 and response.json()['results'][0]['revenue'] == 2.0 + 4.5
+
+    # the revenue of the deleted rentals is subtracted
+    assert client.delete(rental_urls[1]).status_code == 204
+    response = client.get(revenue_report_url)
+    assert response.json()['results'][0]['returns'] == 1 and response.json()['results'][0]['revenue'] == 2.0
+    assert client.delete(rental_urls[0]).status_code == 204
+    assert client.get(revenue_report_url).json()['results'] == []
+
+    # an active rental has no revenue to subtract
+    rental_response = client.post(rentals_url, {'movie': str(movie.uuid)}, **request_args)
+    assert client.delete(rental_response.json()['url']).status_code == 204
+    assert not DailyRevenue.objects.exists()
+
+
+def test_revenue_report_cache__admin(client):
+    client.post(auth_url, data.admin_credentials, **request_args)
+    response = client.get(revenue_report_url)
+    assert response['X-Cache'] == 'MISS' and response.json()['results'] == []
+    assert client.get(revenue_report_url)['X-Cache'] == 'HIT'
+
+    # a return invalidates the cached reports
+    movie = get_random_movies(number_of_movies=1)[0]
+    rental_response = client.post(rentals_url, {'movie': str(movie.uuid)}, **request_args)
+    client.patch(rental_response.json()['url'], {'returned': True}, **request_args)
+    response = client.get(revenue_report_url)
+    assert response['X-Cache'] == 'MISS' and response.json()['results'][0]['returns'] == 1
@@ -1,26 +1,53 @@
+from collections import defaultdict
+from contextlib import contextmanager
+from itertools import islice
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import Coalesce
+from django.http import Http404
+from django.utils import timezone
 from rest_framework import status
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.response import Response
-from rest_framework.viewsets import ModelViewSet
+from rest_framework.viewsets import GenericViewSet, ModelViewSet
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.filters import SearchFilter, OrderingFilter
 from rest_framework.decorators import action
+from rest_framework.settings import api_settings
 from drf_spectacular.utils import extend_schema
+from common.cache import bump_model_version_on_commit
+from common.mixins import CachedResponseMixin, ConditionalGetMixin, StreamingExportMixin, CompiledReadMixin
 from common.paginations import MovieStorePagination
-from .models import Genre, Movie, Rental
-from .serializers import GenreSerializer, MovieSerializer, \
-    CreateRentalSerializer, UpdateRentalSerializer, RentalSerializer
+from common.permissions import IsSuperuser
+from common.serializers import SparseFieldset
+from .models import ArchivedRental, DailyRevenue, Genre, Movie, Rental, RentalHistory
+from .serializers import GenreSerializer, MovieSerializer, BulkCreateMovieSerializer, BulkUpdateMovieSerializer, \
+    BulkDeleteMovieSerializer, CreateRentalSerializer, UpdateRentalSerializer, BulkReturnRentalSerializer, \
+    RentalSerializer, ArchivedRentalSerializer, RentalHistorySerializer, RevenueReportSerializer
 from .permissions import GenrePermissions, MoviePermissions, RentalPermissions
-from .filters import YearFilter, GenreFilter, DirectorFilter, UserFilter, MovieFilter, StatusFilter
+from .filters import YearFilter, GenreFilter, DirectorFilter, UserFilter, MovieFilter, StatusFilter, \
+    RentalDateFilter, FeeFilter, MovieSearchFilter, parse_date_or_datetime
+from .archive import get_archive_horizon
+from .bulk import save_movies, patch_movies, delete_movies
+from .genres import genre_resolver
+from .corentals import add_rental, get_also_rented
+from .popularity import increment_popularity
+from .logic import fee_expression, return_rentals
+from .reports import get_revenue_report, remove_return
 from . import api_schema
 
 
-class GenreViewSet(ModelViewSet):
+class GenreViewSet(ConditionalGetMixin, CachedResponseMixin, CompiledReadMixin, ModelViewSet):
     queryset = Genre.objects.all()
     permission_classes = (IsAuthenticated, GenrePermissions)
     pagination_class = MovieStorePagination
+    pagination_count_mode = 'cached'
     serializer_class = GenreSerializer
     http_method_names = ('get', 'post', 'patch', 'delete')
     lookup_field = 'uuid'
+    response_cache_name = 'genres'
+    response_cache_models = (Genre,)
 
     # filtering and ordering
     filter_backends = [SearchFilter, OrderingFilter]
@@ -54,27 +81,121 @@ class GenreViewSet(ModelViewSet):
         return super().destroy(request, *args, **kwargs)
 
 
-class MovieViewSet(ModelViewSet):
+class MovieViewSet(ConditionalGetMixin, CachedResponseMixin, StreamingExportMixin, CompiledReadMixin,
+                   ModelViewSet):
     queryset = Movie.objects.all()
     permission_classes = (IsAuthenticated, MoviePermissions,)
     pagination_class = MovieStorePagination
+    pagination_count_mode = 'cached'
     serializer_class = MovieSerializer
     http_method_names = ('get', 'post', 'patch', 'delete')
     lookup_field = 'uuid'
+    # the library is not cached (and not conditional), since it is different for every user
+    response_cache_name = 'movies'
+    response_cache_models = (Movie, Genre, Movie.genres.through)
+    response_cache_actions = ('list', 'retrieve', 'facets')
 
     # filtering and ordering
-    filter_backends = [SearchFilter, OrderingFilter, YearFilter, GenreFilter, DirectorFilter]
-    search_fields = ['title']
-    ordering_fields = ['title', 'year']
+    # the search filter follows the ordering filter, since it orders the results by relevance
+    filter_backends = [OrderingFilter, MovieSearchFilter, YearFilter, GenreFilter, DirectorFilter]
+    search_fields = ['title', 'director', 'summary']
+    ordering_fields = ['title', 'year', 'popularity']
     ordering = ['title']
 
+    # export
+    export_fields = (('uuid', 'uuid'), ('title', 'title'), ('year', 'year'), ('director', 'director'),
+                     ('summary', 'summary'))
+    export_filename = 'movies'
+
+    # facets
+    facets_director_limit = 100
+
+    # customers also rented
+    also_rented_limit = 10
+    also_rented_max_limit = 50
+
     def get_queryset(self):
-        queryset = Movie.objects.all()
+        """
+        Gets the movies.
+        The genres are prefetched, so that serializing a page of movies runs a fixed number of queries
+        regardless of the page size, and the summary is loaded, only if they are requested (see SparseFieldset).
+        The search vector is never loaded. Filtering is applied by the list/retrieve actions (see filter_queryset).
+        """
+        fieldset = SparseFieldset(self.request)
+        queryset = Movie.objects.defer('search_vector')
+        if fieldset.includes('genres'):
+            queryset = queryset.prefetch_related('genres')
+        if not fieldset.includes('summary'):
+            queryset = queryset.defer('summary')
         if self.action == 'get_user_library':
-            user_active_rentals = self.request.user.rentals.filter(return_date=None)
-            active_rentals_movies_ids = [rental.movie.id for rental in user_active_rentals]
-            return queryset.filter(id__in=active_rentals_movies_ids)
-        return self.filter_queryset(queryset)
+            # subquery on the user's active rentals, backed by the (user, returned, movie) rentals index
+            user_active_rentals = Rental.objects.filter(user=self.request.user, returned=False)
+            return queryset.filter(id__in=user_active_rentals.values('movie_id'))
+        return queryset
+
+    def is_ordered_by_popularity(self, request):
+        ordering = request.query_params.get(api_settings.ORDERING_PARAM, '')
+        return 'popularity' in [field.strip().lstrip('-') for field in ordering.split(',')]
+
+    def response_is_cacheable(self, request):
+        # the popularity changes on every rental, without a new version of the movies (see popularity)
+        return super().response_is_cacheable(request) and not self.is_ordered_by_popularity(request)
+
+    def supports_conditional_get(self, request):
+        # the popularity changes on every rental, without a new modification time of the movies
+        return super().supports_conditional_get(request) and not self.is_ordered_by_popularity(request)
+
+    def get_export_columns(self):
+        return super().get_export_columns() + ['genres']
+
+    def get_export_rows(self, queryset):
+        """
+        Reads the movies in chunks, adding the genre names of every chunk with one query
+        (prefetch_related does not work with iterator()).
+        """
+        columns = super().get_export_columns()
+        movies = queryset.values_list('id', *[field for _, field in self.export_fields])\
+            .iterator(chunk_size=self.export_chunk_size)
+        for chunk in iter(lambda: list(islice(movies, self.export_chunk_size)), []):
+            movie_genres = defaultdict(list)
+            genre_names = Movie.genres.through.objects.filter(movie_id__in=[movie[0] for movie in chunk])\
+                .order_by('genre__name').values_list('movie_id', 'genre__name')
+            for movie_id, genre_name in genre_names:
+                movie_genres[movie_id].append(genre_name)
+            for movie_id, *values in chunk:
+                yield dict(zip(columns, values), genres=movie_genres[movie_id])
+
+    def get_facets(self, queryset):
+        """
+        Counts the movies of a queryset per genre, year, decade and director, with three grouped queries
+        (the decades are summed from the years). Only the directors with the most movies are counted.
+        """
+        movies = queryset.prefetch_related(None).order_by()
+        years = list(movies.values(value=F('year')).annotate(count=Count('id')).order_by('value'))
+        decades = defaultdict(int)
+        for year in years:
+            decades[year['value'] - year['value'] % 10] += year['count']
+        genres = Movie.genres.through.objects.filter(movie_id__in=movies.values('id'))\
+            .values(value=F('genre__name')).annotate(count=Count('movie_id')).order_by('-count', 'value')
+        directors = movies.values(value=F('director')).annotate(count=Count('id'))\
+            .order_by('-count', 'value')[:self.facets_director_limit]
+        return {
+            'count': sum(year['count'] for year in years),
+            'genres': list(genres),
+            'years': years,
+            'decades': [{'value': decade, 'count': count} for decade, count in sorted(decades.items())],
+            'directors': list(directors),
+        }
+
+    def get_facets_response(self, request, *args, **kwargs):
+        return Response(self.get_facets(self.filter_queryset(self.get_queryset())))
+
+    def get_serializer_class(self):
+        return {
+            'bulk_create': BulkCreateMovieSerializer,
+            'bulk_partial_update': BulkUpdateMovieSerializer,
+            'bulk_destroy': BulkDeleteMovieSerializer,
+        }.get(self.action, super().get_serializer_class())
 
     @extend_schema(**api_schema.list_movies)
     def list(self, request, *args, **kwargs):
@@ -108,37 +229,200 @@ class MovieViewSet(ModelViewSet):
         # call list with the library queryset
         return self.list(request, *args, **kwargs)
 
+    @extend_schema(**api_schema.movie_facets)
+    @action(methods=['get'], detail=False, url_path='facets', url_name='facets')
+    def facets(self, request, *args, **kwargs):
+        """Counts the (filtered) movies per genre, year, decade and director (cached per filters)."""
+        return self.get_cached_response(self.get_facets_response, request, *args, **kwargs)
+
+    @extend_schema(**api_schema.also_rented)
+    @action(methods=['get'], detail=True, url_path='also-rented', url_name='also-rented')
+    def also_rented(self, request, *args, **kwargs):
+        """Lists the movies rented the most by the users who have rented this movie (customers also rented)."""
+        try:
+            limit = int(request.query_params.get('limit', self.also_rented_limit))
+        except ValueError:
+            limit = self.also_rented_limit
+        limit = min(limit, self.also_rented_max_limit) if limit > 0 else self.also_rented_limit
+        try:
+            co_rentals = list(get_also_rented(kwargs[self.lookup_field], limit))
+            # a movie without co-rentals is checked for existence
+            if not co_rentals and not Movie.objects.filter(uuid=kwargs[self.lookup_field]).exists():
+                raise NotFound()
+        except DjangoValidationError:
+            raise NotFound()
+        movies = self.get_serializer([co_rental.other_movie for co_rental in co_rentals], many=True).data
+        return Response([{'movie': movie, 'count': co_rental.count} for movie, co_rental in zip(movies, co_rentals)])
+
+    @extend_schema(**api_schema.export_movies)
+    @action(methods=['get'], detail=False, url_path='export', url_name='export')
+    def export(self, request, *args, **kwargs):
+        """Exports all the (filtered) movies as a streamed NDJSON or CSV file."""
+        return self.get_export_response(request)
+
+    # bulk actions, each one validates the whole list (reporting the errors per item) and writes it with
+    # batched queries in one transaction
+
+    @extend_schema(**api_schema.bulk_create_movies)
+    @action(methods=['post'], detail=False, url_path='bulk', url_name='bulk')
+    def bulk_create(self, request, *args, **kwargs):
+        """Creates a list of movies."""
+        serializer = self.get_serializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        with self.genre_write(serializer):
+            created_movies, _ = save_movies(serializer.validated_data, serializer.genre_map)
+        return Response({'count': len(created_movies), 'uuids': [movie.uuid for movie in created_movies]},
+                        status=status.HTTP_201_CREATED)
+
+    @extend_schema(**api_schema.bulk_partial_update_movies)
+    @bulk_create.mapping.patch
+    def bulk_partial_update(self, request, *args, **kwargs):
+        """Updates the data of a list of movies, selected by uuid."""
+        serializer = self.get_serializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        with self.genre_write(serializer):
+            patch_movies(serializer.get_movies(), serializer.validated_data, serializer.genre_map)
+        return Response({'count': len(serializer.validated_data)}, status=status.HTTP_200_OK)
+
+    @extend_schema(**api_schema.bulk_destroy_movies)
+    @bulk_create.mapping.delete
+    @transaction.atomic
+    def bulk_destroy(self, request, *args, **kwargs):
+        """Deletes a list of movies, selected by uuid."""
+        serializer = self.get_serializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        delete_movies(serializer.get_movies())
+        return Response({'count': len(serializer.validated_data)}, status=status.HTTP_200_OK)
+
+    def perform_create(self, serializer):
+        with self.genre_write(serializer):
+            serializer.save()
+
+    def perform_update(self, serializer):
+        with self.genre_write(serializer):
+            serializer.save()
 
-class RentalViewSet(ModelViewSet):
+    @contextmanager
+    def genre_write(self, serializer):
+        """
+        Writes movies with their genre links in a transaction. The genres are resolved by the genre cache of the
+        process (see genres.GenreResolver), which can still resolve a genre that another process has just deleted:
+        the foreign key of its links then fails (when the transaction is committed), and the deleted genres are
+        reported like the unknown genres (a validation error) instead of a server error.
+        """
+        try:
+            with transaction.atomic():
+                yield
+        except IntegrityError:
+            genre_resolver.clear()
+            errors = serializer.get_deleted_genre_errors()
+            if not errors:
+                raise
+            raise ValidationError(errors)
+
+
+class RentalViewSet(StreamingExportMixin, CompiledReadMixin, ModelViewSet):
     queryset = Rental.objects.all()
     permission_classes = (IsAuthenticated, RentalPermissions)
     pagination_class = MovieStorePagination
+    pagination_count_mode = 'estimated'
     serializer_class = RentalSerializer
     http_method_names = ('get', 'post', 'patch', 'delete')
     lookup_field = 'uuid'
 
     # filtering and ordering
-    filter_backends = [SearchFilter, OrderingFilter, UserFilter, MovieFilter, StatusFilter]
+    filter_backends = [SearchFilter, OrderingFilter, UserFilter, MovieFilter, StatusFilter, RentalDateFilter,
+                       FeeFilter]
     search_fields = ['movie__title']
-    ordering_fields = ['movie__title', 'movie__year', 'rental_date', 'return_date', 'payment']
+    ordering_fields = ['movie__title', 'movie__year', 'rental_date', 'return_date', 'payment', 'fee']
     ordering = ['rental_date']
 
+    # the list and the export read the rentals, the archived rentals (see movie_store.archive) or both of them,
+    # depending on their filters (see get_rental_model), and a rental is retrieved from the archived rentals when
+    # it is not found in the rentals
+    archive_query_param = 'archived'
+    archive_actions = ('list', 'export')
+    rental_model = Rental
+    rental_serializers = {Rental: RentalSerializer, ArchivedRental: ArchivedRentalSerializer,
+                          RentalHistory: RentalHistorySerializer}
+
+    # export
+    export_fields = (('uuid', 'uuid'), ('user', 'user__email'), ('movie', 'movie__uuid'),
+                     ('movie_title', 'movie__title'), ('rental_date', 'rental_date'), ('return_date', 'return_date'),
+                     ('returned', 'returned'), ('payment', 'payment'))
+    export_filename = 'rentals'
+
     def get_queryset(self):
         """
         Gets the rentals.
         If the user has elevated permissions (staff or superuser), returns all rentals.
         If the user does not have elevated permissions, returns only his own rentals.
+        The user and the movie are selected and the genres of the movie are prefetched, only if they are
+        requested (see SparseFieldset), so that serializing any number of rentals runs a fixed number of queries.
+        The rentals are annotated with their current fee, which is computed by the database.
+        The archived rentals, or both the rentals and the archived rentals, are read instead of the rentals by the
+        list and the export, depending on their filters (see get_rental_model), and by retrieve (see get_object).
         """
-        queryset = Rental.objects.all()
+        fieldset = SparseFieldset(self.request)
+        queryset = self.rental_model.objects.annotate(fee=fee_expression(timezone.now()))
+        if self.rental_model is ArchivedRental and self.request.query_params.get('status') == 'active':
+            # the archived rentals are all returned
+            return queryset.none()
+        if fieldset.includes('user'):
+            queryset = queryset.select_related('user')
+        if fieldset.includes('movie'):
+            queryset = queryset.select_related('movie').defer('movie__search_vector')\
+                .prefetch_related('movie__genres')
         if not (self.request.user.is_staff or self.request.user.is_superuser):
             queryset = queryset.filter(user=self.request.user)
         return self.filter_queryset(queryset)
 
+    def get_export_queryset(self):
+        # the rentals queryset is already filtered
+        return self.get_queryset().prefetch_related(None)
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self.rental_model = self.get_rental_model(request)
+
+    def get_rental_model(self, request):
+        """
+        Gets the model of the rentals of the list and the export:
+        - the archived rentals with ?archived=true,
+        - the rentals when the filters exclude the archived rentals, which are returned and rented before the archive
+          horizon (the active rentals, or a rental_date_min after the horizon),
+        - the rental history (the rentals and the archived rentals) otherwise.
+        """
+        if self.action not in self.archive_actions:
+            return Rental
+        query_params = request.query_params
+        if query_params.get(self.archive_query_param, '').lower() in ('true', '1'):
+            return ArchivedRental
+        if query_params.get('status') == 'active':
+            return Rental
+        try:
+            if parse_date_or_datetime(query_params.get('rental_date_min', '')) >= get_archive_horizon():
+                return Rental
+        except ValueError:
+            pass
+        return RentalHistory
+
+    def get_object(self):
+        """Gets a rental, or an archived rental for retrieve, so that the archived rentals keep their urls"""
+        try:
+            return super().get_object()
+        except Http404:
+            if self.action != 'retrieve' or self.rental_model is not Rental:
+                raise
+        self.rental_model = ArchivedRental
+        return super().get_object()
+
     def get_serializer_class(self):
         return {
             'create': CreateRentalSerializer,
-            'partial_update': UpdateRentalSerializer
-        }.get(self.action, super().get_serializer_class())
+            'partial_update': UpdateRentalSerializer,
+            'bulk_return': BulkReturnRentalSerializer,
+        }.get(self.action, self.rental_serializers[self.rental_model])
 
     def get_response_serializer_class(self):
         return self.serializer_class
@@ -161,10 +445,16 @@ class RentalViewSet(ModelViewSet):
     @extend_schema(**api_schema.create_rental)
     def create(self, request, *args, **kwargs):
         """Creates a new rental for the user who sends the request."""
-        rental_data = dict(request.data, user=request.user.email)
-        serializer = self.get_serializer(data=rental_data)
+        serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        rental = self.perform_create(serializer)
+        try:
+            rental = self.perform_create(serializer)
+        except IntegrityError:
+            # the active rentals are unique per user and movie
+            movie = serializer.validated_data['movie']
+            if not Rental.objects.filter(user=request.user, movie=movie, returned=False).exists():
+                raise
+            raise ValidationError({api_settings.NON_FIELD_ERRORS_KEY: ['This movie is already rented.']})
         response_serializer = self.get_response_serializer(instance=rental)
         return Response(response_serializer.data, status=status.HTTP_201_CREATED)
 
@@ -187,8 +477,66 @@ class RentalViewSet(ModelViewSet):
         """Deletes a rental."""
         return super().destroy(request, *args, **kwargs)
 
+    @extend_schema(**api_schema.bulk_return_rentals)
+    @action(methods=['post'], detail=False, url_path='bulk-return', url_name='bulk-return')
+    def bulk_return(self, request, *args, **kwargs):
+        """Returns a list of rentals, selected by uuid, with one update (the returned rentals are skipped)."""
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        count = return_rentals(Rental.objects.filter(uuid__in=serializer.validated_data['uuids']))
+        return Response({'count': count}, status=status.HTTP_200_OK)
+
+    @extend_schema(**api_schema.rental_balance)
+    @action(methods=['get'], detail=False, url_path='balance', url_name='balance')
+    def balance(self, request, *args, **kwargs):
+        """
+        Gets the outstanding balance (the sum of the current fees of the active rentals) of the user who sends the
+        request, with one aggregate query. The admins get the balance of the user of the user filter, or of all users.
+        """
+        totals = self.get_queryset().filter(returned=False).order_by()\
+            .aggregate(active_rentals=Count('pk'), balance=Coalesce(Sum('fee'), 0.0))
+        return Response(totals, status=status.HTTP_200_OK)
+
+    @extend_schema(**api_schema.export_rentals)
+    @action(methods=['get'], detail=False, url_path='export', url_name='export')
+    def export(self, request, *args, **kwargs):
+        """Exports all the (filtered) rentals as a streamed NDJSON or CSV file."""
+        return self.get_export_response(request)
+
+    @transaction.atomic
     def perform_create(self, serializer):
-        return serializer.save()
+        rental = serializer.save(user=self.request.user)
+        add_rental(rental)
+        increment_popularity(rental)
+        return rental
 
     def perform_update(self, serializer):
         return serializer.save()
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            super().perform_destroy(instance)
+            remove_return(instance)
+        # the rentals have no delete receiver, they are deleted in bulk (see MovieStoreConfig.ready)
+        bump_model_version_on_commit(Rental)
+
+
+class ReportViewSet(CachedResponseMixin, GenericViewSet):
+    queryset = DailyRevenue.objects.none()
+    permission_classes = (IsAuthenticated, IsSuperuser)
+    serializer_class = RevenueReportSerializer
+    response_cache_name = 'reports'
+    response_cache_models = (DailyRevenue, Movie, Genre, Movie.genres.through)
+    response_cache_actions = ('revenue',)
+
+    @extend_schema(**api_schema.revenue_report)
+    @action(methods=['get'], detail=False, url_path='revenue', url_name='revenue')
+    def revenue(self, request, *args, **kwargs):
+        """Reports the returns and the revenue per day, month, movie or genre, from the daily revenue rollups."""
+        return self.get_cached_response(self.get_revenue_response, request, *args, **kwargs)
+
+    def get_revenue_response(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        report = get_revenue_report(**serializer.validated_data)
+        return Response({'group_by': serializer.validated_data['group_by'], 'results': report})
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/3.1/ref/settings/
 """
 
 from os import getenv
+from importlib.util import find_spec
 from pathlib import Path
 from datetime import timedelta
 
@@ -67,6 +68,28 @@ REST_FRAMEWORK = {
     ),
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
     'EXCEPTION_HANDLER': 'common.views.custom_exception_handler',
+    'DEFAULT_RENDERER_CLASSES': [
+        'common.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'common.parsers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
+}
+
+# MessagePack is available to the clients only when the optional msgpack package is installed
+if find_spec('msgpack') is not None:
+    REST_FRAMEWORK['DEFAULT_RENDERER_CLASSES'].append('common.renderers.MessagePackRenderer')
+    REST_FRAMEWORK['DEFAULT_PARSER_CLASSES'].append('common.parsers.MessagePackParser')
+
+# Pagination counts (see common.paginations.CountingPaginator)
+# The views can override the count mode with their pagination_count_mode attribute
+MOVIE_STORE_PAGINATION = {
+    'COUNT_MODE': 'exact',
+    'COUNT_CACHE_TIMEOUT': 300,
+    'COUNT_ESTIMATE_THRESHOLD': 100000,
 }
 
 ROOT_URLCONF = 'movie_store_api.urls'
@@ -105,6 +128,36 @@ DATABASES = {
     }
 }
 
+# Cache
+# The local memory cache is per process, the file based cache (django.core.cache.backends.filebased.FileBasedCache
+# with a LOCATION directory) can be shared by all the processes of a deployment
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# Response cache of the genres and movies (see common.mixins.CachedResponseMixin)
+MOVIE_STORE_RESPONSE_CACHE = {
+    'TIMEOUT': 300,
+}
+
+# In-process cache of the genres (see movie_store.genres), checked against the database at most every
+# CHECK_INTERVAL seconds
+MOVIE_STORE_GENRE_CACHE = {
+    'CHECK_INTERVAL': 5,
+}
+
+# Serialize the lists from values() rows, with the compiled read serializers (see common.mixins.CompiledReadMixin)
+MOVIE_STORE_COMPILED_READ = True
+
+# Archive of the returned rentals rented before the horizon (see movie_store.archive), which should be longer than
+# the popularity windows (30 days), since the popularity is computed from the rentals
+MOVIE_STORE_RENTAL_ARCHIVE = {
+    'HORIZON_DAYS': 365,
+    'BATCH_SIZE': 10000,
+}
+
 AUTH_USER_MODEL = "iam.CustomUser"
 
 
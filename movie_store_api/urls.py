@@ -17,6 +17,7 @@ from django.conf.urls import include
 from django.contrib import admin
 from django.urls import path
 from drf_spectacular.views import SpectacularAPIView, SpectacularRedocView, SpectacularSwaggerView
+from common.views import ResponseCacheStatsView
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -25,4 +26,5 @@ urlpatterns = [
     path('api/schema/redoc/', SpectacularRedocView.as_view(url_name='schema'), name='redoc'),
     path('iam/', include('iam.urls')),
     path('store/', include('movie_store.urls')),
+    path('stats/response-cache/', ResponseCacheStatsView.as_view(), name='response-cache-stats'),
 ]